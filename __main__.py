@@ -1,25 +1,208 @@
 """This module implements the command-line interface."""
 
+import json
 import logging
-from sys import argv
-import re
+import os
+from sys import argv, stdin
 
-from filenames import SUBTASK_B_TRAIN2016_DATASET_FNAMES as TRAIN2016_DATASET_FNAMES, \
-    SUBTASK_B_TRAIN2017_DATASET_FNAMES as TRAIN2017_DATASET_FNAMES, TEST2016_DATASET_FNAME, \
-    TEST2016_DIRNAME, TEST2017_DATASET_FNAME, TEST2017_DIRNAME, TEST_PREDICTIONS_BASE_DIRNAME, \
-    TEST2016_PREDICTIONS_DIRNAME, TEST2017_PREDICTIONS_DIRNAME, TEST2016_GOLD_BASE_FNAME, \
-    TEST2017_GOLD_BASE_FNAME, AGGREGATION_METHOD_MAP, DEV_DATASET_FNAME, DEV_GOLD_BASE_FNAME
-from evaluation import train_nonsegmented, train_segmented_aggregation, train_segmented_ml, \
-    evaluate_nonsegmented, evaluate_segmented_aggregation, evaluate_segmented_ml, \
-    produce_gold_results
-from language_model import LanguageModel
+from benchmark import compare_benchmarks, run_benchmarks
+import evaluation
+import preprocessing
+from filenames import TEST2016_DIRNAME, DEV_DATASET_FNAME, DEV_GOLD_BASE_FNAME, \
+    SUBTASK_A_TRAIN_DATASET_FNAMES, SUBTASK_B_TRAIN2016_DATASET_FNAMES, TEST2016_DATASET_FNAME, \
+    TEST2017_DATASET_FNAME, UNANNOTATED_DATASET_FNAME
+from evaluation import produce_gold_results
+from experiment import determine_filenames, run
+from halving import successive_halving
+from instrumentation import INSTRUMENTATION
+from language_model import LanguageModel, update_statistics
+from preprocessing import locate_dataset, tokenizer_mismatches
+from scoring import array_variant_mismatches
+from significance import compare_configs, SIGNIFICANCE_TESTS
+from regression import check_published_results, load_published_results, \
+    sample_published_results, REGRESSION_SAMPLE_SIZE
+from result_cache import ResultCache
+from work_queue import WorkQueue, work
 
 LOGGER = logging.getLogger(__name__)
 
+def result_cache_fingerprint(result_cache, year):
+    """Returns the fingerprint of the dataset files and the language model for a year."""
+    test_dirname, _, gold_base_fname, test_dataset_fname, train_dataset_fnames = \
+        determine_filenames(year)
+    gold_fname = os.path.normpath("%s/%s" % (test_dirname, gold_base_fname))
+    return result_cache.fingerprint(train_dataset_fnames + [test_dataset_fname, gold_fname])
+
 def main():
     """This function implements the command-line interface."""
     # Parse input configuration.
-    if argv[1] == "prepare":
+    if argv[1] in ("pending", "record", "results"):
+        # Filter configuration strings on the standard input that have no results in the result
+        # cache (pending), store comma-separated results on the standard input in the result cache
+        # (record), or print the cached results of configuration strings on the standard input
+        # (results).
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.WARNING)
+        year = argv[2]
+        assert year in ("dev", "2016", "2017")
+        result_cache = ResultCache()
+        fingerprint = result_cache_fingerprint(result_cache, year)
+        for line in stdin:
+            if argv[1] == "record":
+                config, scores = line.strip().split(',', 1)
+                result_cache.put(config, fingerprint, scores)
+                print("%s,%s" % (config, scores), flush=True)
+            else:
+                config = line.strip()
+                scores = result_cache.get(config, fingerprint)
+                if argv[1] == "pending" and scores is None:
+                    print(config, flush=True)
+                elif argv[1] == "results" and scores is not None:
+                    print("%s,%s" % (config, scores))
+        result_cache.close()
+        raise SystemExit
+    elif argv[1] == "halving":
+        # Print the configuration strings on the standard input that survive successive halving
+        # and are to be evaluated on the full datasets.
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.INFO)
+        year = argv[2]
+        assert year in ("dev", "2016", "2017")
+        configs = [line.strip() for line in stdin if line.strip()]
+        for config in successive_halving(configs, year):
+            print(config)
+        raise SystemExit
+    elif argv[1] in ("submit", "work", "collect"):
+        # Submit configuration strings on the standard input to a work queue in a directory on a
+        # shared filesystem (submit), evaluate the configurations in a work queue (work), or print
+        # the comma-separated results of a work queue and log its failed configurations (collect).
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.INFO if argv[1] == "work" else logging.WARNING)
+        queue = WorkQueue(argv[2])
+        if argv[1] == "submit":
+            year = argv[3]
+            assert year in ("dev", "2016", "2017")
+            queue.submit(year, (line.strip() for line in stdin if line.strip()))
+        elif argv[1] == "work":
+            work(queue)
+        elif argv[1] == "collect":
+            for result in queue.results():
+                print(result)
+            for failure in queue.failures():
+                config, error = failure.split(",", 1)
+                LOGGER.warning("the evaluation of %s has failed: %s", config, error)
+        raise SystemExit
+    elif argv[1] == "tokenizer":
+        # Check that the tokenizer produces the same tokens as the reference tokenizer on all
+        # SemEval 2016/2017 Task 3 datasets.
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.INFO)
+        dataset_fnames = []
+        for dataset_fname in SUBTASK_B_TRAIN2016_DATASET_FNAMES \
+                             + [DEV_DATASET_FNAME, TEST2016_DATASET_FNAME, TEST2017_DATASET_FNAME] \
+                             + SUBTASK_A_TRAIN_DATASET_FNAMES + [UNANNOTATED_DATASET_FNAME]:
+            try:
+                locate_dataset(dataset_fname)
+                dataset_fnames.append(dataset_fname)
+            except FileNotFoundError:
+                LOGGER.warning("dataset %s does not exist, skipping", dataset_fname)
+        num_mismatches = 0
+        for dataset_fname, tag, text in tokenizer_mismatches(dataset_fnames):
+            LOGGER.error("tokens of a <%s> element in %s differ: %r", tag, dataset_fname, text)
+            num_mismatches += 1
+        LOGGER.info("checked %d datasets, found %d mismatches", len(dataset_fnames),
+                    num_mismatches)
+        raise SystemExit(1 if num_mismatches else 0)
+    elif argv[1] == "scoring":
+        # Check that the array variants of the weighting functions agree with the reference
+        # weighting functions on randomly sampled inputs.
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.INFO)
+        num_mismatches = 0
+        for function_name, inputs, reference_output, output in array_variant_mismatches():
+            LOGGER.error("%s%r: %r != %r", function_name, inputs, reference_output, output)
+            num_mismatches += 1
+        LOGGER.info("found %d mismatches", num_mismatches)
+        raise SystemExit(1 if num_mismatches else 0)
+    elif argv[1] == "regression":
+        # Evaluate a sample of the configurations in the published grid search results and check
+        # that the scores match the published scores. Prints the published scores, the produced
+        # scores, and the runtime of every configuration.
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.INFO)
+        sample_size = int(argv[2]) if len(argv) > 2 else REGRESSION_SAMPLE_SIZE
+        results = load_published_results(*argv[3:4])
+        num_mismatches = 0
+        total_runtime = 0.0
+        print("config,published MAP,published AvgRec,published MRR,MAP,AvgRec,MRR,match,runtime")
+        for config, published_scores, scores, matches, runtime \
+                in check_published_results(sample_published_results(results, sample_size)):
+            print("%s,%s,%s,%s,%.3f" % (config, ",".join(published_scores), ",".join(scores),
+                                        "true" if matches else "false", runtime), flush=True)
+            num_mismatches += 0 if matches else 1
+            total_runtime += runtime
+        LOGGER.info("checked %d configurations in %.1f seconds, found %d mismatches",
+                    min(sample_size, len(results)), total_runtime, num_mismatches)
+        raise SystemExit(1 if num_mismatches else 0)
+    elif argv[1] == "significance":
+        # Test the differences in the MAP of all pairs of the first N configuration strings on
+        # the standard input, such as the lines of a results-*.csv file sorted by MAP, using
+        # paired randomization or bootstrap tests and the Benjamini-Hochberg procedure.
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.INFO)
+        year = argv[2]
+        assert year in ("dev", "2016", "2017")
+        configs = [line.strip().split(',', 1)[0] for line in stdin \
+                   if line.strip() and not line.startswith("config,")]
+        if len(argv) > 3:
+            configs = configs[:int(argv[3])]
+        test = argv[4] if len(argv) > 4 else "randomization"
+        assert test in SIGNIFICANCE_TESTS
+        print("config1,config2,MAP1,MAP2,pvalue,qvalue,significant")
+        for first_config, second_config, first_map, second_map, pvalue, qvalue, significant \
+                in compare_configs(configs, year, test=test):
+            print("%s,%s,%.4f,%.4f,%.6f,%.6f,%s" % (first_config, second_config, first_map,
+                                                    second_map, pvalue, qvalue,
+                                                    "true" if significant else "false"))
+        raise SystemExit
+    elif argv[1] == "benchmark":
+        # Benchmark the stages of the evaluation on synthetic datasets generated in a directory
+        # and store the results in a JSON file. The sizes of the datasets can be set by name=value
+        # arguments, such as num_orgquestions=100.
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.INFO)
+        dirname, output_fname = argv[2], os.path.abspath(argv[3])
+        parameters = {}
+        for argument in argv[4:]:
+            name, value = argument.split("=", 1)
+            parameters[name] = float(value) if "." in value else int(value)
+        with open(output_fname, "wt") as file:
+            json.dump(run_benchmarks(dirname, **parameters), file, indent=2, sort_keys=True)
+            file.write("\n")
+        raise SystemExit
+    elif argv[1] == "compare":
+        # Compare the results of the benchmarks stored in two JSON files.
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.WARNING)
+        with open(argv[2], "rt") as old_file, open(argv[3], "rt") as new_file:
+            old_results, new_results = json.load(old_file), json.load(new_file)
+        for name, old_time, new_time, ratio in compare_benchmarks(old_results, new_results):
+            # The times and the ratios of benchmarks without operations are missing.
+            print("%-50s %13s %13s %9s" % (name,
+                                           "n/a" if old_time is None else "%.3es" % old_time,
+                                           "n/a" if new_time is None else "%.3es" % new_time,
+                                           "n/a" if ratio is None else "%.3fx" % ratio))
+        raise SystemExit
+    elif argv[1] == "update":
+        # Add the <Thread>s of datasets to the statistics of the unannotated dataset and clear the
+        # caches of features, which depend on the statistics.
+        logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
+                            level=logging.INFO)
+        revision = update_statistics(argv[2:])
+        evaluation.clear_caches()
+        LOGGER.info("updated the statistics to revision %d", revision)
+        raise SystemExit
+    elif argv[1] == "prepare":
         logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
                             level=logging.INFO)
         # Prepare the language model.
@@ -30,92 +213,26 @@ def main():
         raise SystemExit
     else:
         logging.basicConfig(format='%(asctime)s | %(levelname)s : %(message)s',
-                            level=logging.WARNING)
-    config = argv[1].split('-')
-    method = config[0]
-    assert method in ("unsegmented", "segmented_ml", "segmented_aggregation")
+                            level=logging.INFO if "--streaming" in argv else logging.WARNING)
+        if "--streaming" in argv:
+            # Train the classifier by stochastic gradient descent over chunks of the training
+            # datasets and report its convergence.
+            argv.remove("--streaming")
+            evaluation.STREAMING_TRAINING = True
+        if "--instrument" in argv:
+            # Store the time spent in the stages of the run and counters of events in a JSON file
+            # next to the output file.
+            argv.remove("--instrument")
+            INSTRUMENTATION.enabled = True
+    config = argv[1]
     year = argv[2]
     assert year in ("dev", "2016", "2017")
-    segment_filtering_method = config[1]
-    assert segment_filtering_method in \
-        ("none", "kolczetal00_title", "kolczetal00_firstpara",
-         "kolczetal00_parawithmosttitlewords", "kolczetal00_firsttwopara",
-         "kolczetal00_firstlastpara") \
-        or re.match(r"kolczetal00_bestsentence[0-5]", segment_filtering_method)
-    segment_filtering = segment_filtering_method \
-                        if segment_filtering_method != "none" else None
-    base_term_weighting = config[2]
-    assert re.match(r"(bm25|tfidf)_", base_term_weighting)
-    extra_term_weighting_method = config[3]
-    assert extra_term_weighting_method in ("none", "godwin", "murataetal00_A",
-                                           "murataetal00_B")
-    extra_term_weighting = extra_term_weighting_method \
-                           if extra_term_weighting_method != "none" else None
-    if method == "segmented_aggregation":
-        aggregate_tier1_segments_method = config[4]
-        assert aggregate_tier1_segments_method in AGGREGATION_METHOD_MAP.keys()
-        aggregate_tier1_segments = AGGREGATION_METHOD_MAP[aggregate_tier1_segments_method]
-        aggregate_tier2_segments_method = config[5]
-        assert aggregate_tier2_segments_method in AGGREGATION_METHOD_MAP.keys()
-        aggregate_tier2_segments = AGGREGATION_METHOD_MAP[aggregate_tier2_segments_method]
-        order = config[6]
-        assert order in ("result_first", "query_first")
-        thread_first = order == "result_first"
-
-    # Determine directory and file names
-    if year == "dev":
-        test_dirname = TEST2016_DIRNAME
-        test_predictions_dirname = TEST2016_PREDICTIONS_DIRNAME
-        gold_base_fname = DEV_GOLD_BASE_FNAME
-        test_dataset_fname = DEV_DATASET_FNAME
-        train_dataset_fnames = TRAIN2016_DATASET_FNAMES
-    elif year == "2016":
-        test_dirname = TEST2016_DIRNAME
-        test_predictions_dirname = TEST2016_PREDICTIONS_DIRNAME
-        gold_base_fname = TEST2016_GOLD_BASE_FNAME
-        test_dataset_fname = TEST2016_DATASET_FNAME
-        train_dataset_fnames = TRAIN2016_DATASET_FNAMES + [DEV_DATASET_FNAME]
-    elif year == "2017":
-        test_dirname = TEST2017_DIRNAME
-        test_predictions_dirname = TEST2017_PREDICTIONS_DIRNAME
-        gold_base_fname = TEST2017_GOLD_BASE_FNAME
-        test_dataset_fname = TEST2017_DATASET_FNAME
-        train_dataset_fnames = TRAIN2017_DATASET_FNAMES + [DEV_DATASET_FNAME]
-    output_fname = "%s/subtask_B_%s-%s.txt" % (test_predictions_dirname, argv[1], argv[2])
-    base_output_fname = "%s/subtask_B_%s-%s.txt" % (TEST_PREDICTIONS_BASE_DIRNAME, argv[1], argv[2])
-    LOGGER.info("Producing %s ...", output_fname)
-
-    # Perform training
-    language_model = LanguageModel(base_term_weighting=base_term_weighting,
-                                   extra_term_weighting=extra_term_weighting)
-    if method == "segmented_ml":
-        classifier = train_segmented_ml(language_model, train_dataset_fnames,
-                                        segment_filtering=segment_filtering)
-    elif method == "segmented_aggregation":
-        classifier = train_segmented_aggregation(language_model, train_dataset_fnames,
-                                                 aggregate_tier1_segments,
-                                                 aggregate_tier2_segments,
-                                                 thread_first=thread_first,
-                                                 segment_filtering=segment_filtering)
-    elif method == "unsegmented":
-        classifier = train_nonsegmented(language_model, train_dataset_fnames,
-                                        segment_filtering=segment_filtering)
-
-    # Perform evaluation
-    if method == "segmented_ml":
-        evaluate_segmented_ml(language_model, classifier, [test_dataset_fname], output_fname,
-                              segment_filtering=segment_filtering)
-    elif method == "segmented_aggregation":
-        evaluate_segmented_aggregation(language_model, classifier,
-                                       [test_dataset_fname], output_fname,
-                                       aggregate_tier1_segments,
-                                       aggregate_tier2_segments,
-                                       thread_first=thread_first,
-                                       segment_filtering=segment_filtering)
-    elif method == "unsegmented":
-        evaluate_nonsegmented(language_model, classifier, [test_dataset_fname], output_fname,
-                              segment_filtering=segment_filtering)
-
+    if len(argv) > 3:
+        # Tokenize the datasets and featurize them using pools of processes that share the parsed
+        # datasets and the language model.
+        preprocessing.TOKENIZATION_PROCESSES = int(argv[3])
+        evaluation.FEATURIZATION_PROCESSES = int(argv[3])
+    test_dirname, gold_base_fname, base_output_fname = run(config, year)
     print("%s %s %s" % (test_dirname, gold_base_fname, base_output_fname))
 
 if __name__ == "__main__":
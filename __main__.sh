@@ -3,17 +3,8 @@ set -e
 export LC_ALL=C
 export PARALLEL_SHELL=/bin/bash
 
-python3 __main__.py prepare
-for YEAR in dev 2016 2017; do 
-  echo config,MAP,AvgRec,MRR
-  # Print the SemEval-Task3 baselines.
-  if [[ $YEAR = 2016 ]]; then
-    echo baseline_1_IR,0.7475,0.8830,83.79
-    echo baseline_2_random,0.4698,0.6792,50.96
-  elif [[ $YEAR = 2017 ]]; then
-    echo baseline_1_IR,0.4185,0.7759,46.42
-    echo baseline_2_random,0.2981,0.6265,33.02
-  fi
+configs() {
+  # Print the configurations that are evaluated in every year.
   for METHOD in {unsegmented,segmented_{ml,aggregation}}; do
     # Set up optimal pivoted document normalization slopes.
     case $METHOD in
@@ -31,7 +22,7 @@ for YEAR in dev 2016 2017; do
     esac
     for SEGMENT_FILTERING in {none,kolczetal00_{title,firstpara,parawithmosttitlewords,firsttwopara,firstlastpara,bestsentence{0..5}}}; do
       if [[ $METHOD = segmented_ml && $SEGMENT_FILTERING =~ ^kolczetal00_bestsentence ]]; then
-        continue # kolczetal00_bestsentence produces a variable number of segments, which segmented_ml cannot handle.
+        continue # kolczetal00_bestsentence produces a variable number of segments, which segmented_ml cannot handle (see segmented_ml_pooled).
       fi
       for TERM_WEIGHTING in tfidf_{nfc_nfc,nfx_nfx,bfx_nfx,lnc_ltc,dnb_s=${B_S}_dtn,dtb_s=${B_S}_nnn,nfc_lfc,nfc_dfc,Lpc_anc,Lpc_ann,dpc_ann,Lpu_s=${U_S}_Lpc,Lfb_s=${B_S}_bfc,Lpb_s=${B_S}_bfc,nnc_bfc,npc_bpn,npc_bfn}-{none,godwin,murataetal00_{A,B}} bm25_{k1=1.2_k3=1000.0_b=0.75,k1=1.2_k3=0_b=0.75,k1=2.00_k3=950_b=0,k1=2.00_k3=0_b=0.80}-none; do
         if [[ $METHOD = segmented_aggregation ]]; then
@@ -65,12 +56,60 @@ for YEAR in dev 2016 2017; do
         fi
       done
     done
-  done | parallel --halt=2 --bar -- '
-    set -e
-    RESULTS="$(python3 __main__.py {} '$YEAR')"
-    read TEST_DIRNAME GOLD_BASE_FNAME BASE_OUTPUT_FNAME < <(echo $RESULTS)
-    cd $TEST_DIRNAME
-    python2 _scorer/ev.py $GOLD_BASE_FNAME $BASE_OUTPUT_FNAME | tee $BASE_OUTPUT_FNAME.score \
-      | sed -n -r "/^ALL SCORES:/{s/^ALL SCORES:/{}/;s/\t/,/g;s/^([^,]*(,[^,]*){3,3}),.*/\1/;p}"
-  ' | tee results-${YEAR}_unsorted.csv | sort -r -t, -k 2 >results-${YEAR}.csv
+  done
+}
+
+work() {
+  # Evaluate the configurations in the work queue of a year with one worker per CPU.
+  for WORKER in $(seq $(nproc)); do
+    python3 __main__.py work "$QUEUE_DIRNAME"/$1 &
+  done
+  wait
+}
+
+if [[ $1 = --work ]]; then
+  # Help another machine that shares the filesystem evaluate the configurations in its work queues.
+  QUEUE_DIRNAME="$2"
+  for YEAR in dev 2016 2017; do
+    work $YEAR
+  done
+  exit
+fi
+
+python3 __main__.py prepare
+if [[ $1 = --queue ]]; then
+  # Submit the configurations that have no results in the result cache to work queues on a shared
+  # filesystem, so that other machines can help evaluate them.
+  QUEUE_DIRNAME="$2"
+  for YEAR in dev 2016 2017; do
+    configs | python3 __main__.py pending $YEAR | python3 __main__.py submit "$QUEUE_DIRNAME"/$YEAR $YEAR
+  done
+fi
+for YEAR in dev 2016 2017; do 
+  echo config,MAP,AvgRec,MRR
+  # Print the SemEval-Task3 baselines.
+  if [[ $YEAR = 2016 ]]; then
+    echo baseline_1_IR,0.7475,0.8830,83.79
+    echo baseline_2_random,0.4698,0.6792,50.96
+  elif [[ $YEAR = 2017 ]]; then
+    echo baseline_1_IR,0.4185,0.7759,46.42
+    echo baseline_2_random,0.2981,0.6265,33.02
+  fi
+  if [[ $1 = --queue ]]; then
+    work $YEAR
+    python3 __main__.py collect "$QUEUE_DIRNAME"/$YEAR | python3 __main__.py record $YEAR >/dev/null
+  else
+    # Evaluate only the configurations that have no results in the result cache and record every
+    # result in the result cache as soon as it is produced, so that an interrupted run can resume.
+    configs | python3 __main__.py pending $YEAR | parallel --halt=2 --bar -- '
+      set -e
+      RESULTS="$(python3 __main__.py {} '$YEAR')"
+      read TEST_DIRNAME GOLD_BASE_FNAME BASE_OUTPUT_FNAME < <(echo $RESULTS)
+      cd $TEST_DIRNAME
+      python2 _scorer/ev.py $GOLD_BASE_FNAME $BASE_OUTPUT_FNAME | tee $BASE_OUTPUT_FNAME.score \
+        | sed -n -r "/^ALL SCORES:/{s/^ALL SCORES:/{}/;s/\t/,/g;s/^([^,]*(,[^,]*){3,3}),.*/\1/;p}"
+    ' | python3 __main__.py record $YEAR >/dev/null
+  fi
+  configs | python3 __main__.py results $YEAR | tee results-${YEAR}_unsorted.csv \
+    | sort -r -t, -k 2 >results-${YEAR}.csv
 done
@@ -1,9 +1,18 @@
 """This module provides segment similarity aggregation functions."""
 
+from abc import ABC, abstractmethod
+from itertools import islice
 import logging
 
+from instrumentation import INSTRUMENTATION
+
 LOGGER = logging.getLogger(__name__)
 
+# Lists of more than AGGREGATION_BLOCK_SIZE results are aggregated in blocks of
+# AGGREGATION_BLOCK_SIZE results by the running aggregates below, so that the memory use does not
+# grow with the length of a <Thread>.
+AGGREGATION_BLOCK_SIZE = 64
+
 def harmonic_number(n, s):
     """Returns the generalized harmonic number Hn,s."""
     return sum(1 / (i**s) for i in range(1, n+1))
@@ -68,3 +77,136 @@ def aggregate_wavg_koetal04(results, language_model):
         average = sum(result[0] * (weight / sum(weights)) \
                       for result, weight in zip(results, weights))
     return [average] + results[0][1:-1]
+
+class RunningAggregate(ABC):
+    """
+        A running version of an aggregation function. Results are added in blocks and only the
+        running state of the aggregate is kept in memory. The aggregate of all added results
+        agrees with the aggregation function applied to the list of all results up to rounding
+        errors.
+    """
+    def __init__(self, language_model):
+        self.language_model = language_model
+        self.num_results = 0
+        self.first_result = None
+
+    def update(self, results):
+        """Adds a block of results. The active results are passed to add with their ranks."""
+        for result in results:
+            if result[-1].active:
+                if self.first_result is None:
+                    self.first_result = result
+                self.add(result, self.num_results)
+            self.num_results += 1
+
+    @abstractmethod
+    def add(self, result, rank):
+        """Adds an active result with a rank among all results, including the inactive ones."""
+
+    @abstractmethod
+    def result(self):
+        """Returns the aggregate of all added results."""
+
+class RunningMin(RunningAggregate):
+    """A running version of aggregate_min."""
+    def __init__(self, language_model):
+        super(RunningMin, self).__init__(language_model)
+        self.best_result = None
+
+    def add(self, result, rank):
+        if self.best_result is None or result[0] < self.best_result[0]:
+            self.best_result = result
+
+    def result(self):
+        if self.best_result is None:
+            raise ValueError("No active results to aggregate")
+        return self.best_result[:-1]
+
+class RunningMax(RunningMin):
+    """A running version of aggregate_max."""
+    def add(self, result, rank):
+        if self.best_result is None or result[0] > self.best_result[0]:
+            self.best_result = result
+
+class RunningAvg(RunningAggregate):
+    """A running version of aggregate_avg."""
+    def __init__(self, language_model):
+        super(RunningAvg, self).__init__(language_model)
+        self.total = 0
+        self.num_active_results = 0
+
+    def add(self, result, rank):
+        self.total += result[0]
+        self.num_active_results += 1
+
+    def result(self):
+        return [self.total / self.num_active_results] + self.first_result[1:-1]
+
+class RunningWeightedAvg(RunningAggregate):
+    """A running weighted average, whose weights are computed by the weight method."""
+    def __init__(self, language_model):
+        super(RunningWeightedAvg, self).__init__(language_model)
+        self.weighted_total = 0.0
+        self.total_weight = 0
+
+    @abstractmethod
+    def weight(self, result, rank):
+        """Returns the weight of an active result."""
+
+    def add(self, result, rank):
+        weight = self.weight(result, rank)
+        self.weighted_total += result[0] * weight
+        self.total_weight += weight
+
+    def result(self):
+        if self.total_weight == 0:
+            average = 0.0
+        else:
+            average = self.weighted_total / self.total_weight
+        return [average] + self.first_result[1:-1]
+
+class RunningWavgLength(RunningWeightedAvg):
+    """A running version of aggregate_wavg_length."""
+    def weight(self, result, rank):
+        return len(result[-1].tokens)
+
+class RunningWavgGodwin(RunningWeightedAvg):
+    """A running version of aggregate_wavg_godwin."""
+    def weight(self, result, rank):
+        s = 1
+        return 1 / ((rank+1)**s)
+
+class RunningWavgKoetal04(RunningWeightedAvg):
+    """A running version of aggregate_wavg_koetal04."""
+    def weight(self, result, rank):
+        return self.language_model.similarity(result[-1].document.qsubject, result[-1])
+
+RUNNING_AGGREGATES = {
+    aggregate_min: RunningMin,
+    aggregate_max: RunningMax,
+    aggregate_avg: RunningAvg,
+    aggregate_wavg_length: RunningWavgLength,
+    aggregate_wavg_godwin: RunningWavgGodwin,
+    aggregate_wavg_koetal04: RunningWavgKoetal04,
+}
+
+def aggregate_blockwise(aggregate_segments, results, language_model,
+                        block_size=AGGREGATION_BLOCK_SIZE):
+    """
+        Aggregates an iterable of results using an aggregation function. If there are at most
+        block_size results, they are aggregated at once by the aggregation function. Otherwise,
+        they are consumed in blocks of block_size results and aggregated by the running version of
+        the aggregation function, so that at most block_size results are kept in memory.
+    """
+    results = iter(results)
+    block = list(islice(results, block_size + 1))
+    if len(block) <= block_size:
+        with INSTRUMENTATION.stage("aggregate"):
+            return aggregate_segments(block, language_model)
+    running_aggregate = RUNNING_AGGREGATES[aggregate_segments](language_model)
+    while block:
+        with INSTRUMENTATION.stage("aggregate"):
+            running_aggregate.update(block)
+        block = list(islice(results, block_size))
+    with INSTRUMENTATION.stage("aggregate"):
+        return running_aggregate.result()
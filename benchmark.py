@@ -0,0 +1,242 @@
+"""
+    This module implements a benchmark suite that measures the time spent in the stages of the
+    evaluation on synthetic datasets (see synthetic.py).
+"""
+
+from functools import partial
+import logging
+import os
+import platform
+import subprocess
+from time import perf_counter
+
+from filenames import SUBTASK_B_TRAIN2016_DATASET_FNAMES, TEST2016_DATASET_FNAME, \
+    TEST2016_PREDICTIONS_DIRNAME, AGGREGATION_METHOD_MAP, \
+    UNANNOTATED_DATASET_BM25_STATS_FNAME as BM25_STATS_FNAME, \
+    UNANNOTATED_DATASET_COUNTS_FNAME as COUNTS_FNAME, \
+    UNANNOTATED_DATASET_DICTIONARY_FNAME as DICTIONARY_FNAME, \
+    UNANNOTATED_DATASET_IDF_TABLES_BASE_FNAME as IDF_TABLES_BASE_FNAME, \
+    UNANNOTATED_DATASET_MODEL_BUNDLE_FNAME as MODEL_BUNDLE_FNAME, \
+    UNANNOTATED_DATASET_PIVOT_STATS_FNAME as PIVOT_STATS_FNAME
+from evaluation import train_nonsegmented, train_segmented_aggregation, train_segmented_ml, \
+    evaluate_nonsegmented, evaluate_segmented_aggregation, evaluate_segmented_ml
+import language_model
+from language_model import LanguageModel
+from preprocessing import segment_orgquestions, segment_threads
+from synthetic import generate_datasets, SYNTHETIC_NUM_ORGQUESTIONS, \
+    SYNTHETIC_THREADS_PER_ORGQUESTION, SYNTHETIC_COMMENTS_PER_THREAD, SYNTHETIC_VOCABULARY_SIZE, \
+    SYNTHETIC_ZIPF_EXPONENT, SYNTHETIC_RANDOM_STATE
+
+LOGGER = logging.getLogger(__name__)
+
+BENCHMARK_REPEATS = 3
+# The term weightings whose vectorization and similarity are benchmarked.
+BENCHMARK_TERM_WEIGHTINGS = ("tfidf_nfc_nfc", "tfidf_Lpb_s=0.20_bfc",
+                             "bm25_k1=1.2_k3=1000.0_b=0.75")
+# The term weighting and the aggregation operators of the train_* and evaluate_* benchmarks.
+BENCHMARK_TRAINING_TERM_WEIGHTING = "tfidf_nfc_nfc"
+BENCHMARK_TRAINING_AGGREGATION = ("max", "avg")
+
+def _measure(function, setup=None, repeats=BENCHMARK_REPEATS):
+    """
+        Calls a function repeats times and returns a dict with the wall times of the calls. The
+        function returns the number of operations it has performed, such as the number of
+        similarities it has computed. If setup is not None, it is called before every call of the
+        function and it is not measured.
+    """
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        started = perf_counter()
+        num_operations = function()
+        times.append(perf_counter() - started)
+    return {"operations": num_operations, "times": times, "min_time": min(times),
+            "min_time_per_operation": min(times) / num_operations if num_operations else None}
+
+def _parse(dataset_fnames):
+    """Parses datasets and returns the number of document pairs."""
+    return len(list(zip(segment_orgquestions(dataset_fnames), segment_threads(dataset_fnames))))
+
+def _remove_statistics():
+    """Removes the statistics of the unannotated dataset, so that they are prepared again."""
+    fnames = [BM25_STATS_FNAME, PIVOT_STATS_FNAME, DICTIONARY_FNAME, COUNTS_FNAME,
+              MODEL_BUNDLE_FNAME] \
+             + ["%s/%s" % (os.path.dirname(IDF_TABLES_BASE_FNAME), fname) \
+                for fname in os.listdir(os.path.dirname(IDF_TABLES_BASE_FNAME)) \
+                if fname.startswith(os.path.basename(IDF_TABLES_BASE_FNAME))]
+    for fname in fnames:
+        if os.path.exists(fname):
+            os.remove(fname)
+    _clear_statistics()
+
+def _clear_statistics():
+    """Clears the statistics of the unannotated dataset that are kept in memory."""
+    language_model.load_statistics.cache_clear()
+    language_model.load_idf_tables.cache_clear()
+
+def _load_language_model():
+    """Sets up a language model and returns one."""
+    LanguageModel(base_term_weighting=BENCHMARK_TRAINING_TERM_WEIGHTING)
+    return 1
+
+def _clear_bows(segments):
+    """Removes the bag-of-words representations cached in segments."""
+    for segment in segments:
+        segment.bow = None
+        segment.bow_arrays = None
+
+def _vectorize(model, segments):
+    """Vectorizes segments and returns the number of segments."""
+    if model.use_tfidf:
+        for segment in segments:
+            model.vectorize_arrays(segment)
+    else:
+        # BM25 only uses the bag-of-words representation of segments.
+        for segment in segments:
+            model.bow(segment)
+    return len(segments)
+
+def _similarity(model, segment_pairs):
+    """Computes the similarities of segment pairs and returns the number of segment pairs."""
+    for orgquestion_segment, thread_segment in segment_pairs:
+        model.similarity(orgquestion_segment, thread_segment)
+    return len(segment_pairs)
+
+def _aggregate(aggregate_segments, model, results):
+    """Aggregates lists of segment similarities and returns the number of lists."""
+    for subresults in results:
+        aggregate_segments(subresults, model)
+    return len(results)
+
+def _train(train_function, model, *args, **kwargs):
+    """Trains a classifier and returns one."""
+    train_function(model, SUBTASK_B_TRAIN2016_DATASET_FNAMES, *args, **kwargs)
+    return 1
+
+def _evaluate(evaluate_function, model, classifier, *args, **kwargs):
+    """Evaluates a classifier on the 2016 test dataset and returns the number of document pairs."""
+    output_fname = "%s/benchmark.txt" % TEST2016_PREDICTIONS_DIRNAME
+    evaluate_function(model, classifier, [TEST2016_DATASET_FNAME], output_fname, *args, **kwargs)
+    with open(output_fname, "rt") as file:
+        num_pairs = sum(1 for _ in file)
+    os.remove(output_fname)
+    return num_pairs
+
+def _environment():
+    """Returns the versions of Python, of the required packages, and of the code."""
+    import gensim
+    import numpy
+    import sklearn
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(),
+            "platform": platform.platform(), "numpy": numpy.__version__,
+            "scikit-learn": sklearn.__version__, "gensim": gensim.__version__}
+
+def run_benchmarks(dirname, num_orgquestions=SYNTHETIC_NUM_ORGQUESTIONS,
+                   threads_per_orgquestion=SYNTHETIC_THREADS_PER_ORGQUESTION,
+                   comments_per_thread=SYNTHETIC_COMMENTS_PER_THREAD,
+                   vocabulary_size=SYNTHETIC_VOCABULARY_SIZE,
+                   zipf_exponent=SYNTHETIC_ZIPF_EXPONENT, random_state=SYNTHETIC_RANDOM_STATE,
+                   repeats=BENCHMARK_REPEATS):
+    """
+        Generates synthetic datasets in a directory (see generate_datasets), benchmarks the
+        stages of the evaluation on the datasets, and returns a JSON-serializable dict with the
+        parameters, the environment, and the results of the benchmarks. The benchmarks remove
+        the statistics of the language model in the directory, so the directory must not exist,
+        be empty, or contain synthetic datasets generated before.
+
+        Every benchmark is repeated repeats times and its result contains the wall times of the
+        repeats and the number of operations, such as computed similarities, per repeat. The
+        bag-of-words representations cached in segments are removed before every repeat.
+    """
+    parameters = {"num_orgquestions": num_orgquestions,
+                  "threads_per_orgquestion": threads_per_orgquestion,
+                  "comments_per_thread": comments_per_thread, "vocabulary_size": vocabulary_size,
+                  "zipf_exponent": zipf_exponent, "random_state": random_state}
+    generate_datasets(dirname, **parameters)
+    working_dirname = os.getcwd()
+    os.chdir(dirname)
+    try:
+        benchmarks = {}
+        measure = partial(_measure, repeats=repeats)
+
+        LOGGER.info("benchmarking the parser")
+        benchmarks["parse"] = measure(partial(_parse, SUBTASK_B_TRAIN2016_DATASET_FNAMES))
+
+        LOGGER.info("benchmarking the language model preparation")
+        benchmarks["prepare_language_model"] = measure(_load_language_model,
+                                                       setup=_remove_statistics)
+        benchmarks["load_language_model"] = measure(_load_language_model,
+                                                    setup=_clear_statistics)
+
+        pairs = list(zip(segment_orgquestions([TEST2016_DATASET_FNAME]),
+                         segment_threads([TEST2016_DATASET_FNAME])))
+        segments = [segment for orgquestion, (thread, _) in pairs \
+                    for segment in orgquestion.segments + thread.segments]
+        segment_pairs = [(orgquestion_segment, thread_segment) \
+                         for orgquestion, (thread, _) in pairs \
+                         for orgquestion_segment in orgquestion.segments \
+                         for thread_segment in thread.segments]
+        for term_weighting in BENCHMARK_TERM_WEIGHTINGS:
+            LOGGER.info("benchmarking the %s term weighting", term_weighting)
+            model = LanguageModel(base_term_weighting=term_weighting)
+            benchmarks["vectorize[%s]" % term_weighting] = \
+                measure(partial(_vectorize, model, segments),
+                        setup=partial(_clear_bows, segments))
+            benchmarks["similarity[%s]" % term_weighting] = \
+                measure(partial(_similarity, model, segment_pairs),
+                        setup=partial(_clear_bows, segments))
+
+        LOGGER.info("benchmarking the aggregation operators")
+        model = LanguageModel(base_term_weighting=BENCHMARK_TRAINING_TERM_WEIGHTING)
+        results = [[[model.similarity(orgquestion_segment, thread_segment), orgquestion_segment,
+                     thread_segment] for thread_segment in thread.segments] \
+                   for orgquestion, (thread, _) in pairs \
+                   for orgquestion_segment in orgquestion.segments]
+        for name, aggregate_segments in sorted(AGGREGATION_METHOD_MAP.items()):
+            benchmarks["aggregate[%s]" % name] = \
+                measure(partial(_aggregate, aggregate_segments, model, results),
+                        setup=partial(_clear_bows, segments))
+
+        LOGGER.info("benchmarking the training and the evaluation")
+        aggregate_tier1_segments, aggregate_tier2_segments = \
+            [AGGREGATION_METHOD_MAP[name] for name in BENCHMARK_TRAINING_AGGREGATION]
+        methods = [("unsegmented", train_nonsegmented, evaluate_nonsegmented, (), {}),
+                   ("segmented_aggregation", train_segmented_aggregation,
+                    evaluate_segmented_aggregation,
+                    (aggregate_tier1_segments, aggregate_tier2_segments), {"thread_first": True}),
+                   ("segmented_ml", train_segmented_ml, evaluate_segmented_ml, (), {})]
+        for name, train_function, evaluate_function, args, kwargs in methods:
+            benchmarks["train[%s]" % name] = \
+                measure(partial(_train, train_function, model, *args, **kwargs))
+            classifier = train_function(model, SUBTASK_B_TRAIN2016_DATASET_FNAMES, *args,
+                                        **kwargs)
+            benchmarks["evaluate[%s]" % name] = \
+                measure(partial(_evaluate, evaluate_function, model, classifier, *args, **kwargs))
+    finally:
+        os.chdir(working_dirname)
+    parameters["repeats"] = repeats
+    return {"parameters": parameters, "environment": _environment(), "benchmarks": benchmarks}
+
+def compare_benchmarks(old_results, new_results):
+    """
+        Produces (name, old time, new time, ratio) tuples for the benchmarks in two results of
+        run_benchmarks, where the times are the minimum times per operation and the ratio is the
+        new time divided by the old time. A time is None if the benchmark has performed no
+        operations, and the ratio is None if either time is None or the old time is zero.
+    """
+    if old_results["parameters"] != new_results["parameters"]:
+        LOGGER.warning("the benchmarks were run with different parameters: %s and %s",
+                       old_results["parameters"], new_results["parameters"])
+    for name in sorted(set(old_results["benchmarks"]) & set(new_results["benchmarks"])):
+        old_time = old_results["benchmarks"][name]["min_time_per_operation"]
+        new_time = new_results["benchmarks"][name]["min_time_per_operation"]
+        yield (name, old_time, new_time,
+               new_time / old_time if old_time and new_time is not None else None)
@@ -1,13 +1,62 @@
 """This module contains high-level training and evaluation functions."""
 
+from functools import partial
+from glob import glob
 import logging
-from sklearn.linear_model import LogisticRegression
+import os
+from pickle import load, dump
 
+from numpy import array, concatenate, corrcoef, finfo, float64
+from numpy.linalg import norm
+from numpy.random import RandomState
+
+from aggregation import aggregate_avg, aggregate_blockwise, aggregate_max, aggregate_min, \
+    AGGREGATION_BLOCK_SIZE, RUNNING_AGGREGATES
+from filenames import FEATURE_CACHE_DIRNAME
+from instrumentation import INSTRUMENTATION
+from parallel import featurize_parallel
 from preprocessing import segment_threads, segment_orgquestions
+from result_cache import ResultCache
 
 LOGGER = logging.getLogger(__name__)
 LOGISTIC_REGRESSION_RANDOM_STATE = 12345
 
+# If CACHE_DOCUMENT_PAIRS is True, parsed document pairs are kept in memory, so that long-running
+# processes that evaluate many configurations parse every dataset only once per segment filtering.
+CACHE_DOCUMENT_PAIRS = False
+_DOCUMENT_PAIRS = {}
+
+# The aggregation operators that pool the similarities between an <OrgQuestion> segment and the
+# <Thread> segments into the features of the pooled segmented ML version.
+SEGMENTED_ML_POOLING = (aggregate_max, aggregate_avg, aggregate_min)
+
+# If CACHE_FEATURES is False, the features of datasets are always computed anew rather than loaded
+# from the feature cache (see load_features), such as when the features are checked against
+# published results.
+CACHE_FEATURES = True
+# The version of the code that produces the features, which is a part of the names of the feature
+# cache files. Increment it after changing the code that produces the features.
+FEATURE_CACHE_VERSION = 1
+
+# If FEATURIZATION_PROCESSES is not None, datasets are featurized by a pool of forked processes that
+# share the parsed dataset and the language model with their parent (see parallel.py).
+FEATURIZATION_PROCESSES = None
+
+# If STREAMING_TRAINING is True, classifiers are trained by stochastic gradient descent over chunks
+# of STREAMING_CHUNK_SIZE document pairs, so that the features of the training datasets are never
+# all kept in memory. The training stops after STREAMING_MAX_EPOCHS passes over the datasets or when
+# the relative change of the coefficients after a pass falls below STREAMING_TOLERANCE. The averaged
+# coefficients of stochastic gradient descent with a constant STREAMING_LEARNING_RATE converge to
+# the batch solution much faster than with a decreasing learning rate on correlated features. A
+# batch classifier fitted on a random sample of STREAMING_SAMPLE_SIZE standardized document pairs
+# is used to check the convergence of the streaming classifier.
+STREAMING_TRAINING = False
+STREAMING_CHUNK_SIZE = 10000
+STREAMING_MAX_EPOCHS = 20
+STREAMING_TOLERANCE = 1e-2
+STREAMING_LEARNING_RATE = 0.01
+STREAMING_SAMPLE_SIZE = 10000
+
 def produce_gold_results(dataset_fnames, output_fname):
     """
         Produces gold results from an input (dev) datasets and stores the
@@ -33,28 +82,445 @@ def produce_gold_results(dataset_fnames, output_fname):
                                                             rank+1, gold_score,
                                                             "true" if relevant else "false"))
 
-def train_nonsegmented(language_model, dataset_fnames, segment_filtering=False):
+def nonsegmented_features(language_model, orgquestion, thread):
     """
-        Trains a classifier that maps document similarity to relevance labels.
-        The non-segmented version disregards segmentation and computes similarity directly between
+        Returns the features of a document pair. The non-segmented version
+        disregards segmentation and computes similarity directly between
         documents.
+    """
+    return [language_model.similarity(orgquestion, thread)]
+
+def segmented_aggregation_features(language_model, orgquestion, thread, aggregate_tier1_segments,
+                                   aggregate_tier2_segments, thread_first=True):
+    """
+        Returns the features of a document pair. The segmented non-ML version
+        computes similarity between segments and then performs a reduction
+        step to derive document similarity.
+
+        If thread_first is True, the reduction is first performed over <Thread>
+        segments and then over <OrgQuestion> segments rather than the other way
+        around.
+
+        The similarities are computed and reduced in blocks (see aggregate_blockwise), so that
+        the memory use does not grow with the length of the <Thread>.
+    """
+    tier1 = thread if thread_first else orgquestion
+    tier2 = orgquestion if thread_first else thread
+
+    def subresults(tier2_segment):
+        """Produces the similarities between a tier 2 segment and all tier 1 segments."""
+        for tier1_segment in tier1.segments:
+            orgquestion_segment = tier2_segment if thread_first else tier1_segment
+            thread_segment = tier1_segment if thread_first else tier2_segment
+            yield [language_model.similarity(orgquestion_segment, thread_segment),
+                   tier2_segment, tier1_segment]
+
+    results = (aggregate_blockwise(aggregate_tier1_segments, subresults(tier2_segment),
+                                   language_model) \
+               for tier2_segment in tier2.segments)
+    results_aggregate = aggregate_blockwise(aggregate_tier2_segments, results, language_model)
+    LOGGER.debug("Aggregating results: %s", results_aggregate)
+    return results_aggregate
+
+def segmented_ml_features(language_model, orgquestion, thread):
+    """
+        Returns the features of a document pair. The segmented ML version
+        computes similarity between all pairs of active segments.
+    """
+    results = []
+    for orgquestion_segment in orgquestion.segments:
+        if not orgquestion_segment.active:
+            continue
+        for thread_segment in thread.segments:
+            if not thread_segment.active:
+                continue
+            results.append(language_model.similarity(orgquestion_segment, thread_segment))
+    return results
+
+def segmented_ml_pooled_features(language_model, orgquestion, thread,
+                                 block_size=AGGREGATION_BLOCK_SIZE):
+    """
+        Returns the features of a document pair. The pooled segmented ML version
+        computes similarity between every active <OrgQuestion> segment and all
+        active <Thread> segments and pools the similarities using the
+        SEGMENTED_ML_POOLING aggregation operators, so that the number of
+        features does not depend on the number of active segments.
+
+        The similarities are pooled in blocks of block_size segments, so that
+        the memory use does not grow with the length of the <Thread>.
+    """
+    results = []
+    for orgquestion_segment in orgquestion.segments:
+        if not orgquestion_segment.active:
+            continue
+        pooled_results = [RUNNING_AGGREGATES[aggregate_segments](language_model) \
+                          for aggregate_segments in SEGMENTED_ML_POOLING]
+        block = []
+        for thread_segment in thread.segments:
+            if not thread_segment.active:
+                continue
+            block.append([language_model.similarity(orgquestion_segment, thread_segment),
+                          thread_segment])
+            if len(block) == block_size:
+                for pooled_result in pooled_results:
+                    pooled_result.update(block)
+                block = []
+        for pooled_result in pooled_results:
+            pooled_result.update(block)
+            results.append(pooled_result.result()[0])
+    return results
+
+def document_pairs(dataset_fname, segment_filtering=None):
+    """
+        Produces (orgquestion, thread, relevant) triples for all document pairs in a dataset.
 
         If segment_filtering is not None, a text summarization technique is
         used for the filtering of <Thread> segments.
     """
-    training_scores = []
-    training_classes = []
-    for orgquestion, (thread, relevant) \
-        in zip(segment_orgquestions(dataset_fnames),
-               segment_threads(dataset_fnames, segment_filtering=segment_filtering)):
-        training_scores.append([language_model.similarity(orgquestion, thread)])
-        training_classes.append(relevant)
+    key = (dataset_fname, segment_filtering)
+    if key in _DOCUMENT_PAIRS:
+        INSTRUMENTATION.count("document_pairs_cache_hits")
+        return _DOCUMENT_PAIRS[key]
+    pairs = ((orgquestion, thread, relevant) for orgquestion, (thread, relevant) \
+             in zip(segment_orgquestions([dataset_fname]),
+                    segment_threads([dataset_fname], segment_filtering=segment_filtering)))
+    if CACHE_DOCUMENT_PAIRS:
+        pairs = list(pairs)
+        _DOCUMENT_PAIRS[key] = pairs
+    return pairs
+
+def featurize(dataset_fname, pair_features, segment_filtering=None, orgquestion_ids=None):
+    """
+        Produces a list of (orgquestion id, thread id, features, relevant) tuples for all
+        document pairs in a dataset. The features of a document pair are computed using
+        pair_features.
+
+        If segment_filtering is not None, a text summarization technique is
+        used for the filtering of <Thread> segments.
+
+        If orgquestion_ids is not None, only the document pairs with the listed <OrgQuestion>
+        ids are featurized.
+    """
+    if FEATURIZATION_PROCESSES is not None:
+        return featurize_parallel(dataset_fname, pair_features, FEATURIZATION_PROCESSES,
+                                  segment_filtering=segment_filtering,
+                                  orgquestion_ids=orgquestion_ids)
+    return [(orgquestion.id, thread.id, pair_features(orgquestion, thread), relevant) \
+            for orgquestion, thread, relevant \
+            in document_pairs(dataset_fname, segment_filtering=segment_filtering) \
+            if orgquestion_ids is None or orgquestion.id in orgquestion_ids]
+
+def feature_cache_fname(dataset_fname, feature_cache_key):
+    """
+        Returns the name of the feature cache file of a dataset under a key, or None if the key
+        is None. The name contains FEATURE_CACHE_VERSION and a fingerprint of the dataset file and
+        of the language model artifacts (see ResultCache.fingerprint), so that the features are
+        computed anew whenever the dataset, the statistics of the language model, or the code
+        that produces the features change.
+    """
+    if feature_cache_key is None:
+        return None
+    result_cache = ResultCache()
+    try:
+        fingerprint = result_cache.fingerprint([dataset_fname])
+    finally:
+        result_cache.close()
+    return "%s/%s-%s-%d-%s.features" % (FEATURE_CACHE_DIRNAME, os.path.basename(dataset_fname),
+                                        feature_cache_key, FEATURE_CACHE_VERSION,
+                                        fingerprint[:16])
+
+def clear_caches():
+    """
+        Removes the feature cache files and discards the document pairs kept in memory together
+        with the bag-of-words representations cached in their segments. Both depend on the
+        statistics of the language model, so they are to be cleared whenever the statistics are
+        updated (see language_model.update_statistics).
+    """
+    _DOCUMENT_PAIRS.clear()
+    for fname in glob("%s/*.features" % FEATURE_CACHE_DIRNAME):
+        os.remove(fname)
+
+def load_features(dataset_fnames, pair_features, segment_filtering=None, feature_cache_key=None,
+                  orgquestion_ids=None):
+    """
+        Produces a list of (orgquestion id, thread id, features, relevant) tuples for all
+        document pairs in the datasets.
+
+        If feature_cache_key is not None, the features of every dataset are stored in a
+        per-dataset cache file under the key, and they are loaded from the cache file
+        on subsequent calls rather than computed anew. The key must therefore uniquely
+        identify the pair_features and segment_filtering, such as a configuration string. The
+        cache files of a dataset are invalidated when the dataset or the language model change
+        (see feature_cache_fname).
+
+        If orgquestion_ids is not None, only the document pairs with the listed <OrgQuestion>
+        ids are produced. The features of the remaining document pairs are not computed, and
+        they are therefore not stored in the cache.
+    """
+    if not CACHE_FEATURES:
+        feature_cache_key = None
+    features = []
+    for dataset_fname in dataset_fnames:
+        cache_fname = feature_cache_fname(dataset_fname, feature_cache_key)
+        if feature_cache_key is None or orgquestion_ids is not None \
+           and not os.path.exists(cache_fname):
+            INSTRUMENTATION.count("feature_cache_misses")
+            features.extend(featurize(dataset_fname, pair_features,
+                                      segment_filtering=segment_filtering,
+                                      orgquestion_ids=orgquestion_ids))
+            continue
+        try:
+            dataset_features = list(_load_feature_cache(cache_fname))
+            INSTRUMENTATION.count("feature_cache_hits")
+            LOGGER.debug("Loaded features from %s", cache_fname)
+        except IOError:
+            INSTRUMENTATION.count("feature_cache_misses")
+            dataset_features = featurize(dataset_fname, pair_features,
+                                         segment_filtering=segment_filtering)
+            # Write to a temporary file first, so that concurrent processes never read a
+            # partially written cache file.
+            os.makedirs(FEATURE_CACHE_DIRNAME, exist_ok=True)
+            temporary_cache_fname = "%s.%d.tmp" % (cache_fname, os.getpid())
+            with open(temporary_cache_fname, "wb") as file:
+                dump(dataset_features, file)
+            os.replace(temporary_cache_fname, cache_fname)
+            LOGGER.debug("Stored features in %s", cache_fname)
+        features.extend(pair for pair in dataset_features \
+                        if orgquestion_ids is None or pair[0] in orgquestion_ids)
+    return features
+
+def _load_feature_cache(cache_fname):
+    """
+        Produces the (orgquestion id, thread id, features, relevant) tuples stored in a feature
+        cache file. A cache file contains one or more pickled lists of tuples.
+    """
+    with open(cache_fname, "rb") as file:
+        while True:
+            try:
+                dataset_features = load(file)
+            except EOFError:
+                break
+            for pair in dataset_features:
+                yield pair
+
+def stream_features(dataset_fnames, pair_features, segment_filtering=None,
+                    feature_cache_key=None, chunk_size=STREAMING_CHUNK_SIZE):
+    """
+        Produces (orgquestion id, thread id, features, relevant) tuples for all document pairs in
+        the datasets one at a time.
+
+        If feature_cache_key is not None, the features of every dataset are cached under the
+        key as in load_features, but they are stored and loaded in chunks of chunk_size
+        document pairs, so that datasets that do not fit in memory can be streamed.
+    """
+    if not CACHE_FEATURES:
+        feature_cache_key = None
+    for dataset_fname in dataset_fnames:
+        cache_fname = feature_cache_fname(dataset_fname, feature_cache_key)
+        if feature_cache_key is not None and os.path.exists(cache_fname):
+            INSTRUMENTATION.count("feature_cache_hits")
+            LOGGER.debug("Loading features from %s", cache_fname)
+            for pair in _load_feature_cache(cache_fname):
+                yield pair
+            continue
+        features = ((orgquestion.id, thread.id, pair_features(orgquestion, thread), relevant) \
+                    for orgquestion, thread, relevant \
+                    in document_pairs(dataset_fname, segment_filtering=segment_filtering))
+        INSTRUMENTATION.count("feature_cache_misses")
+        if feature_cache_key is None:
+            for pair in features:
+                yield pair
+            continue
+        os.makedirs(FEATURE_CACHE_DIRNAME, exist_ok=True)
+        temporary_cache_fname = "%s.%d.tmp" % (cache_fname, os.getpid())
+        with open(temporary_cache_fname, "wb") as file:
+            chunk = []
+            for pair in features:
+                chunk.append(pair)
+                if len(chunk) == chunk_size:
+                    dump(chunk, file)
+                    chunk = []
+                yield pair
+            dump(chunk, file)
+        os.replace(temporary_cache_fname, cache_fname)
+        LOGGER.debug("Stored features in %s", cache_fname)
+
+def _feature_chunks(features, chunk_size=STREAMING_CHUNK_SIZE):
+    """
+        Produces (scores, classes) pairs of arrays for consecutive chunks of at most chunk_size
+        (orgquestion id, thread id, features, relevant) tuples.
+    """
+    chunk = []
+    for pair in features:
+        chunk.append(pair)
+        if len(chunk) == chunk_size:
+            yield (array([pair_features for _, _, pair_features, _ in chunk], dtype=float64),
+                   array([relevant for _, _, _, relevant in chunk], dtype=bool))
+            chunk = []
+    if chunk:
+        yield (array([pair_features for _, _, pair_features, _ in chunk], dtype=float64),
+               array([relevant for _, _, _, relevant in chunk], dtype=bool))
+
+def train_streaming(features, chunk_size=STREAMING_CHUNK_SIZE, max_epochs=STREAMING_MAX_EPOCHS,
+                    tolerance=STREAMING_TOLERANCE, sample_size=STREAMING_SAMPLE_SIZE):
+    """
+        Trains a classifier that maps document pair features to relevance labels by stochastic
+        gradient descent over chunks of chunk_size document pairs. Only a single chunk and a
+        random sample of sample_size document pairs are kept in memory.
+
+        features is a function that returns a new iterator over (orgquestion id, thread id,
+        features, relevant) tuples, such as stream_features. The iterator is consumed once to
+        standardize the features and once per epoch. The training stops after max_epochs epochs
+        or when the relative change of the coefficients after an epoch falls below tolerance.
+
+        The classifier minimizes the regularized log loss of train on the standardized features,
+        so that the L2 penalty applies to the coefficients of the standardized rather than the raw
+        features and the classifier generally differs from a classifier returned by train. The
+        standardization is folded into the coefficients, so that the classifier takes the raw
+        features and it can be used in place of a classifier returned by train.
+    """
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    random = RandomState(LOGISTIC_REGRESSION_RANDOM_STATE)
+    # Standardize the features, since stochastic gradient descent is sensitive to their scale,
+    # and collect a reservoir sample of document pairs for the convergence check.
+    scaler = StandardScaler()
+    sample_scores, sample_classes = [], []
+    num_pairs = 0
+    for scores, classes in _feature_chunks(features(), chunk_size):
+        with INSTRUMENTATION.stage("fit"):
+            scaler.partial_fit(scores)
+        for pair_scores, relevant in zip(scores, classes):
+            if num_pairs < sample_size:
+                sample_scores.append(pair_scores)
+                sample_classes.append(relevant)
+            else:
+                index = random.randint(num_pairs + 1)
+                if index < sample_size:
+                    sample_scores[index] = pair_scores
+                    sample_classes[index] = relevant
+            num_pairs += 1
+    if not num_pairs:
+        raise ValueError("The training datasets contain no document pairs")
+    LOGGER.info("Training a streaming classifier on %d document pairs", num_pairs)
+
+    # An L2 penalty of alpha/2 * |w|^2 on the mean log loss corresponds to the default C = 1.0 of
+    # LogisticRegression, which penalizes the summed log loss by 1/(2C) * |w|^2.
+    loss = "log_loss" if "log_loss" in SGDClassifier.loss_functions else "log"
+    classifier = SGDClassifier(loss=loss, alpha=1.0 / num_pairs, learning_rate="constant",
+                               eta0=STREAMING_LEARNING_RATE, average=True,
+                               random_state=LOGISTIC_REGRESSION_RANDOM_STATE)
+    coefficients = None
+    for epoch in range(max_epochs):
+        for scores, classes in _feature_chunks(features(), chunk_size):
+            with INSTRUMENTATION.stage("fit"):
+                permutation = random.permutation(len(classes))
+                classifier.partial_fit(scaler.transform(scores)[permutation],
+                                       classes[permutation], classes=[False, True])
+        previous_coefficients = coefficients
+        coefficients = concatenate([classifier.coef_.ravel(), classifier.intercept_])
+        if previous_coefficients is None:
+            continue
+        change = norm(coefficients - previous_coefficients) \
+                 / max(norm(previous_coefficients), finfo(float64).tiny)
+        LOGGER.info("Epoch %d: relative change of the coefficients %g", epoch + 1, change)
+        if change < tolerance:
+            break
+    else:
+        LOGGER.warning("The streaming classifier has not converged after %d epochs", max_epochs)
+
+    _unstandardize(classifier, scaler)
+    streaming_convergence(classifier, scaler, num_pairs, sample_scores, sample_classes)
+    return classifier
+
+def _unstandardize(classifier, scaler):
+    """
+        Folds the standardization of a scaler into the coefficients of a linear classifier
+        trained on the standardized features, so that the classifier takes the raw features.
+    """
+    classifier.coef_ = classifier.coef_ / scaler.scale_
+    classifier.intercept_ = classifier.intercept_ - classifier.coef_.dot(scaler.mean_)
+
+def streaming_convergence(classifier, scaler, num_pairs, scores, classes):
+    """
+        Compares a classifier returned by train_streaming on num_pairs document pairs with a
+        batch classifier fitted on a sample of the document pair features and relevance labels.
+        The batch classifier minimizes the same regularized log loss on the features standardized
+        by scaler, with the penalty scaled from num_pairs to the size of the sample. Returns the
+        fraction of the sample where the predicted relevance labels agree, the correlation of the
+        decision functions, and the log losses of both classifiers on the sample, or None if the
+        sample does not contain both relevance labels.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import log_loss
+
+    if len(set(classes)) < 2:
+        LOGGER.warning("The sample contains a single relevance label, skipping the convergence "
+                       "check")
+        return None
+    # A penalty of 1/(2 * num_pairs) * |w|^2 on the mean log loss of the sample corresponds to C
+    # = num_pairs / len(classes), which equals the default C = 1.0 of train on all document pairs.
+    batch_classifier = LogisticRegression(C=float(num_pairs) / len(classes),
+                                          random_state=LOGISTIC_REGRESSION_RANDOM_STATE)
+    with INSTRUMENTATION.stage("fit"):
+        batch_classifier.fit(scaler.transform(scores), classes)
+    _unstandardize(batch_classifier, scaler)
+    streaming_decisions = classifier.decision_function(scores)
+    batch_decisions = batch_classifier.decision_function(scores)
+    agreement = ((streaming_decisions > 0) == (batch_decisions > 0)).mean()
+    correlation = corrcoef(streaming_decisions, batch_decisions)[0, 1]
+    streaming_loss = log_loss(classes, classifier.predict_proba(scores))
+    batch_loss = log_loss(classes, batch_classifier.predict_proba(scores))
+    LOGGER.info("Streaming and batch classifiers on %d sampled document pairs: label agreement "
+                "%f, decision function correlation %f, log loss %f (streaming) vs. %f (batch)",
+                len(classes), agreement, correlation, streaming_loss, batch_loss)
+    return agreement, correlation, streaming_loss, batch_loss
+
+def train_features(dataset_fnames, pair_features, segment_filtering=None, feature_cache_key=None):
+    """
+        Trains a classifier on the features of the document pairs in the datasets. If
+        STREAMING_TRAINING is True, the classifier is trained by train_streaming, otherwise by
+        train.
+    """
+    if STREAMING_TRAINING:
+        return train_streaming(partial(stream_features, dataset_fnames, pair_features,
+                                       segment_filtering=segment_filtering,
+                                       feature_cache_key=feature_cache_key,
+                                       chunk_size=STREAMING_CHUNK_SIZE))
+    return train(load_features(dataset_fnames, pair_features, segment_filtering=segment_filtering,
+                               feature_cache_key=feature_cache_key))
+
+def train(features):
+    """Trains a classifier that maps document pair features to relevance labels."""
+    # Importing scikit-learn takes seconds, so it is only imported when a classifier is trained.
+    from sklearn.linear_model import LogisticRegression
+
+    training_scores = [pair_features for _, _, pair_features, _ in features]
+    training_classes = [relevant for _, _, _, relevant in features]
     classifier = LogisticRegression(random_state=LOGISTIC_REGRESSION_RANDOM_STATE)
-    classifier.fit(training_scores, training_classes)
+    with INSTRUMENTATION.stage("fit"):
+        classifier.fit(training_scores, training_classes)
     return classifier
 
+def train_nonsegmented(language_model, dataset_fnames, segment_filtering=None,
+                       feature_cache_key=None):
+    """
+        Trains a classifier that maps document similarity to relevance labels.
+        The non-segmented version disregards segmentation and computes similarity directly between
+        documents.
+
+        If segment_filtering is not None, a text summarization technique is
+        used for the filtering of <Thread> segments.
+
+        If feature_cache_key is not None, the features are cached per dataset (see load_features).
+    """
+    return train_features(dataset_fnames, partial(nonsegmented_features, language_model),
+                          segment_filtering=segment_filtering,
+                          feature_cache_key=feature_cache_key)
+
 def evaluate_nonsegmented(language_model, classifier, dataset_fnames, output_fname, \
-                          segment_filtering=None):
+                          segment_filtering=None, feature_cache_key=None):
     """
         Produces an output file that contains the ranking of document pairs and
         predicted relevance labels.  The non-segmented version disregards
@@ -62,19 +528,25 @@ def evaluate_nonsegmented(language_model, classifier, dataset_fnames, output_fna
 
         If segment_filtering is not None, a text summarization technique is
         used for the filtering of <Thread> segments.
+
+        If feature_cache_key is not None, the features are cached per dataset (see load_features).
     """
+    features = load_features(dataset_fnames, partial(nonsegmented_features, language_model),
+                             segment_filtering=segment_filtering,
+                             feature_cache_key=feature_cache_key)
     with open(output_fname, "wt") as output_file:
-        for orgquestion, (thread, _) \
-            in zip(segment_orgquestions(dataset_fnames),
-                   segment_threads(dataset_fnames, segment_filtering=segment_filtering)):
-            test_score = language_model.similarity(orgquestion, thread)
-            test_class = classifier.predict([[test_score]])[0]
-            output_file.write("%s\t%s\t0\t%s\t%s\n" % (orgquestion.id, thread.id, repr(test_score),
-                                                       "true" if test_class else "false"))
+        for orgquestion_id, thread_id, pair_features, _ in features:
+            test_score = pair_features[0]
+            with INSTRUMENTATION.stage("predict"):
+                test_class = classifier.predict([pair_features])[0]
+            with INSTRUMENTATION.stage("write"):
+                output_file.write("%s\t%s\t0\t%s\t%s\n" % (orgquestion_id, thread_id,
+                                                           repr(test_score),
+                                                           "true" if test_class else "false"))
 
 def train_segmented_aggregation(language_model, dataset_fnames, aggregate_tier1_segments,
                                 aggregate_tier2_segments, thread_first=True,
-                                segment_filtering=None):
+                                segment_filtering=None, feature_cache_key=None):
     """
         Trains a classifier that maps document similarity to relevance labels.
         The segmented non-ML version computes similarity between segments and
@@ -89,36 +561,20 @@ def train_segmented_aggregation(language_model, dataset_fnames, aggregate_tier1_
 
         If segment_filtering is not None, a text summarization technique is
         used for the filtering of <Thread> segments.
+
+        If feature_cache_key is not None, the features are cached per dataset (see load_features).
     """
-    training_scores = []
-    training_classes = []
-    for orgquestion, (thread, relevant) \
-        in zip(segment_orgquestions(dataset_fnames),
-               segment_threads(dataset_fnames, segment_filtering=segment_filtering)):
-        results = []
-        tier1 = thread if thread_first else orgquestion
-        tier2 = orgquestion if thread_first else thread
-        for tier2_segment in tier2.segments:
-            subresults = []
-            for tier1_segment in tier1.segments:
-                orgquestion_segment = tier2_segment if thread_first else tier1_segment
-                thread_segment = tier1_segment if thread_first else tier2_segment
-                subresults.append([language_model.similarity(orgquestion_segment, thread_segment),
-                                   tier2_segment, tier1_segment])
-            subresults_aggregate = aggregate_tier1_segments(subresults, language_model)
-            LOGGER.debug("Aggregating subresults: %s -> %s", subresults, subresults_aggregate)
-            results.append(subresults_aggregate)
-        results_aggregate = aggregate_tier2_segments(results, language_model)
-        LOGGER.debug("Aggregating results: %s -> %s", results, results_aggregate)
-        training_scores.append(results_aggregate)
-        training_classes.append(relevant)
-    classifier = LogisticRegression(random_state=LOGISTIC_REGRESSION_RANDOM_STATE)
-    classifier.fit(training_scores, training_classes)
-    return classifier
+    pair_features = partial(segmented_aggregation_features, language_model,
+                            aggregate_tier1_segments=aggregate_tier1_segments,
+                            aggregate_tier2_segments=aggregate_tier2_segments,
+                            thread_first=thread_first)
+    return train_features(dataset_fnames, pair_features, segment_filtering=segment_filtering,
+                          feature_cache_key=feature_cache_key)
 
 def evaluate_segmented_aggregation(language_model, classifier, dataset_fnames, output_fname,
                                    aggregate_tier1_segments, aggregate_tier2_segments,
-                                   thread_first=True, segment_filtering=None):
+                                   thread_first=True, segment_filtering=None,
+                                   feature_cache_key=None):
     """
         Produces an output file that contains the ranking of document pairs and
         predicted relevance labels.  The segmented non-ML version computes
@@ -134,32 +590,27 @@ def evaluate_segmented_aggregation(language_model, classifier, dataset_fnames, o
 
         If segment_filtering is not None, a text summarization technique is
         used for the filtering of <Thread> segments.
+
+        If feature_cache_key is not None, the features are cached per dataset (see load_features).
     """
+    pair_features = partial(segmented_aggregation_features, language_model,
+                            aggregate_tier1_segments=aggregate_tier1_segments,
+                            aggregate_tier2_segments=aggregate_tier2_segments,
+                            thread_first=thread_first)
+    features = load_features(dataset_fnames, pair_features, segment_filtering=segment_filtering,
+                             feature_cache_key=feature_cache_key)
     with open(output_fname, "wt") as output_file:
-        for orgquestion, (thread, _) \
-            in zip(segment_orgquestions(dataset_fnames),
-                   segment_threads(dataset_fnames, segment_filtering=segment_filtering)):
-            results = []
-            tier1 = thread if thread_first else orgquestion
-            tier2 = orgquestion if thread_first else thread
-            for tier2_segment in tier2.segments:
-                subresults = []
-                for tier1_segment in tier1.segments:
-                    orgquestion_segment = tier2_segment if thread_first else tier1_segment
-                    thread_segment = tier1_segment if thread_first else tier2_segment
-                    subresults.append([language_model.similarity(orgquestion_segment, thread_segment),
-                                       tier2_segment, tier1_segment])
-                subresults_aggregate = aggregate_tier1_segments(subresults, language_model)
-                LOGGER.debug("Aggregating subresults: %s -> %s", subresults, subresults_aggregate)
-                results.append(subresults_aggregate)
-            results_aggregate = aggregate_tier2_segments(results, language_model)
-            LOGGER.debug("Aggregating results: %s -> %s", results, results_aggregate)
-            test_score = results_aggregate[0]
-            test_class = classifier.predict([[test_score]])[0]
-            output_file.write("%s\t%s\t0\t%s\t%s\n" % (orgquestion.id, thread.id, repr(test_score),
-                                                       "true" if test_class else "false"))
-
-def train_segmented_ml(language_model, dataset_fnames, segment_filtering=None):
+        for orgquestion_id, thread_id, pair_features, _ in features:
+            test_score = pair_features[0]
+            with INSTRUMENTATION.stage("predict"):
+                test_class = classifier.predict([[test_score]])[0]
+            with INSTRUMENTATION.stage("write"):
+                output_file.write("%s\t%s\t0\t%s\t%s\n" % (orgquestion_id, thread_id,
+                                                           repr(test_score),
+                                                           "true" if test_class else "false"))
+
+def train_segmented_ml(language_model, dataset_fnames, segment_filtering=None,
+                       feature_cache_key=None, pooled=False):
     """
         Trains a classifier that maps document similarity to relevance labels.
         This is done by computing similarity between segments and then
@@ -167,29 +618,21 @@ def train_segmented_ml(language_model, dataset_fnames, segment_filtering=None):
 
         If segment_filtering is not None, a text summarization technique is
         used for the filtering of <Thread> segments. Note that the ml approach
-        expects all training samples to have the same number of active segments.
-    """
-    training_scores = []
-    training_classes = []
-    for orgquestion, (thread, relevant) \
-        in zip(segment_orgquestions(dataset_fnames),
-               segment_threads(dataset_fnames, segment_filtering=segment_filtering)):
-        results = []
-        for orgquestion_segment in orgquestion.segments:
-            if not orgquestion_segment.active:
-                continue
-            for thread_segment in thread.segments:
-                if not thread_segment.active:
-                    continue
-                results.append(language_model.similarity(orgquestion_segment, thread_segment))
-        training_scores.append(results)
-        training_classes.append(relevant)
-    classifier = LogisticRegression(random_state=LOGISTIC_REGRESSION_RANDOM_STATE)
-    classifier.fit(training_scores, training_classes)
-    return classifier
+        expects all training samples to have the same number of active segments
+        unless pooled is True.
+
+        If feature_cache_key is not None, the features are cached per dataset (see load_features).
+
+        If pooled is True, the similarities are pooled into a fixed number of features (see
+        segmented_ml_pooled_features).
+    """
+    pair_features = segmented_ml_pooled_features if pooled else segmented_ml_features
+    return train_features(dataset_fnames, partial(pair_features, language_model),
+                          segment_filtering=segment_filtering,
+                          feature_cache_key=feature_cache_key)
 
 def evaluate_segmented_ml(language_model, classifier, dataset_fnames, output_fname,
-                          segment_filtering=None):
+                          segment_filtering=None, feature_cache_key=None, pooled=False):
     """
         Produces an output file that contains the ranking of document pairs and
         predicted relevance labels.  This is done by computing similarity
@@ -199,21 +642,24 @@ def evaluate_segmented_ml(language_model, classifier, dataset_fnames, output_fna
 
         If segment_filtering is not None, a text summarization technique is
         used for the filtering of <Thread> segments. Note that the ml approach
-        expects all training samples to have the same number of active segments.
+        expects all training samples to have the same number of active segments
+        unless pooled is True.
+
+        If feature_cache_key is not None, the features are cached per dataset (see load_features).
+
+        If pooled is True, the similarities are pooled into a fixed number of features (see
+        segmented_ml_pooled_features).
     """
+    pair_features = segmented_ml_pooled_features if pooled else segmented_ml_features
+    features = load_features(dataset_fnames, partial(pair_features, language_model),
+                             segment_filtering=segment_filtering,
+                             feature_cache_key=feature_cache_key)
     with open(output_fname, "wt") as output_file:
-        for orgquestion, (thread, _) \
-            in zip(segment_orgquestions(dataset_fnames),
-                   segment_threads(dataset_fnames, segment_filtering=segment_filtering)):
-            results = []
-            for orgquestion_segment in orgquestion.segments:
-                if not orgquestion_segment.active:
-                    continue
-                for thread_segment in thread.segments:
-                    if not thread_segment.active:
-                        continue
-                    results.append(language_model.similarity(orgquestion_segment, thread_segment))
-            test_score = classifier.decision_function([results])[0]
-            test_class = classifier.predict([results])[0]
-            output_file.write("%s\t%s\t0\t%s\t%s\n" % (orgquestion.id, thread.id, repr(test_score),
-                                                       "true" if test_class else "false"))
+        for orgquestion_id, thread_id, results, _ in features:
+            with INSTRUMENTATION.stage("predict"):
+                test_score = classifier.decision_function([results])[0]
+                test_class = classifier.predict([results])[0]
+            with INSTRUMENTATION.stage("write"):
+                output_file.write("%s\t%s\t0\t%s\t%s\n" % (orgquestion_id, thread_id,
+                                                           repr(test_score),
+                                                           "true" if test_class else "false"))
@@ -0,0 +1,207 @@
+"""This module implements the evaluation of configuration strings."""
+
+from functools import partial
+import logging
+import re
+
+from filenames import SUBTASK_B_TRAIN2016_DATASET_FNAMES as TRAIN2016_DATASET_FNAMES, \
+    SUBTASK_B_TRAIN2017_DATASET_FNAMES as TRAIN2017_DATASET_FNAMES, TEST2016_DATASET_FNAME, \
+    TEST2016_DIRNAME, TEST2017_DATASET_FNAME, TEST2017_DIRNAME, TEST_PREDICTIONS_BASE_DIRNAME, \
+    TEST2016_PREDICTIONS_DIRNAME, TEST2017_PREDICTIONS_DIRNAME, TEST2016_GOLD_BASE_FNAME, \
+    TEST2017_GOLD_BASE_FNAME, AGGREGATION_METHOD_MAP, DEV_DATASET_FNAME, DEV_GOLD_BASE_FNAME
+from evaluation import train_nonsegmented, train_segmented_aggregation, train_segmented_ml, \
+    evaluate_nonsegmented, evaluate_segmented_aggregation, evaluate_segmented_ml, \
+    nonsegmented_features, segmented_aggregation_features, segmented_ml_features, \
+    segmented_ml_pooled_features, \
+    load_features, train
+from instrumentation import INSTRUMENTATION
+from language_model import LanguageModel
+
+LOGGER = logging.getLogger(__name__)
+
+class Configuration(object):
+    """A configuration of a method that maps document pairs to relevance labels."""
+    def __init__(self, config):
+        """
+            Sets up a configuration from a configuration string, such as
+            "unsegmented-none-tfidf_nfc_nfc-none".
+
+            The configuration string consists of a method, a segment filtering method, a base term
+            weighting, and an extra term weighting separated by dashes. The segmented_aggregation
+            method is followed by a tier 1 aggregation operator, a tier 2 aggregation operator, and
+            an aggregation order.
+        """
+        self.config = config
+        config = config.split('-')
+        self.method = config[0]
+        assert self.method in ("unsegmented", "segmented_ml", "segmented_ml_pooled",
+                               "segmented_aggregation")
+        segment_filtering_method = config[1]
+        assert segment_filtering_method in \
+            ("none", "kolczetal00_title", "kolczetal00_firstpara",
+             "kolczetal00_parawithmosttitlewords", "kolczetal00_firsttwopara",
+             "kolczetal00_firstlastpara") \
+            or re.match(r"kolczetal00_bestsentence[0-5]", segment_filtering_method)
+        self.segment_filtering = segment_filtering_method \
+                                 if segment_filtering_method != "none" else None
+        self.base_term_weighting = config[2]
+        assert re.match(r"(bm25|tfidf)_", self.base_term_weighting)
+        extra_term_weighting_method = config[3]
+        assert extra_term_weighting_method in ("none", "godwin", "murataetal00_A",
+                                               "murataetal00_B")
+        self.extra_term_weighting = extra_term_weighting_method \
+                                    if extra_term_weighting_method != "none" else None
+        if self.method == "segmented_aggregation":
+            aggregate_tier1_segments_method = config[4]
+            assert aggregate_tier1_segments_method in AGGREGATION_METHOD_MAP.keys()
+            self.aggregate_tier1_segments = AGGREGATION_METHOD_MAP[aggregate_tier1_segments_method]
+            aggregate_tier2_segments_method = config[5]
+            assert aggregate_tier2_segments_method in AGGREGATION_METHOD_MAP.keys()
+            self.aggregate_tier2_segments = AGGREGATION_METHOD_MAP[aggregate_tier2_segments_method]
+            order = config[6]
+            assert order in ("result_first", "query_first")
+            self.thread_first = order == "result_first"
+
+    def language_model(self):
+        """Returns a language model with the term weighting of the configuration."""
+        return LanguageModel(base_term_weighting=self.base_term_weighting,
+                             extra_term_weighting=self.extra_term_weighting)
+
+    def pair_features(self, language_model):
+        """Returns a function that maps a document pair to the features of the configuration."""
+        if self.method == "segmented_ml":
+            return partial(segmented_ml_features, language_model)
+        elif self.method == "segmented_ml_pooled":
+            return partial(segmented_ml_pooled_features, language_model)
+        elif self.method == "segmented_aggregation":
+            return partial(segmented_aggregation_features, language_model,
+                           aggregate_tier1_segments=self.aggregate_tier1_segments,
+                           aggregate_tier2_segments=self.aggregate_tier2_segments,
+                           thread_first=self.thread_first)
+        elif self.method == "unsegmented":
+            return partial(nonsegmented_features, language_model)
+
+def determine_filenames(year):
+    """
+        Returns the directory and file names that correspond to a year, i.e. the scorer directory
+        name, the predictions directory name, the gold results file name relative to the scorer
+        directory, the test dataset file name, and the training dataset file names.
+    """
+    assert year in ("dev", "2016", "2017")
+    if year == "dev":
+        test_dirname = TEST2016_DIRNAME
+        test_predictions_dirname = TEST2016_PREDICTIONS_DIRNAME
+        gold_base_fname = DEV_GOLD_BASE_FNAME
+        test_dataset_fname = DEV_DATASET_FNAME
+        train_dataset_fnames = TRAIN2016_DATASET_FNAMES
+    elif year == "2016":
+        test_dirname = TEST2016_DIRNAME
+        test_predictions_dirname = TEST2016_PREDICTIONS_DIRNAME
+        gold_base_fname = TEST2016_GOLD_BASE_FNAME
+        test_dataset_fname = TEST2016_DATASET_FNAME
+        train_dataset_fnames = TRAIN2016_DATASET_FNAMES + [DEV_DATASET_FNAME]
+    elif year == "2017":
+        test_dirname = TEST2017_DIRNAME
+        test_predictions_dirname = TEST2017_PREDICTIONS_DIRNAME
+        gold_base_fname = TEST2017_GOLD_BASE_FNAME
+        test_dataset_fname = TEST2017_DATASET_FNAME
+        train_dataset_fnames = TRAIN2017_DATASET_FNAMES + [DEV_DATASET_FNAME]
+    return test_dirname, test_predictions_dirname, gold_base_fname, test_dataset_fname, \
+        train_dataset_fnames
+
+def run(config, year):
+    """
+        Trains and evaluates a configuration string on the datasets of a year and produces an
+        output file with predictions. Returns the scorer directory name, the gold results file
+        name, and the output file name, where the latter two are relative to the scorer directory.
+
+        If the instrumentation is enabled, the time spent in the stages of the run and the
+        counters of events are stored in a JSON file next to the output file.
+    """
+    configuration = Configuration(config)
+
+    # Determine directory and file names
+    test_dirname, test_predictions_dirname, gold_base_fname, test_dataset_fname, \
+        train_dataset_fnames = determine_filenames(year)
+    output_fname = "%s/subtask_B_%s-%s.txt" % (test_predictions_dirname, config, year)
+    base_output_fname = "%s/subtask_B_%s-%s.txt" % (TEST_PREDICTIONS_BASE_DIRNAME, config, year)
+    instrumentation_fname = "%s/subtask_B_%s-%s.json" % (test_predictions_dirname, config, year)
+    LOGGER.info("Producing %s ...", output_fname)
+
+    INSTRUMENTATION.reset()
+    with INSTRUMENTATION.stage("run"):
+        # Perform training. The features of the datasets are cached under the configuration string,
+        # so that datasets shared between the training and test datasets of different years are
+        # only featurized once.
+        feature_cache_key = config
+        language_model = configuration.language_model()
+        if configuration.method in ("segmented_ml", "segmented_ml_pooled"):
+            classifier = train_segmented_ml(language_model, train_dataset_fnames,
+                                            segment_filtering=configuration.segment_filtering,
+                                            feature_cache_key=feature_cache_key,
+                                            pooled=configuration.method == "segmented_ml_pooled")
+        elif configuration.method == "segmented_aggregation":
+            classifier = train_segmented_aggregation(
+                language_model, train_dataset_fnames, configuration.aggregate_tier1_segments,
+                configuration.aggregate_tier2_segments, thread_first=configuration.thread_first,
+                segment_filtering=configuration.segment_filtering,
+                feature_cache_key=feature_cache_key)
+        elif configuration.method == "unsegmented":
+            classifier = train_nonsegmented(language_model, train_dataset_fnames,
+                                            segment_filtering=configuration.segment_filtering,
+                                            feature_cache_key=feature_cache_key)
+
+        # Perform evaluation
+        if configuration.method in ("segmented_ml", "segmented_ml_pooled"):
+            evaluate_segmented_ml(language_model, classifier, [test_dataset_fname], output_fname,
+                                  segment_filtering=configuration.segment_filtering,
+                                  feature_cache_key=feature_cache_key,
+                                  pooled=configuration.method == "segmented_ml_pooled")
+        elif configuration.method == "segmented_aggregation":
+            evaluate_segmented_aggregation(language_model, classifier,
+                                           [test_dataset_fname], output_fname,
+                                           configuration.aggregate_tier1_segments,
+                                           configuration.aggregate_tier2_segments,
+                                           thread_first=configuration.thread_first,
+                                           segment_filtering=configuration.segment_filtering,
+                                           feature_cache_key=feature_cache_key)
+        elif configuration.method == "unsegmented":
+            evaluate_nonsegmented(language_model, classifier, [test_dataset_fname], output_fname,
+                                  segment_filtering=configuration.segment_filtering,
+                                  feature_cache_key=feature_cache_key)
+
+    if INSTRUMENTATION.enabled:
+        INSTRUMENTATION.dump(instrumentation_fname, config=config, year=year)
+
+    return test_dirname, gold_base_fname, base_output_fname
+
+def score(config, year, orgquestion_ids=None):
+    """
+        Trains and evaluates a configuration string on the datasets of a year in-process and
+        returns a list of (orgquestion id, thread id, test score, relevant) tuples for all
+        document pairs in the test dataset.
+
+        If orgquestion_ids is not None, only the document pairs with the listed <OrgQuestion> ids
+        are used for training and evaluation.
+    """
+    configuration = Configuration(config)
+    _, _, _, test_dataset_fname, train_dataset_fnames = determine_filenames(year)
+    language_model = configuration.language_model()
+    pair_features = configuration.pair_features(language_model)
+    test_features = load_features([test_dataset_fname], pair_features,
+                                  segment_filtering=configuration.segment_filtering,
+                                  feature_cache_key=config, orgquestion_ids=orgquestion_ids)
+    if configuration.method in ("segmented_ml", "segmented_ml_pooled"):
+        classifier = train(load_features(train_dataset_fnames, pair_features,
+                                         segment_filtering=configuration.segment_filtering,
+                                         feature_cache_key=config,
+                                         orgquestion_ids=orgquestion_ids))
+        test_scores = classifier.decision_function([features for _, _, features, _ \
+                                                    in test_features])
+    else:
+        # The test score is the similarity itself and the classifier only predicts the relevance
+        # labels, which do not affect the ranking. Therefore, no training is necessary.
+        test_scores = [features[0] for _, _, features, _ in test_features]
+    return [(orgquestion_id, thread_id, test_score, relevant) \
+            for (orgquestion_id, thread_id, _, relevant), test_score \
+            in zip(test_features, test_scores)]
@@ -6,6 +6,14 @@ from scoring import df_n, df_t, df_f, df_F, df_p, tf_n, tf_l, tf_a, tf_b, tf_L,
     norm_c, norm_u, norm_b
 
 # The following constant contain filenames and pathnames related to datasets.
+DATASET_DIRNAME = "datasets"
+# The zip archives of the datasets (see datasets/Makefile), whose members are named by their paths
+# relative to DATASET_DIRNAME. The datasets that have not been extracted are read from the archives.
+DATASET_ARCHIVE_FNAMES = \
+    ["%s/QL-unannotated-data-subtaskA.xml.zip" % DATASET_DIRNAME,
+     "%s/semeval2016-task3-cqa-ql-traindev-v3.2.zip" % DATASET_DIRNAME,
+     "%s/semeval2016_task3_test.zip" % DATASET_DIRNAME,
+     "%s/semeval2017_task3_test_input_abcd.zip" % DATASET_DIRNAME]
 TRAIN_DATASET_DIRNAME = "datasets/v3.2/train"
 SUBTASK_B_TRAIN2016_DATASET_FNAMES = \
     ["%s/SemEval2016-Task3-CQA-QL-train-part1.xml" % TRAIN_DATASET_DIRNAME,
@@ -35,7 +43,15 @@ UNANNOTATED_DATASET_FNAME = "%s.xml" % UNANNOTATED_DATASET_BASE_FNAME
 UNANNOTATED_DATASET_DICTIONARY_FNAME = "%s.dict" % UNANNOTATED_DATASET_BASE_FNAME
 UNANNOTATED_DATASET_PIVOT_STATS_FNAME = "%s.pivot" % UNANNOTATED_DATASET_BASE_FNAME
 UNANNOTATED_DATASET_BM25_STATS_FNAME = "%s.bm25" % UNANNOTATED_DATASET_BASE_FNAME
+UNANNOTATED_DATASET_COUNTS_FNAME = "%s.counts" % UNANNOTATED_DATASET_BASE_FNAME
 UNANNOTATED_DATASET_LOG_FNAME = "%s.log" % UNANNOTATED_DATASET_BASE_FNAME
+UNANNOTATED_DATASET_IDF_TABLES_BASE_FNAME = "%s.idf" % UNANNOTATED_DATASET_BASE_FNAME
+UNANNOTATED_DATASET_MODEL_BUNDLE_FNAME = "%s.model" % UNANNOTATED_DATASET_BASE_FNAME
+FEATURE_CACHE_DIRNAME = "datasets/features"
+RESULT_CACHE_FNAME = "datasets/results.sqlite"
+GRID_SEARCH_RESULTS_FNAME = "grid_search/results.csv"
+# The file that marks a directory with synthetic datasets (see synthetic.py).
+SYNTHETIC_DATASETS_MARKER_FNAME = "SYNTHETIC"
 
 # The following constants contain mapping from configuration strings to functions.
 AGGREGATION_METHOD_MAP = \
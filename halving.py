@@ -0,0 +1,69 @@
+"""
+    This module implements the successive halving search over configuration strings described in
+    (Jamieson K., Talwalkar A., 2016).
+"""
+
+from functools import partial
+import logging
+from math import ceil
+from multiprocessing import Pool
+from random import Random
+
+from experiment import determine_filenames, score
+from metrics import mean_average_precision
+from preprocessing import retrieve_orgquestion_ids
+
+LOGGER = logging.getLogger(__name__)
+
+HALVING_ETA = 3
+HALVING_MIN_FRACTION = 1 / 27
+HALVING_RANDOM_STATE = 12345
+
+def sample_orgquestion_ids(year, fraction, random_state=HALVING_RANDOM_STATE):
+    """
+        Returns a random sample of the <OrgQuestion> ids in the training and test datasets of a
+        year. The sample contains a fraction of the ids of every dataset. Samples with the same
+        random_state are nested, i.e. a sample contains all samples with smaller fractions.
+    """
+    _, _, _, test_dataset_fname, train_dataset_fnames = determine_filenames(year)
+    orgquestion_ids = set()
+    for dataset_fname in train_dataset_fnames + [test_dataset_fname]:
+        dataset_orgquestion_ids = list(retrieve_orgquestion_ids([dataset_fname]))
+        Random(random_state).shuffle(dataset_orgquestion_ids)
+        sample_size = max(1, ceil(fraction * len(dataset_orgquestion_ids)))
+        orgquestion_ids.update(dataset_orgquestion_ids[:sample_size])
+    return orgquestion_ids
+
+def _score_config(config, year, orgquestion_ids):
+    """Returns the in-process mean average precision of a configuration string."""
+    return mean_average_precision(score(config, year, orgquestion_ids=orgquestion_ids))
+
+def successive_halving(configs, year, eta=HALVING_ETA, min_fraction=HALVING_MIN_FRACTION,
+                       processes=None):
+    """
+        Evaluates configuration strings on the datasets of a year using growing fractions of the
+        <OrgQuestion>s, starting with min_fraction. After every rung, only the best 1/eta of the
+        configurations by the in-process mean average precision are kept and the fraction is
+        multiplied by eta. Returns the configurations that survive the last rung with a fraction
+        smaller than one, which are to be evaluated on the full datasets.
+
+        The configurations are evaluated in parallel by a pool of processes worker processes. If
+        processes is None, the number of CPUs is used.
+    """
+    configs = list(configs)
+    fraction = min_fraction
+    with Pool(processes) as pool:
+        while fraction < 1.0 - 1e-9 and len(configs) > 1:
+            orgquestion_ids = sample_orgquestion_ids(year, fraction)
+            LOGGER.info("evaluating %d configurations on %d orgquestions (fraction %f)",
+                        len(configs), len(orgquestion_ids), fraction)
+            mean_average_precisions = pool.map(partial(_score_config, year=year,
+                                                       orgquestion_ids=orgquestion_ids),
+                                               configs)
+            ranked_configs = sorted(zip(configs, mean_average_precisions),
+                                    key=lambda config: config[1], reverse=True)
+            configs = [config for config, _ in ranked_configs[:ceil(len(configs) / eta)]]
+            LOGGER.info("kept %d configurations, best MAP %f", len(configs),
+                        ranked_configs[0][1])
+            fraction *= eta
+    return configs
@@ -0,0 +1,174 @@
+"""
+    This module implements the instrumentation of runs, which records the wall and CPU time spent in
+    the stages of a run and counters of events, such as the number of scored segment pairs.
+"""
+
+from functools import wraps
+import json
+import logging
+import os
+from threading import Lock
+from time import perf_counter
+try:
+    from time import thread_time
+except ImportError:
+    # time.thread_time is only available in Python 3.7 and later. The CPU time of the process
+    # then includes the CPU time of all its threads, such as the reader thread of the parser.
+    from time import process_time as thread_time
+
+LOGGER = logging.getLogger(__name__)
+
+# If the INSTRUMENTATION environment variable is set to a value other than "" and "0", or if the
+# main script is run with the --instrument option, the instrumentation is enabled and the record of
+# every run is stored in a JSON file next to the predictions file of the run. When the
+# instrumentation is disabled, the instrumented code only checks a flag.
+INSTRUMENTATION_ENVIRONMENT_VARIABLE = "INSTRUMENTATION"
+
+class _NullStage(object):
+    """A context manager that does nothing, which is used for stages when disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage(object):
+    """A context manager that adds the wall and CPU time spent in its body to a stage."""
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.wall_time = None
+        self.cpu_time = None
+
+    def __enter__(self):
+        self.wall_time = perf_counter()
+        self.cpu_time = thread_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.add_time(self.name, perf_counter() - self.wall_time,
+                                      thread_time() - self.cpu_time)
+        return False
+
+class Instrumentation(object):
+    """
+        The wall and CPU time spent in named stages and named counters of events.
+
+        The CPU time of a stage is the CPU time of the thread that executes the stage, so that the
+        parsing by a reader thread is not attributed to the consumer and vice versa. Before
+        Python 3.7, the CPU time of the whole process is used instead. Stages can be
+        nested, such as vectorize in similarity and similarity in aggregate, and the time of a
+        nested stage is then included in the time of the enclosing stage. The times and counters
+        of worker processes are merged into the record of their parent (see merge), so that the
+        times of a stage are summed over the processes.
+    """
+    def __init__(self, enabled=False):
+        """Sets up an empty record. If enabled is False, nothing is recorded."""
+        self.enabled = enabled
+        self.lock = Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def reset(self):
+        """Discards all recorded times and counters."""
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+
+    def add_time(self, name, wall_time, cpu_time, calls=1):
+        """Adds the wall and CPU time of calls executions to a stage."""
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = [0, 0.0, 0.0]
+            stage = self.stages[name]
+            stage[0] += calls
+            stage[1] += wall_time
+            stage[2] += cpu_time
+
+    def count(self, name, increment=1):
+        """Increments a counter."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def stage(self, name):
+        """Returns a context manager that adds the time spent in its body to a stage."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def iterate(self, name, iterable):
+        """
+            Returns an iterator over an iterable that adds the time spent producing every item to a
+            stage, or the iterable itself if the instrumentation is disabled.
+        """
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iter(iterable))
+
+    def _iterate(self, name, iterator):
+        """Produces the items of an iterator and adds the time spent producing them to a stage."""
+        wall_time = 0.0
+        cpu_time = 0.0
+        calls = 0
+        try:
+            while True:
+                started_wall_time = perf_counter()
+                started_cpu_time = thread_time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    wall_time += perf_counter() - started_wall_time
+                    cpu_time += thread_time() - started_cpu_time
+                    calls += 1
+                yield item
+        finally:
+            self.add_time(name, wall_time, cpu_time, calls=calls)
+
+    def record(self):
+        """Returns the recorded times and counters as a JSON-serializable dict."""
+        with self.lock:
+            return {
+                "stages": {name: {"calls": calls, "wall_time": wall_time, "cpu_time": cpu_time} \
+                           for name, (calls, wall_time, cpu_time) in sorted(self.stages.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def merge(self, record):
+        """Adds the times and counters of a record, such as the record of a worker process."""
+        for name, stage in record["stages"].items():
+            self.add_time(name, stage["wall_time"], stage["cpu_time"], calls=stage["calls"])
+        for name, increment in record["counters"].items():
+            self.count(name, increment)
+
+    def dump(self, fname, **metadata):
+        """Stores the record together with metadata, such as the configuration, in a JSON file."""
+        record = dict(metadata)
+        record.update(self.record())
+        # Write to a temporary file first, so that readers never see a partially written file.
+        temporary_fname = "%s.%d.tmp" % (fname, os.getpid())
+        with open(temporary_fname, "wt") as file:
+            json.dump(record, file, indent=2, sort_keys=True)
+            file.write("\n")
+        os.replace(temporary_fname, fname)
+        LOGGER.debug("Stored instrumentation in %s", fname)
+
+INSTRUMENTATION = Instrumentation(
+    enabled=os.environ.get(INSTRUMENTATION_ENVIRONMENT_VARIABLE, "") not in ("", "0"))
+
+def instrumented(name):
+    """Returns a decorator that adds the time spent in a function to a stage."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not INSTRUMENTATION.enabled:
+                return function(*args, **kwargs)
+            with _Stage(INSTRUMENTATION, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
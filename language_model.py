@@ -1,29 +1,453 @@
 """This module contains the language model that maps token lists to vector-space represenations."""
 
+from array import array
+from collections import Counter
+from functools import lru_cache
+from glob import glob
+from hashlib import sha256
 from itertools import chain
+import json
 import logging
+from mmap import mmap, ACCESS_READ
+import os
 from pickle import load, dump
 import re
+from struct import Struct
+from sys import intern
 
-from gensim import corpora
-from numpy import mean
+from numpy import dot, errstate, float64, frombuffer, fromiter, int64, mean, stack
+from numpy import load as load_array, save as save_array
 
 from filenames import UNANNOTATED_DATASET_FNAME, \
     UNANNOTATED_DATASET_DICTIONARY_FNAME as DICTIONARY_FNAME, \
     UNANNOTATED_DATASET_LOG_FNAME as LOG_FNAME, \
     UNANNOTATED_DATASET_PIVOT_STATS_FNAME as PIVOT_STATS_FNAME, \
     UNANNOTATED_DATASET_BM25_STATS_FNAME as BM25_STATS_FNAME, \
+    UNANNOTATED_DATASET_COUNTS_FNAME as COUNTS_FNAME, \
+    UNANNOTATED_DATASET_IDF_TABLES_BASE_FNAME as IDF_TABLES_BASE_FNAME, \
+    UNANNOTATED_DATASET_MODEL_BUNDLE_FNAME as MODEL_BUNDLE_FNAME, \
     TFIDF_DF_WEIGHTING_METHOD_MAP as DF_WEIGHTING_METHOD_MAP, \
     TFIDF_TF_WEIGHTING_METHOD_MAP as TF_WEIGHTING_METHOD_MAP, \
     TFIDF_NORMALIZATION_METHOD_MAP as NORMALIZATION_METHOD_MAP
+from instrumentation import INSTRUMENTATION, instrumented
 from preprocessing import Document, segment_threads
-from scoring import bm25, norm_u, norm_b
+from scoring import bm25, df_n, df_f, df_F, df_t, df_p, norm_u, norm_b, ARRAY_VARIANTS
 
 LOGGER = logging.getLogger(__name__)
 
+# The document frequency weighting functions that correspond to the rows of the IDF tables and the
+# data type of the IDF tables. With "float32", the IDF tables take half the memory and the term
+# weights differ from the reference term weights by relative rounding errors of about 1e-7.
+IDF_TABLE_FUNCTIONS = (df_n, df_f, df_F, df_t, df_p)
+IDF_TABLE_DTYPE = "float64"
+
+# The magic number and the version of the model bundle file format. The version is to be increased
+# whenever the format or the content of the model bundle changes.
+MODEL_BUNDLE_MAGIC = b"SEGMTLM\0"
+MODEL_BUNDLE_VERSION = 1
+MODEL_BUNDLE_PREAMBLE = Struct("<8sII")
+
+# The keys of the BM25 and the pivoted document normalization tf-idf statistics.
+STATISTICS_KEYS = ("documents", "qsubjects", "qbodies", "comments")
+
+class FlatDictionary(object):
+    """
+        A read-only dictionary that maps tokens to ids and stores the document frequencies of
+        the ids in a flat array rather than in a dict of Python integers. Reading a flat array
+        does not update reference counts, so forked processes can share the memory pages of the
+        array with their parent instead of copying them.
+
+        The tokens are interned like the tokens produced by preprocessing.tokenize, so that looking
+        up a token compares the token objects by their identity.
+    """
+    def __init__(self, tokens, dfs, num_docs):
+        """
+            Sets up a flat dictionary from a list of tokens in term id order, a buffer of 64-bit
+            document frequencies in term id order, and the number of documents.
+        """
+        self.token2id = {intern(token): term_id for term_id, token in enumerate(tokens)}
+        self.dfs = dfs
+        self.df_array = frombuffer(self.dfs, dtype=int64)
+        self.num_docs = num_docs
+
+    def doc2bow(self, tokens):
+        """
+            Returns the bag-of-words representation of a list of tokens as a list of
+            (term id, term frequency) pairs in ascending term id order. Out-of-dictionary tokens
+            are skipped. The output is identical to the doc2bow method of gensim dictionaries.
+        """
+        token2id = self.token2id
+        counter = Counter(tokens)
+        return sorted((token2id[token], tf) for token, tf in counter.items() if token in token2id)
+
+def intersect_term_ids(query_term_ids, result_term_ids):
+    """
+        Returns the indices of the common term ids in two arrays of term ids in ascending order,
+        first in the array of query term ids and then in the array of result term ids.
+    """
+    if not len(query_term_ids) or not len(result_term_ids):
+        return query_term_ids[:0], result_term_ids[:0]
+    result_indices = result_term_ids.searchsorted(query_term_ids)
+    result_indices[result_indices == len(result_term_ids)] = 0
+    common = result_term_ids[result_indices] == query_term_ids
+    return common.nonzero()[0], result_indices[common]
+
+def prepare_statistics():
+    """
+        Returns the BM25 statistics, the pivoted document normalization tf-idf statistics, and the
+        gensim dictionary of the unannotated SemEval 2016/2017 Task 3 dataset. The statistics are
+        prepared and stored when they are not available.
+    """
+    from gensim import corpora
+
+    file_handler = logging.FileHandler(LOG_FNAME, encoding='utf8')
+    logging.getLogger().addHandler(file_handler)
+
+    # Prepare the BM25 scoring model.
+    try:
+        with open(BM25_STATS_FNAME, "br") as file:
+            bm25_avdl = load(file)
+    except IOError:
+        bm25_avdl = {}
+        LOGGER.info("preparing the bm25 scoring function statistics")
+
+        bm25_avdl["documents"] = mean([sum((len(token) for token in document.tokens)) \
+            for document, _ in segment_threads([UNANNOTATED_DATASET_FNAME])])
+        LOGGER.info("average document length: %f", bm25_avdl["documents"])
+
+        bm25_avdl["qsubjects"] = mean([sum((len(token) for token in segment.tokens)) \
+            for segment in chain.from_iterable(document.segments for document, _ \
+                                   in segment_threads([UNANNOTATED_DATASET_FNAME])) \
+            if segment == segment.document.qsubject])
+        LOGGER.info("average qsubject segment length: %f", bm25_avdl["qsubjects"])
+
+        bm25_avdl["qbodies"] = mean([sum((len(token) for token in segment.tokens)) \
+            for segment in chain.from_iterable(document.segments for document, _ \
+                                   in segment_threads([UNANNOTATED_DATASET_FNAME])) \
+            if segment == segment.document.qbody])
+        LOGGER.info("average qbody segment length: %f", bm25_avdl["qbodies"])
+
+        bm25_avdl["comments"] = mean([sum((len(token) for token in segment.tokens)) \
+            for segment in chain.from_iterable(document.segments for document, _ \
+                                   in segment_threads([UNANNOTATED_DATASET_FNAME])) \
+            if segment != segment.document.qsubject and segment != segment.document.qbody])
+        LOGGER.info("average comment segment length: %f", bm25_avdl["comments"])
+
+        with open(BM25_STATS_FNAME, "bw") as file:
+            dump(bm25_avdl, file)
+        LOGGER.info("done preparing the bm25 scoring function statistics")
+
+    # Prepare the pivoted document normalization tf-idf statistics.
+    try:
+        with open(PIVOT_STATS_FNAME, "rb") as file:
+            pivot_stats = load(file)
+    except IOError:
+        pivot_stats = {}
+        LOGGER.info("preparing the pivoted document normalization tf-idf statistics")
+
+        pivot_stats["documents"] = {}
+        pivot_stats["documents"]["avgb"] = bm25_avdl["documents"]
+        pivot_stats["documents"]["avgu"] = mean([len(document.terms) \
+            for document, _ in segment_threads([UNANNOTATED_DATASET_FNAME])])
+        LOGGER.info("average document length: %f", pivot_stats["documents"]["avgb"])
+        LOGGER.info("average document unique terms: %f", pivot_stats["documents"]["avgu"])
+
+        pivot_stats["qsubjects"] = {}
+        pivot_stats["qsubjects"]["avgb"] = bm25_avdl["qsubjects"]
+        pivot_stats["qsubjects"]["avgu"] = mean([len(segment.terms) \
+            for segment in chain.from_iterable(document.segments for document, _ \
+                                   in segment_threads([UNANNOTATED_DATASET_FNAME])) \
+            if segment == segment.document.qsubject])
+        LOGGER.info("average qsubject segment length: %f",
+                    pivot_stats["qsubjects"]["avgb"])
+        LOGGER.info("average qsubject segment unique terms: %f",
+                    pivot_stats["qsubjects"]["avgu"])
+
+        pivot_stats["qbodies"] = {}
+        pivot_stats["qbodies"]["avgb"] = bm25_avdl["qbodies"]
+        pivot_stats["qbodies"]["avgu"] = mean([len(segment.terms) \
+            for segment in chain.from_iterable(document.segments for document, _ \
+                                   in segment_threads([UNANNOTATED_DATASET_FNAME])) \
+            if segment == segment.document.qbody])
+        LOGGER.info("average qbody segment length: %f", pivot_stats["qbodies"]["avgb"])
+        LOGGER.info("average qbody segment unique terms: %f",
+                    pivot_stats["qbodies"]["avgu"])
+
+        pivot_stats["comments"] = {}
+        pivot_stats["comments"]["avgb"] = bm25_avdl["comments"]
+        pivot_stats["comments"]["avgu"] = mean([len(segment.terms) \
+            for segment in chain.from_iterable(document.segments for document, _ \
+                                   in segment_threads([UNANNOTATED_DATASET_FNAME])) \
+            if segment != segment.document.qsubject and segment != segment.document.qbody])
+        LOGGER.info("average comment segment length: %f", pivot_stats["comments"]["avgb"])
+        LOGGER.info("average comment segment unique terms: %f",
+                    pivot_stats["comments"]["avgu"])
+
+        with open(PIVOT_STATS_FNAME, "wb") as file:
+            dump(pivot_stats, file)
+        LOGGER.info("done preparing the pivoted document normalization tf-idf statistics")
+
+    # Prepare the dictionary.
+    try:
+        dictionary = corpora.Dictionary.load(DICTIONARY_FNAME, mmap='r')
+    except IOError:
+        dictionary = \
+            corpora.Dictionary(segment.tokens for segment in chain.from_iterable( \
+                document.segments for document, _ \
+                                  in segment_threads([UNANNOTATED_DATASET_FNAME])))
+        dictionary.save(DICTIONARY_FNAME)
+
+    logging.getLogger().removeHandler(file_handler)
+    return bm25_avdl, pivot_stats, dictionary
+
+def count_statistics(dataset_fnames, dictionary=None):
+    """
+        Returns the numbers of <Thread> documents and segments in SemEval 2016/2017 Task 3
+        datasets, the sums of their lengths, and the sums of their numbers of unique terms as
+        dicts keyed by STATISTICS_KEYS. The lengths are measured as in the BM25 statistics. The
+        datasets are read in a single pass.
+
+        If dictionary is not None, the segments are added to the gensim dictionary in the same
+        pass.
+    """
+    counts = {key: 0 for key in STATISTICS_KEYS}
+    lengths = {key: 0 for key in STATISTICS_KEYS}
+    unique_terms = {key: 0 for key in STATISTICS_KEYS}
+
+    def segment_tokens():
+        """Counts the documents and segments and produces the tokens of the segments."""
+        for document, _ in segment_threads(dataset_fnames):
+            items = [("documents", document)]
+            for segment in document.segments:
+                if segment == document.qsubject:
+                    items.append(("qsubjects", segment))
+                elif segment == document.qbody:
+                    items.append(("qbodies", segment))
+                else:
+                    items.append(("comments", segment))
+            for key, item in items:
+                counts[key] += 1
+                lengths[key] += sum((len(token) for token in item.tokens))
+                unique_terms[key] += len(item.terms)
+            for segment in document.segments:
+                yield segment.tokens
+
+    if dictionary is not None:
+        dictionary.add_documents(segment_tokens())
+    else:
+        for _ in segment_tokens():
+            pass
+    return counts, lengths, unique_terms
+
+def _dump_atomically(obj, fname):
+    """Pickles an object to a file, so that readers never see a partially written file."""
+    temporary_fname = "%s.%d.tmp" % (fname, os.getpid())
+    with open(temporary_fname, "wb") as file:
+        dump(obj, file)
+    os.replace(temporary_fname, fname)
+
+def update_statistics(dataset_fnames):
+    """
+        Adds the <Thread>s of SemEval 2016/2017 Task 3 datasets to the BM25 statistics, the
+        pivoted document normalization tf-idf statistics, and the dictionary of the unannotated
+        dataset in place, stores them together with a new model bundle, and returns the new
+        revision of the statistics. The datasets are read in a single pass and the unannotated
+        dataset is not read again, except for counting its documents and segments before the
+        first update.
+
+        The average lengths and numbers of unique terms are updated from the numbers of documents
+        and segments that the statistics were computed from, which are stored with the revision
+        in a counts file, and they agree with the statistics prepared from all datasets up to
+        rounding errors. The IDF tables of the previous revision are removed and the statistics
+        and IDF tables loaded in this process are discarded, so that language models set up
+        afterwards use the new revision. Language models that were set up before keep the
+        previous revision. The caches of features (see evaluation.clear_caches) are not cleared.
+    """
+    bm25_avdl, pivot_stats, dictionary = prepare_statistics()
+    try:
+        with open(COUNTS_FNAME, "rb") as file:
+            revision, counts = load(file)
+    except IOError:
+        LOGGER.info("counting the documents and segments of the unannotated dataset")
+        revision = 0
+        counts, _, _ = count_statistics([UNANNOTATED_DATASET_FNAME])
+    if sum(counts[key] for key in STATISTICS_KEYS[1:]) != dictionary.num_docs:
+        raise ValueError("The counts in %s do not match the dictionary, prepare the statistics "
+                         "again" % COUNTS_FNAME)
+
+    LOGGER.info("adding %s to revision %d of the statistics", ", ".join(dataset_fnames),
+                revision)
+    new_counts, lengths, unique_terms = count_statistics(dataset_fnames, dictionary)
+    for key in STATISTICS_KEYS:
+        if not new_counts[key]:
+            continue
+        num_items = counts[key] + new_counts[key]
+        bm25_avdl[key] = (bm25_avdl[key] * counts[key] + lengths[key]) / num_items
+        pivot_stats[key]["avgb"] = bm25_avdl[key]
+        pivot_stats[key]["avgu"] = \
+            (pivot_stats[key]["avgu"] * counts[key] + unique_terms[key]) / num_items
+        counts[key] = num_items
+        LOGGER.info("added %d %s, average length: %f, average unique terms: %f",
+                    new_counts[key], key, pivot_stats[key]["avgb"], pivot_stats[key]["avgu"])
+    revision += 1
+
+    # The dictionary is stored first and the counts last, so that an interrupted update is
+    # detected by the next update.
+    temporary_fname = "%s.%d.tmp" % (DICTIONARY_FNAME, os.getpid())
+    dictionary.save(temporary_fname)
+    os.replace(temporary_fname, DICTIONARY_FNAME)
+    _dump_atomically(bm25_avdl, BM25_STATS_FNAME)
+    _dump_atomically(pivot_stats, PIVOT_STATS_FNAME)
+    _dump_atomically((revision, counts), COUNTS_FNAME)
+    save_model_bundle(MODEL_BUNDLE_FNAME, bm25_avdl, pivot_stats, dictionary)
+    for stale_fname in glob("%s-*.npy" % IDF_TABLES_BASE_FNAME):
+        try:
+            os.remove(stale_fname)
+        except FileNotFoundError:
+            pass # Another process has removed the stale IDF tables first.
+    load_statistics.cache_clear()
+    load_idf_tables.cache_clear()
+    LOGGER.info("stored revision %d of the statistics", revision)
+    return revision
+
+def save_model_bundle(fname, bm25_avdl, pivot_stats, dictionary):
+    """
+        Stores the BM25 statistics, the pivoted document normalization tf-idf statistics, and a
+        gensim dictionary in a model bundle file named fname. The file contains the following:
+
+        - MODEL_BUNDLE_MAGIC, the version and the length of the header as two 32-bit integers,
+        - the header, a JSON object with the statistics, the number of documents and terms, and
+          the offsets of the following sections,
+        - the document frequencies of the terms as 64-bit integers in term id order, and
+        - the tokens of the terms in term id order separated by newlines.
+
+        The sections are aligned to eight bytes, so that they can be read directly from a
+        memory-mapped file.
+    """
+    tokens = [None] * len(dictionary.token2id)
+    for token, term_id in dictionary.token2id.items():
+        tokens[term_id] = token
+    dfs = array("q", (dictionary.dfs.get(term_id, 0) for term_id in range(len(tokens))))
+    tokens = "\n".join(tokens).encode("utf8")
+
+    def aligned(offset):
+        """Returns the smallest offset aligned to eight bytes that is at least offset."""
+        return (offset + 7) // 8 * 8
+
+    # The offsets are stored in the header, so the header is padded to a length that leaves room
+    # for the offsets before they are known.
+    header = {"bm25_avdl": bm25_avdl, "pivot_stats": pivot_stats,
+              "num_docs": dictionary.num_docs, "num_terms": len(dfs)}
+    header_length = aligned(len(json.dumps(header).encode("utf8")) + 100)
+    header["dfs_offset"] = aligned(MODEL_BUNDLE_PREAMBLE.size + header_length)
+    header["tokens_offset"] = header["dfs_offset"] + len(dfs) * dfs.itemsize
+    header["tokens_length"] = len(tokens)
+    encoded_header = json.dumps(header).encode("utf8").ljust(header_length)
+    assert len(encoded_header) == header_length
+
+    temporary_fname = "%s.%d.tmp" % (fname, os.getpid())
+    with open(temporary_fname, "wb") as file:
+        file.write(MODEL_BUNDLE_PREAMBLE.pack(MODEL_BUNDLE_MAGIC, MODEL_BUNDLE_VERSION,
+                                              header_length))
+        file.write(encoded_header)
+        file.write(b"\0" * (header["dfs_offset"] - file.tell()))
+        file.write(dfs.tobytes())
+        file.write(tokens)
+    os.replace(temporary_fname, fname)
+
+def load_model_bundle(fname):
+    """
+        Returns the BM25 statistics, the pivoted document normalization tf-idf statistics, and the
+        flat dictionary stored in a model bundle file named fname. The document frequencies are
+        read directly from the memory-mapped file. Raises ValueError if the file is not a model
+        bundle of the current version.
+    """
+    with open(fname, "rb") as file:
+        bundle = mmap(file.fileno(), 0, access=ACCESS_READ)
+    if len(bundle) < MODEL_BUNDLE_PREAMBLE.size:
+        raise ValueError("%s is not a model bundle" % fname)
+    magic, version, header_length = MODEL_BUNDLE_PREAMBLE.unpack_from(bundle)
+    if magic != MODEL_BUNDLE_MAGIC:
+        raise ValueError("%s is not a model bundle" % fname)
+    if version != MODEL_BUNDLE_VERSION:
+        raise ValueError("%s is a model bundle of version %d rather than %d" \
+                         % (fname, version, MODEL_BUNDLE_VERSION))
+    header = json.loads(bytes(bundle[MODEL_BUNDLE_PREAMBLE.size:
+                                     MODEL_BUNDLE_PREAMBLE.size+header_length]).decode("utf8"))
+    dfs = memoryview(bundle)[header["dfs_offset"]:header["tokens_offset"]].cast("q")
+    tokens = bytes(bundle[header["tokens_offset"]:
+                          header["tokens_offset"]+header["tokens_length"]]).decode("utf8")
+    tokens = tokens.split("\n") if header["num_terms"] else []
+    assert len(tokens) == len(dfs) == header["num_terms"]
+    return header["bm25_avdl"], header["pivot_stats"], \
+        FlatDictionary(tokens, dfs, header["num_docs"])
+
+@lru_cache(maxsize=None)
+def load_statistics():
+    """
+        Returns the BM25 statistics, the pivoted document normalization tf-idf statistics, and the
+        flat dictionary of the unannotated SemEval 2016/2017 Task 3 dataset. The statistics are
+        loaded from a model bundle, which is prepared from the statistics files when it is not
+        available, when it has an outdated version, or when the statistics files are newer. The
+        statistics are loaded only once per process, so that long-running processes can set up
+        many language models cheaply.
+    """
+    try:
+        bundle_mtime = os.stat(MODEL_BUNDLE_FNAME).st_mtime_ns
+        if all(not os.path.exists(fname) or os.stat(fname).st_mtime_ns <= bundle_mtime \
+               for fname in (BM25_STATS_FNAME, PIVOT_STATS_FNAME, DICTIONARY_FNAME)):
+            return load_model_bundle(MODEL_BUNDLE_FNAME)
+        LOGGER.info("preparing the model bundle: the statistics files have changed")
+    except (IOError, ValueError) as error:
+        LOGGER.info("preparing the model bundle: %s", error)
+    bm25_avdl, pivot_stats, dictionary = prepare_statistics()
+    save_model_bundle(MODEL_BUNDLE_FNAME, bm25_avdl, pivot_stats, dictionary)
+    return load_model_bundle(MODEL_BUNDLE_FNAME)
+
+@lru_cache(maxsize=None)
+def load_idf_tables(dtype=IDF_TABLE_DTYPE):
+    """
+        Returns a dict that maps the document frequency weighting functions in scoring.py to
+        arrays with the weights of all terms in the dictionary of the unannotated SemEval 2016/2017
+        Task 3 dataset. The weights of a term are at the index of its term id.
+
+        The IDF tables are prepared from the dictionary and stored in a single .npy file, which is
+        memory-mapped, so that all language models and forked processes share one copy. The file
+        name contains a hash of the document frequencies, so that the IDF tables are prepared again
+        whenever the dictionary changes.
+    """
+    _, _, dictionary = load_statistics()
+    digest = sha256(dictionary.dfs.tobytes())
+    digest.update(("\t%d" % dictionary.num_docs).encode("utf8"))
+    fname = "%s-%s-%s.npy" % (IDF_TABLES_BASE_FNAME, dtype, digest.hexdigest()[:16])
+    try:
+        idf_tables = load_array(fname, mmap_mode="r")
+    except IOError:
+        LOGGER.info("preparing the %s idf tables", dtype)
+        # Term ids without a document frequency have infinite weights, but they never occur.
+        with errstate(divide="ignore", invalid="ignore"):
+            idf_tables = stack([ARRAY_VARIANTS[function](dictionary.df_array, dictionary.num_docs) \
+                                for function in IDF_TABLE_FUNCTIONS]).astype(dtype)
+        temporary_fname = "%s.%d.tmp" % (fname, os.getpid())
+        with open(temporary_fname, "wb") as file:
+            save_array(file, idf_tables)
+        os.replace(temporary_fname, fname)
+        idf_tables = load_array(fname, mmap_mode="r")
+        # The stale IDF tables are removed only after the current IDF tables are in place, and
+        # never the current IDF tables, which other processes may be preparing concurrently.
+        for stale_fname in glob("%s-%s-*.npy" % (IDF_TABLES_BASE_FNAME, dtype)):
+            if stale_fname == fname:
+                continue
+            try:
+                os.remove(stale_fname)
+            except FileNotFoundError:
+                pass # Another process has removed the stale IDF tables first.
+    return {function: idf_tables[row] for row, function in enumerate(IDF_TABLE_FUNCTIONS)}
+
 class LanguageModel(object):
     """A language model that maps token lists to vector-space represenations."""
-    def __init__(self, base_term_weighting="tfidf_ntc_ntc", extra_term_weighting=None):
+    def __init__(self, base_term_weighting="tfidf_ntc_ntc", extra_term_weighting=None,
+                 use_arrays=True):
         """
             Sets up a tf-idf language model using the unannotated SemEval 2016/2017 Task 3 dataset.
 
@@ -44,10 +468,12 @@ class LanguageModel(object):
             term t is multiplied by a factor K_location(d, t) described in (Murata et al., 2000)
             with constants taken for system A or B from section 3. The title and body parameters
             then correspond to the title and body token lists.
-        """
-        file_handler = logging.FileHandler(LOG_FNAME, encoding='utf8')
-        logging.getLogger().addHandler(file_handler)
 
+            If use_arrays is True, the tf-idf term weights are computed over numpy arrays using the
+            array variants of the weighting functions in scoring.py and the precomputed IDF tables.
+            Otherwise, the tf-idf term weights are computed term by term using the reference
+            weighting functions.
+        """
         # Parse the configuration.
         if re.match(r"tfidf_", base_term_weighting):
             self.use_tfidf = True
@@ -66,6 +492,7 @@ class LanguageModel(object):
         else:
             assert extra_term_weighting is None
         self.extra_term_weighting = extra_term_weighting
+        self.use_arrays = use_arrays
 
         if self.use_tfidf:
             self.tfidf_result = {}
@@ -85,124 +512,57 @@ class LanguageModel(object):
             self.tfidf_query["df"] = DF_WEIGHTING_METHOD_MAP[self.tfidf_query["df"]]
             self.tfidf_query["norm"] = NORMALIZATION_METHOD_MAP[self.tfidf_query["norm"]]
             assert self.tfidf_query["norm"] not in (norm_u, norm_b)
+            self.tfidf_result_arrays = {component: ARRAY_VARIANTS[function] \
+                                        for component, function in self.tfidf_result.items()}
+            self.tfidf_query_arrays = {component: ARRAY_VARIANTS[function] \
+                                       for component, function in self.tfidf_query.items()}
 
-        # Prepare the BM25 scoring model.
-        try:
-            with open(BM25_STATS_FNAME, "br") as file:
-                self.bm25_avdl = load(file)
-        except IOError:
-            self.bm25_avdl = {}
-            LOGGER.info("preparing the bm25 scoring function statistics")
-
-            self.bm25_avdl["documents"] = mean([sum((len(token) for token in document.tokens)) \
-                for document, _ in segment_threads([UNANNOTATED_DATASET_FNAME])])
-            LOGGER.info("average document length: %f", self.bm25_avdl["documents"])
-
-            self.bm25_avdl["qsubjects"] = mean([sum((len(token) for token in segment.tokens)) \
-                for segment in chain.from_iterable(document.segments for document, _ \
-                                       in segment_threads([UNANNOTATED_DATASET_FNAME])) \
-                if segment == segment.document.qsubject])
-            LOGGER.info("average qsubject segment length: %f", self.bm25_avdl["qsubjects"])
-
-            self.bm25_avdl["qbodies"] = mean([sum((len(token) for token in segment.tokens)) \
-                for segment in chain.from_iterable(document.segments for document, _ \
-                                       in segment_threads([UNANNOTATED_DATASET_FNAME])) \
-                if segment == segment.document.qbody])
-            LOGGER.info("average qbody segment length: %f", self.bm25_avdl["qbodies"])
-
-            self.bm25_avdl["comments"] = mean([sum((len(token) for token in segment.tokens)) \
-                for segment in chain.from_iterable(document.segments for document, _ \
-                                       in segment_threads([UNANNOTATED_DATASET_FNAME])) \
-                if segment != segment.document.qsubject and segment != segment.document.qbody])
-            LOGGER.info("average comment segment length: %f", self.bm25_avdl["comments"])
-
-            with open(BM25_STATS_FNAME, "bw") as file:
-                dump(self.bm25_avdl, file)
-            LOGGER.info("done preparing the bm25 scoring function statistics")
-
-        # Prepare the pivoted document normalization tf-idf statistics.
-        try:
-            with open(PIVOT_STATS_FNAME, "rb") as file:
-                self.pivot_stats = load(file)
-        except IOError:
-            self.pivot_stats = {}
-            LOGGER.info("preparing the pivoted document normalization tf-idf statistics")
-
-            self.pivot_stats["documents"] = {}
-            self.pivot_stats["documents"]["avgb"] = self.bm25_avdl["documents"]
-            self.pivot_stats["documents"]["avgu"] = mean([len(document.terms) \
-                for document, _ in segment_threads([UNANNOTATED_DATASET_FNAME])])
-            LOGGER.info("average document length: %f", self.pivot_stats["documents"]["avgb"])
-            LOGGER.info("average document unique terms: %f", self.pivot_stats["documents"]["avgu"])
-
-            self.pivot_stats["qsubjects"] = {}
-            self.pivot_stats["qsubjects"]["avgb"] = self.bm25_avdl["qsubjects"]
-            self.pivot_stats["qsubjects"]["avgu"] = mean([len(segment.terms) \
-                for segment in chain.from_iterable(document.segments for document, _ \
-                                       in segment_threads([UNANNOTATED_DATASET_FNAME])) \
-                if segment == segment.document.qsubject])
-            LOGGER.info("average qsubject segment length: %f",
-                        self.pivot_stats["qsubjects"]["avgb"])
-            LOGGER.info("average qsubject segment unique terms: %f",
-                        self.pivot_stats["qsubjects"]["avgu"])
-
-            self.pivot_stats["qbodies"] = {}
-            self.pivot_stats["qbodies"]["avgb"] = self.bm25_avdl["qbodies"]
-            self.pivot_stats["qbodies"]["avgu"] = mean([len(segment.terms) \
-                for segment in chain.from_iterable(document.segments for document, _ \
-                                       in segment_threads([UNANNOTATED_DATASET_FNAME])) \
-                if segment == segment.document.qbody])
-            LOGGER.info("average qbody segment length: %f", self.pivot_stats["qbodies"]["avgb"])
-            LOGGER.info("average qbody segment unique terms: %f",
-                        self.pivot_stats["qbodies"]["avgu"])
-
-            self.pivot_stats["comments"] = {}
-            self.pivot_stats["comments"]["avgb"] = self.bm25_avdl["comments"]
-            self.pivot_stats["comments"]["avgu"] = mean([len(segment.terms) \
-                for segment in chain.from_iterable(document.segments for document, _ \
-                                       in segment_threads([UNANNOTATED_DATASET_FNAME])) \
-                if segment != segment.document.qsubject and segment != segment.document.qbody])
-            LOGGER.info("average comment segment length: %f", self.pivot_stats["comments"]["avgb"])
-            LOGGER.info("average comment segment unique terms: %f",
-                        self.pivot_stats["comments"]["avgu"])
-
-            with open(PIVOT_STATS_FNAME, "wb") as file:
-                dump(self.pivot_stats, file)
-            LOGGER.info("done preparing the pivoted document normalization tf-idf statistics")
-
-        # Prepare the dictionary.
-        try:
-            self.dictionary = corpora.Dictionary.load(DICTIONARY_FNAME, mmap='r')
-        except IOError:
-            self.dictionary = \
-                corpora.Dictionary(segment for segment in chain.from_iterable( \
-                    document.segments for document, _ \
-                                      in segment_threads([UNANNOTATED_DATASET_FNAME])))
-            self.dictionary.save(DICTIONARY_FNAME)
+        # Load the statistics of the unannotated dataset.
+        self.bm25_avdl, self.pivot_stats, self.dictionary = load_statistics()
+        if self.use_tfidf and self.use_arrays:
+            idf_tables = load_idf_tables()
+            self.tfidf_result_arrays["idf"] = idf_tables[self.tfidf_result["df"]]
+            self.tfidf_query_arrays["idf"] = idf_tables[self.tfidf_query["df"]]
 
-        logging.getLogger().removeHandler(file_handler)
+        # The methods are instrumented per instance rather than decorated, so that they are called
+        # without a wrapper when the instrumentation is disabled.
+        if INSTRUMENTATION.enabled:
+            self.vectorize = instrumented("vectorize")(self.vectorize)
+            self.vectorize_arrays = instrumented("vectorize")(self.vectorize_arrays)
+            self.similarity = instrumented("similarity")(self.similarity)
 
-    def vectorize(self, segment, is_query=False):
+    def bow(self, segment):
         """
-            Returns a vector representation of a segment (or a document) for
-            tf-idf similarity scoring.
-
-            is_query determines, whether the tf-idf weighting scheme for
-            queries will be used rather than the tf-idf weighting scheme for
-            results.
+            Returns the bag-of-words representation of a segment (or a document). The
+            representation is computed only once per segment and cached in the segment.
         """
-        segment_bow = self.dictionary.doc2bow(segment.tokens)
+        if segment.bow is None:
+            if INSTRUMENTATION.enabled:
+                INSTRUMENTATION.count("bow_cache_misses")
+            segment.bow = self.dictionary.doc2bow(segment.tokens)
+        elif INSTRUMENTATION.enabled:
+            INSTRUMENTATION.count("bow_cache_hits")
+        return segment.bow
 
-        # Perform base weighting.
-        base_term_weights = {}
-        tfs = [term_frequency for _, term_frequency in segment_bow]
-        for term_id, tf in segment_bow:
-            df = self.dictionary.dfs[term_id]
-            N = self.dictionary.num_docs
-            model = self.tfidf_query if is_query else self.tfidf_result
-            base_term_weights[term_id] = model["tf"](tf, tfs) * model["df"](df, N)
+    def bow_arrays(self, segment):
+        """
+            Returns the bag-of-words representation of a segment (or a document) as an array of
+            term ids in ascending order and an array of term frequencies. The representation is
+            computed only once per segment and cached in the segment.
+        """
+        if segment.bow_arrays is None:
+            segment_bow = self.bow(segment)
+            segment.bow_arrays = (
+                fromiter((term_id for term_id, _ in segment_bow), dtype=int64,
+                         count=len(segment_bow)),
+                fromiter((tf for _, tf in segment_bow), dtype=float64, count=len(segment_bow)))
+        return segment.bow_arrays
 
-        # Perform extra weighting.
+    def extra_term_weights(self, segment):
+        """
+            Returns a dict that maps the term ids of a segment (or a document) to the extra term
+            weights, or an empty dict if no extra term weighting is used.
+        """
         extra_term_weights = {}
         if self.extra_term_weighting:
             if self.extra_term_weighting == "murataetal00_A":
@@ -211,11 +571,11 @@ class LanguageModel(object):
             elif self.extra_term_weighting == "murataetal00_B":
                 k_location_1 = 1.3
                 k_location_2 = 0.15
+            token2id = self.dictionary.token2id
             for (token_position, token) in enumerate(segment.tokens):
-                token_bow = self.dictionary.doc2bow([token])
-                if len(token_bow) == 0:
+                token_id = token2id.get(token)
+                if token_id is None:
                     continue # An out-of-dictionary token
-                [(token_id, _)] = token_bow
                 if self.extra_term_weighting == "godwin":
                     if token_id not in extra_term_weights:
                         extra_term_weights[token_id] = 0.0
@@ -230,57 +590,124 @@ class LanguageModel(object):
                                 1 + k_location_2 * (segment.murataetal00["length_d"] \
                                 - 2 * segment.document.murataetal00["P"][token]) \
                                 / segment.murataetal00["length_d"]
+        return extra_term_weights
+
+    def vectorize(self, segment, is_query=False):
+        """
+            Returns a vector representation of a segment (or a document) for
+            tf-idf similarity scoring.
+
+            is_query determines, whether the tf-idf weighting scheme for
+            queries will be used rather than the tf-idf weighting scheme for
+            results.
+        """
+        segment_bow = self.bow(segment)
+
+        # Perform base weighting.
+        base_term_weights = {}
+        tfs = [term_frequency for _, term_frequency in segment_bow]
+        for term_id, tf in segment_bow:
+            df = self.dictionary.dfs[term_id]
+            N = self.dictionary.num_docs
+            model = self.tfidf_query if is_query else self.tfidf_result
+            base_term_weights[term_id] = model["tf"](tf, tfs) * model["df"](df, N)
+
+        # Perform extra weighting.
+        extra_term_weights = self.extra_term_weights(segment)
 
         return [(term_id, base_term_weights[term_id] * (extra_term_weights[term_id] \
                                                         if extra_term_weights else 1.0)) \
                 for term_id, _ in segment_bow]
 
+    def vectorize_arrays(self, segment, is_query=False):
+        """
+            Returns a vector representation of a segment (or a document) for
+            tf-idf similarity scoring as an array of term ids in ascending
+            order and an array of term weights. The term weights are computed
+            over whole arrays and agree with vectorize up to rounding errors.
+
+            is_query determines, whether the tf-idf weighting scheme for
+            queries will be used rather than the tf-idf weighting scheme for
+            results.
+        """
+        term_ids, tfs = self.bow_arrays(segment)
+        if not len(term_ids):
+            return term_ids, tfs
+
+        # Perform base weighting.
+        model = self.tfidf_query_arrays if is_query else self.tfidf_result_arrays
+        term_weights = model["tf"](tfs) * model["idf"][term_ids]
+
+        # Perform extra weighting.
+        extra_term_weights = self.extra_term_weights(segment)
+        if extra_term_weights:
+            term_weights = term_weights * fromiter((extra_term_weights[term_id] \
+                                                    for term_id in term_ids.tolist()),
+                                                   dtype=float64, count=len(term_ids))
+
+        return term_ids, term_weights
+
     def similarity(self, query, result):
         """
             Returns cosine similarity between two document segments (or documents). Note that if
             different tf-idf weighting is used for query and result vectors, or when the
             probabilistic BM25 scoring is used, this function is not symmetric.
         """
+        if isinstance(result, Document):
+            statistics_key = "documents"
+        else:
+            assert result in result.document.segments
+            if result.document.qsubject == result:
+                statistics_key = "qsubjects"
+            elif result.document.qbody == result:
+                statistics_key = "qbodies"
+            else:
+                statistics_key = "comments"
+
         if self.use_tfidf:
             # Compute similarity using the tf-idf framework.
-            query_vector = self.vectorize(query, is_query=True)
-            result_vector = self.vectorize(result, is_query=False)
-            if isinstance(result, Document):
-                pivot_stats = self.pivot_stats["documents"]
+            pivot_stats = {"avgu": self.pivot_stats[statistics_key]["avgu"],
+                           "avgb": self.pivot_stats[statistics_key]["avgb"],
+                           "u": len(result.terms),
+                           "b": sum((len(token) for token in result.tokens))}
+            if self.use_arrays:
+                query_term_ids, query_term_weights = self.vectorize_arrays(query, is_query=True)
+                result_term_ids, result_term_weights = self.vectorize_arrays(result, is_query=False)
+                query_norm = self.tfidf_query_arrays["norm"](query_term_weights, None, None, None)
+                result_norm = self.tfidf_result_arrays["norm"](result_term_weights, pivot_stats,
+                                                               self.tfidf_slope)
+                query_indices, result_indices = intersect_term_ids(query_term_ids,
+                                                                   result_term_ids)
+                numerator = float(dot(query_term_weights[query_indices],
+                                      result_term_weights[result_indices]))
             else:
-                assert result in result.document.segments
-                if result.document.qsubject == result:
-                    pivot_stats = self.pivot_stats["qsubjects"]
-                elif result.document.qbody == result:
-                    pivot_stats = self.pivot_stats["qbodies"]
-                else:
-                    pivot_stats = self.pivot_stats["comments"]
-            query_norm = self.tfidf_query["norm"](query_vector, None, None, None)
-            result_norm = self.tfidf_result["norm"]( \
-                result_vector, {"avgu": pivot_stats["avgu"], "avgb": pivot_stats["avgb"],
-                                "u": len(result.terms),
-                                "b": sum((len(token) for token in result.tokens))},
-                self.tfidf_slope)
-            result_term_weights = dict(result_vector)
-            numerator = sum((query_term_weight * result_term_weights[term_id] \
-                             for term_id, query_term_weight in query_vector \
-                             if term_id in result_term_weights))
+                query_vector = self.vectorize(query, is_query=True)
+                result_vector = self.vectorize(result, is_query=False)
+                query_norm = self.tfidf_query["norm"](query_vector, None, None, None)
+                result_norm = self.tfidf_result["norm"](result_vector, pivot_stats,
+                                                        self.tfidf_slope)
+                result_term_weights = dict(result_vector)
+                numerator = sum((query_term_weight * result_term_weights[term_id] \
+                                 for term_id, query_term_weight in query_vector \
+                                 if term_id in result_term_weights))
+            if INSTRUMENTATION.enabled:
+                INSTRUMENTATION.count("scored_pairs")
+                if not (len(query_indices) if self.use_arrays \
+                        else any(term_id in result_term_weights for term_id, _ in query_vector)):
+                    INSTRUMENTATION.count("zero_overlap_pairs")
             return numerator / (query_norm * result_norm) if numerator > 0.0 else 0.0
         else:
             # Compute similarity using the probabilistic BM25 scoring.
-            tfs = dict(self.dictionary.doc2bow(result.tokens))
-            qtfs = dict(self.dictionary.doc2bow(query.tokens))
-            if isinstance(result, Document):
-                avdl = self.bm25_avdl["documents"]
-            else:
-                assert result in result.document.segments
-                if result.document.qsubject == result:
-                    avdl = self.bm25_avdl["qsubjects"]
-                elif result.document.qbody == result:
-                    avdl = self.bm25_avdl["qbodies"]
-                else:
-                    avdl = self.bm25_avdl["comments"]
+            avdl = self.bm25_avdl[statistics_key]
             dl = sum((len(token) for token in result.tokens))
+            # BM25 only sums over the terms that are common to the query and the result, which are
+            # few, so the per-term computation is faster than its array variant.
+            tfs = dict(self.bow(result))
+            qtfs = dict(self.bow(query))
+            if INSTRUMENTATION.enabled:
+                INSTRUMENTATION.count("scored_pairs")
+                if not any(term_id in tfs for term_id in qtfs):
+                    INSTRUMENTATION.count("zero_overlap_pairs")
             return sum((bm25(tfs[term_id], qtf, self.dictionary.num_docs, \
                              self.dictionary.dfs[term_id], dl, avdl, \
                              k1=self.bm25_k1, k3=self.bm25_k3, b=self.bm25_b) \
@@ -0,0 +1,83 @@
+"""
+    This module implements in-process versions of the ranking metrics computed by the SemEval
+    2016/2017 Task 3 scorer. The official scorer remains authoritative for reported results.
+"""
+
+import logging
+import subprocess
+
+LOGGER = logging.getLogger(__name__)
+
+METRICS_THRESHOLD = 10
+SCORER_COMMAND = ["python2", "_scorer/ev.py"]
+
+def rankings(results):
+    """
+        Groups a list of (orgquestion id, thread id, test score, relevant) tuples by <OrgQuestion>
+        ids and returns a list of (orgquestion id, relevance labels) pairs in the order of the
+        first appearance of the ids, where the relevance labels are sorted by decreasing test
+        scores. Ties are broken by the order of appearance, as in the scorer.
+    """
+    orgquestion_ids = []
+    orgquestion_results = {}
+    for orgquestion_id, _, test_score, relevant in results:
+        if orgquestion_id not in orgquestion_results:
+            orgquestion_results[orgquestion_id] = []
+            orgquestion_ids.append(orgquestion_id)
+        orgquestion_results[orgquestion_id].append((test_score, relevant))
+    return [(orgquestion_id,
+             [relevant for _, relevant in sorted(orgquestion_results[orgquestion_id],
+                                                 key=lambda result: result[0], reverse=True)])
+            for orgquestion_id in orgquestion_ids]
+
+def average_precision(relevances, threshold=METRICS_THRESHOLD):
+    """Returns the average precision of the top threshold relevance labels."""
+    precisions = []
+    num_correct = 0
+    for rank, relevant in enumerate(relevances[:threshold]):
+        if relevant:
+            num_correct += 1
+            precisions.append(num_correct / (rank+1))
+    return sum(precisions) / len(precisions) if precisions else 0.0
+
+def reciprocal_rank(relevances, threshold=METRICS_THRESHOLD):
+    """Returns the reciprocal rank of the first relevant label among the top threshold labels."""
+    for rank, relevant in enumerate(relevances[:threshold]):
+        if relevant:
+            return 1.0 / (rank+1)
+    return 0.0
+
+def mean_average_precision(results, threshold=METRICS_THRESHOLD):
+    """
+        Returns the mean average precision (MAP) of a list of (orgquestion id, thread id,
+        test score, relevant) tuples.
+    """
+    average_precisions = [average_precision(relevances, threshold) \
+                          for _, relevances in rankings(results)]
+    return sum(average_precisions) / len(average_precisions)
+
+def mean_reciprocal_rank(results, threshold=METRICS_THRESHOLD):
+    """
+        Returns the mean reciprocal rank (MRR) of a list of (orgquestion id, thread id, test score,
+        relevant) tuples as a percentage, as in the scorer.
+    """
+    reciprocal_ranks = [reciprocal_rank(relevances, threshold) \
+                        for _, relevances in rankings(results)]
+    return 100.0 * sum(reciprocal_ranks) / len(reciprocal_ranks)
+
+def official_scores(test_dirname, gold_base_fname, base_output_fname):
+    """
+        Runs the official SemEval 2016/2017 Task 3 scorer in the scorer directory test_dirname on
+        an output file and returns the MAP, AvgRec, and MRR scores as a comma-separated string
+        formatted by the scorer. The full scorer output is stored next to the output file, as in
+        __main__.sh.
+    """
+    output = subprocess.run(SCORER_COMMAND + [gold_base_fname, base_output_fname],
+                            cwd=test_dirname, stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True).stdout
+    with open("%s/%s.score" % (test_dirname, base_output_fname), "wt") as score_file:
+        score_file.write(output)
+    for line in output.split("\n"):
+        if line.startswith("ALL SCORES:"):
+            return ",".join(line[len("ALL SCORES:"):].split("\t")[1:4])
+    raise ValueError("The scorer produced no scores for %s" % base_output_fname)
@@ -0,0 +1,192 @@
+"""
+    This module implements the parallel featurization of datasets by forked worker processes that
+    share a read-only copy of the parsed datasets and of the language model with their parent.
+"""
+
+import gc
+import logging
+from multiprocessing import get_context
+
+from numpy import array, int32, int64
+
+from instrumentation import INSTRUMENTATION
+from preprocessing import Document, Segment, segment_orgquestions, segment_threads
+
+LOGGER = logging.getLogger(__name__)
+
+SHARDS_PER_PROCESS = 4
+
+# The corpus and the features function of the running parallel featurization, which the forked
+# worker processes inherit from their parent, so that they are never pickled.
+_SHARED = {}
+
+class SharedCorpus(object):
+    """
+        The document pairs of a SemEval 2016/2017 Task 3 dataset stored in flat arrays. Reading the
+        arrays does not update reference counts, so forked processes can share the memory pages of
+        the arrays with their parent instead of copying them.
+    """
+    def __init__(self, dataset_fname):
+        """
+            Parses a dataset and stores the tokens of all document segments in flat arrays.
+
+            self.vocabulary contains every distinct token of the dataset exactly once, and
+            self.token_ids contains the tokens of all segments as indices into self.vocabulary.
+            The tokens of segment i are self.token_ids[self.segment_offsets[i]:
+            self.segment_offsets[i+1]] and the segments of document j are the segments
+            self.document_offsets[j] to self.document_offsets[j+1]-1, where the first segment
+            of a document is its qbody and the second segment is its qsubject.
+
+            Repeated copies of an <OrgQuestion> are stored only once, unless their tokens differ
+            from the stored copy, in which case the differing copy is stored as its own document.
+            self.pairs contains the document indices of the <OrgQuestion> and the <Thread> in every
+            document pair, and self.relevant contains the relevance label of every document pair.
+        """
+        vocabulary = {}
+        token_ids = []
+        segment_offsets = [0]
+        document_offsets = [0]
+        self.document_ids = []
+        self.is_orgquestion = []
+        # The tokens and the index of the last stored copy of every <OrgQuestion>.
+        orgquestion_copies = {}
+        pairs = []
+        self.relevant = []
+
+        def document_segments(document):
+            """Returns the segments of a document in the order in which they are stored."""
+            return [document.qbody, document.qsubject] \
+                   + [segment for segment in document.segments \
+                      if segment != document.qbody and segment != document.qsubject]
+
+        def add_document(document, is_orgquestion):
+            """Stores a document and returns its index."""
+            for segment in document_segments(document):
+                for token in segment.tokens:
+                    if token not in vocabulary:
+                        vocabulary[token] = len(vocabulary)
+                    token_ids.append(vocabulary[token])
+                segment_offsets.append(len(token_ids))
+            document_offsets.append(len(segment_offsets) - 1)
+            self.document_ids.append(document.id)
+            self.is_orgquestion.append(is_orgquestion)
+            return len(self.document_ids) - 1
+
+        for orgquestion, (thread, relevant) in zip(segment_orgquestions([dataset_fname]),
+                                                   segment_threads([dataset_fname])):
+            tokens = [segment.tokens for segment in document_segments(orgquestion)]
+            if orgquestion.id in orgquestion_copies \
+               and orgquestion_copies[orgquestion.id][0] == tokens:
+                orgquestion_index = orgquestion_copies[orgquestion.id][1]
+            else:
+                orgquestion_index = add_document(orgquestion, True)
+                orgquestion_copies[orgquestion.id] = (tokens, orgquestion_index)
+            pairs.append((orgquestion_index, add_document(thread, False)))
+            self.relevant.append(relevant)
+
+        self.vocabulary = [None] * len(vocabulary)
+        for token, token_id in vocabulary.items():
+            self.vocabulary[token_id] = token
+        self.token_ids = array(token_ids, dtype=int32)
+        self.segment_offsets = array(segment_offsets, dtype=int64)
+        self.document_offsets = array(document_offsets, dtype=int64)
+        self.pairs = array(pairs, dtype=int64).reshape(-1, 2)
+
+    def document(self, index, segment_filtering=None):
+        """
+            Reconstructs a document from the flat arrays. The segment_filtering is only applied to
+            <Thread>s, as in the parser.
+        """
+        segment_offsets = self.segment_offsets[self.document_offsets[index]:
+                                               self.document_offsets[index+1]+1].tolist()
+        segments = [Segment(None, tokens=[self.vocabulary[token_id] for token_id \
+                                          in self.token_ids[start:end].tolist()]) \
+                    for start, end in zip(segment_offsets, segment_offsets[1:])]
+        qbody, qsubject = segments[0], segments[1]
+        if self.is_orgquestion[index]:
+            return Document(self.document_ids[index], [qbody, qsubject], qbody, qsubject)
+        return Document(self.document_ids[index], segments, qbody, qsubject,
+                        segment_filtering=segment_filtering)
+
+    def shards(self, num_shards):
+        """
+            Splits the document pairs into at most num_shards contiguous ranges of pair indices,
+            so that all document pairs of an <OrgQuestion> belong to the same range.
+        """
+        boundaries = [0] + [pair_index for pair_index in range(1, len(self.pairs)) \
+                            if self.pairs[pair_index][0] != self.pairs[pair_index-1][0]] \
+                     + [len(self.pairs)]
+        num_orgquestions = len(boundaries) - 1
+        num_shards = max(1, min(num_shards, num_orgquestions))
+        return [(boundaries[shard * num_orgquestions // num_shards],
+                 boundaries[(shard+1) * num_orgquestions // num_shards]) \
+                for shard in range(num_shards)]
+
+def _featurize_shard(shard):
+    """
+        Produces the features of a range of document pairs in the shared corpus together with the
+        instrumentation record of the featurization, or None if the instrumentation is disabled.
+    """
+    # The worker inherits the record of its parent and of its previous shards, which must not be
+    # counted again.
+    INSTRUMENTATION.reset()
+    corpus = _SHARED["corpus"]
+    pair_features = _SHARED["pair_features"]
+    segment_filtering = _SHARED["segment_filtering"]
+    orgquestion_ids = _SHARED["orgquestion_ids"]
+    orgquestions = {}
+    features = []
+    for pair_index in range(*shard):
+        orgquestion_index, thread_index = corpus.pairs[pair_index].tolist()
+        orgquestion_id = corpus.document_ids[orgquestion_index]
+        if orgquestion_ids is not None and orgquestion_id not in orgquestion_ids:
+            continue
+        if orgquestion_index not in orgquestions:
+            orgquestions[orgquestion_index] = corpus.document(orgquestion_index)
+        thread = corpus.document(thread_index, segment_filtering=segment_filtering)
+        features.append((orgquestion_id, thread.id,
+                         pair_features(orgquestions[orgquestion_index], thread),
+                         corpus.relevant[pair_index]))
+    return features, INSTRUMENTATION.record() if INSTRUMENTATION.enabled else None
+
+def featurize_parallel(dataset_fname, pair_features, processes, segment_filtering=None,
+                       orgquestion_ids=None):
+    """
+        Produces a list of (orgquestion id, thread id, features, relevant) tuples for all document
+        pairs in a dataset using a pool of processes forked worker processes. The dataset is parsed
+        by the parent process and the workers featurize shards of <OrgQuestion>s.
+
+        The parsed dataset and the language model that pair_features refers to are inherited by
+        the workers rather than copied, so the memory use grows with the number of workers only
+        by the reconstructed documents of a shard and by the memory pages that a worker writes to.
+
+        If segment_filtering is not None, a text summarization technique is
+        used for the filtering of <Thread> segments.
+
+        If orgquestion_ids is not None, only the document pairs with the listed <OrgQuestion>
+        ids are featurized.
+    """
+    corpus = SharedCorpus(dataset_fname)
+    _SHARED.update(corpus=corpus, pair_features=pair_features,
+                   segment_filtering=segment_filtering, orgquestion_ids=orgquestion_ids)
+    # Move all objects to a permanent generation, so that the garbage collector in the workers does
+    # not write to the memory pages of the inherited objects. gc.freeze is only available in
+    # Python 3.7 and later; on older Pythons, the workers copy the pages that the collector touches.
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    try:
+        with get_context("fork").Pool(processes) as pool:
+            shards = corpus.shards(processes * SHARDS_PER_PROCESS)
+            LOGGER.debug("Featurizing %d shards of %s in %d processes", len(shards),
+                         dataset_fname, processes)
+            features = []
+            for shard_features, record in pool.map(_featurize_shard, shards):
+                features.extend(shard_features)
+                if record is not None:
+                    INSTRUMENTATION.merge(record)
+    finally:
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+        _SHARED.clear()
+    return features
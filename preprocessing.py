@@ -1,11 +1,23 @@
 """This module provides functions for parsing SemEval 2016/2017 Task 3 datasets."""
 
+import atexit
+from collections import deque
+import gzip
+from io import BufferedReader
 from itertools import chain
 import logging
+import lzma
+from multiprocessing import current_process, get_context
+import os
+from queue import Empty, Full, Queue
 import re
+from sys import intern
+from threading import Event, Thread
 import xml.etree.ElementTree as ElementTree
+from zipfile import ZipFile
 
-from gensim.utils import simple_preprocess
+from filenames import DATASET_ARCHIVE_FNAMES, DATASET_DIRNAME
+from instrumentation import INSTRUMENTATION, instrumented
 
 CLEANUP_REGEXES = {
     'html': r'<[^<>]+(>|$)',
@@ -13,8 +25,142 @@ CLEANUP_REGEXES = {
     'urls': r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
 }
 
+# A cleanup regex can only match text that contains its trigger substring.
+CLEANUP_TRIGGERS = {
+    'html': '<',
+    'tags': '[img_assist',
+    'urls': 'http',
+}
+_CLEANUP_PATTERNS = [(CLEANUP_TRIGGERS[name], re.compile(pattern)) \
+                     for name, pattern in CLEANUP_REGEXES.items()]
+
+# Match the maximal runs of non-digit word characters in lowercase text like the tokenizer of
+# gensim.utils.simple_preprocess. In ASCII text, the non-digit word characters are the lowercase
+# letters and the underscore, which are matched faster than the full Unicode character class.
+TOKEN_REGEX = re.compile(r'[^\W\d]+')
+ASCII_TOKEN_REGEX = re.compile(r'[a-z_]+')
+
 LOGGER = logging.getLogger(__name__)
 
+# If TOKENIZATION_PROCESSES is not None, the text of XML elements is cleaned up and tokenized by a
+# pool of worker processes, while the XML is parsed by a reader thread and the documents are
+# assembled by the consumer, so that the three stages run concurrently.
+TOKENIZATION_PROCESSES = None
+TOKENIZATION_CHUNK_SIZE = 256
+TOKENIZATION_WINDOW = 4
+READER_QUEUE_SIZE = 4096
+_TOKENIZATION_POOLS = {}
+
+# The datasets are read in blocks of DATASET_BUFFER_SIZE bytes, since few large reads are much
+# cheaper than many small reads on shared storage.
+DATASET_BUFFER_SIZE = 1 << 20
+# The suffixes of compressed datasets and the functions that open them.
+DATASET_COMPRESSED_SUFFIXES = {
+    ".gz": gzip.open,
+    ".xz": lzma.open,
+}
+
+ORGQUESTION_SEGMENT_TAGS = ("OrgQSubject", "OrgQBody")
+THREAD_SEGMENT_TAGS = ("RelQSubject", "RelQBody", "RelCText")
+
+def tokenize(text):
+    """
+        Cleans up the raw text content of an XML element and transforms it to a list of tokens.
+        The tokens are interned, so that equal tokens are stored and compared as a single object.
+        The output is identical to the output of reference_tokenize.
+    """
+    if text is None:
+        return []
+    for trigger, pattern in _CLEANUP_PATTERNS:
+        if trigger in text:
+            text = pattern.sub('', text)
+    text = text.lower()
+    # str.isascii is only available in Python 3.7 and later.
+    try:
+        text.encode("ascii")
+        token_regex = ASCII_TOKEN_REGEX
+    except UnicodeEncodeError:
+        token_regex = TOKEN_REGEX
+    return [intern(token) for token in token_regex.findall(text) \
+            if 2 <= len(token) <= 15 and token[0] != '_']
+
+def reference_tokenize(text):
+    """
+        Cleans up the raw text content of an XML element and transforms it to a list of tokens
+        using the CLEANUP_REGEXES and gensim.utils.simple_preprocess.
+    """
+    from gensim.utils import simple_preprocess
+
+    if text is None:
+        return []
+    for pattern in CLEANUP_REGEXES.values():
+        text = re.sub(pattern, '', text)
+    return simple_preprocess(text)
+
+def locate_dataset(dataset_fname):
+    """
+        Returns the name of the file that contains a SemEval 2016/2017 Task 3 dataset and the name
+        of the zip archive member that contains the dataset, or None if the file is not a zip
+        archive.
+
+        A dataset is named either by the name of an XML file, of a gzip or xz compressed XML
+        file, or of a zip archive member, such as "datasets/QL-unannotated-data-subtaskA.xml.zip/
+        QL-unannotated-data-subtaskA.xml". If an XML file does not exist, the compressed XML file
+        with a suffix from DATASET_COMPRESSED_SUFFIXES and the members of the archives in
+        DATASET_ARCHIVE_FNAMES are looked up instead, so that the datasets need not be extracted.
+    """
+    if ".zip/" in dataset_fname:
+        archive_fname, member_fname = dataset_fname.split(".zip/", 1)
+        return ("%s.zip" % archive_fname, member_fname)
+    if os.path.exists(dataset_fname):
+        return (dataset_fname, None)
+    for suffix in DATASET_COMPRESSED_SUFFIXES:
+        if os.path.exists(dataset_fname + suffix):
+            return (dataset_fname + suffix, None)
+    member_fname = os.path.relpath(dataset_fname, DATASET_DIRNAME)
+    for archive_fname in DATASET_ARCHIVE_FNAMES:
+        if os.path.exists(archive_fname):
+            with ZipFile(archive_fname) as archive:
+                if member_fname in archive.namelist():
+                    return (archive_fname, member_fname)
+    raise FileNotFoundError("Dataset %s does not exist" % dataset_fname)
+
+def open_dataset(dataset_fname):
+    """
+        Opens a SemEval 2016/2017 Task 3 dataset (see locate_dataset) for reading in binary mode.
+        Compressed datasets are decompressed as they are read.
+    """
+    fname, member_fname = locate_dataset(dataset_fname)
+    if member_fname is not None:
+        # The member keeps the archive file open after the archive has been closed.
+        with ZipFile(fname) as archive:
+            return BufferedReader(archive.open(member_fname), DATASET_BUFFER_SIZE)
+    for suffix, open_compressed in DATASET_COMPRESSED_SUFFIXES.items():
+        if fname.endswith(suffix):
+            return BufferedReader(open_compressed(fname, "rb"), DATASET_BUFFER_SIZE)
+    return open(fname, "rb", buffering=DATASET_BUFFER_SIZE)
+
+def iterparse_dataset(dataset_fname):
+    """
+        Produces the (event, element) pairs of ElementTree.iterparse for the closed XML elements
+        of a SemEval 2016/2017 Task 3 dataset (see open_dataset).
+    """
+    with open_dataset(dataset_fname) as file:
+        yield from ElementTree.iterparse(file)
+
+def tokenizer_mismatches(dataset_fnames):
+    """
+        Produces (dataset filename, tag, text) triples for the XML elements in SemEval 2016/2017
+        Task 3 datasets whose text is tokenized differently by tokenize and reference_tokenize.
+    """
+    segment_tags = ORGQUESTION_SEGMENT_TAGS + THREAD_SEGMENT_TAGS
+    for dataset_fname in dataset_fnames:
+        for event, elem in iterparse_dataset(dataset_fname):
+            if event == "end" and elem.tag in segment_tags:
+                if tokenize(elem.text) != reference_tokenize(elem.text):
+                    yield (dataset_fname, elem.tag, elem.text)
+            elem.clear()
+
 class Document(object):
     """
         A document object that corresponds to <Thread> or <OrgQuestion>
@@ -47,6 +193,9 @@ class Document(object):
             self.terms contains a set of terms that appear in the segment and
             self.tokens contains a list of tokens that appear in the segment.
 
+            self.bow and self.bow_arrays cache the bag-of-words representations
+            of the document that are produced by the language model.
+
             self.document refers back to self. This allows Document object
             to act as Segment objects in certain situations, such as similarity
             computations.
@@ -62,6 +211,8 @@ class Document(object):
         self.qsubject = qsubject
         self.qbody = qbody
         self.document = self
+        self.bow = None
+        self.bow_arrays = None
 
         # Pre-compute statistics for murataelal00 term weighting.
         term_positions = {}
@@ -137,7 +288,7 @@ class Segment(object):
         <OrgQSubject>, <OrgQBody>, <RelQSubject>, <RelQBody>, or <RelCText>
         XML element from SemEval 2016/2017 Task 3 datasets.
     """
-    def __init__(self, text):
+    def __init__(self, text, tokens=None):
         """
             Sets up a document segment object that corresponds to the
             <OrgQSubject>, <OrgQBody>, <RelQSubject>, <RelQBody>, or <RelCText>
@@ -146,6 +297,9 @@ class Segment(object):
             text is the raw unaltered text content of the XML element, which
             is cleaned up and transformed to a list of tokens self.tokens.
 
+            If tokens is not None, it is the list of tokens that was previously
+            produced from the text, and text is not processed.
+
             Each segment can be either active, or filtered out, as indicated
             by the boolean value of self.active. Each segment also belongs to
             at most one document indicated by self.document.
@@ -156,17 +310,17 @@ class Segment(object):
 
             self.terms contains a set of terms that appear in the segment and
             self.tokens contains a list of tokens that appear in the segment.
+
+            self.bow and self.bow_arrays cache the bag-of-words representations
+            of the segment that are produced by the language model.
         """
         assert text is None or isinstance(text, str)
-        if text is None:
-            self.tokens = []
-        else:
-            for pattern in CLEANUP_REGEXES.values():
-                text = re.sub(pattern, '', text)
-            self.tokens = simple_preprocess(text)
+        self.tokens = tokens if tokens is not None else tokenize(text)
         self.terms = set(self.tokens)
         self.active = True
         self.document = None
+        self.bow = None
+        self.bow_arrays = None
 
         # Pre-compute statistics for murataelal00 term weighting.
         self.murataetal00 = {
@@ -179,26 +333,148 @@ class Segment(object):
     def __repr__(self):
         return ' '.join(self.tokens).__repr__()
 
+def _tokenize_chunk(texts):
+    """Tokenizes a list of raw text contents of XML elements."""
+    return [tokenize(text) for text in texts]
+
+def _tokenization_pool():
+    """
+        Returns the pool of tokenization processes, or None if the text is to be tokenized by the
+        consumer. Daemonic processes, such as the workers of other pools, cannot have children and
+        always tokenize the text themselves.
+    """
+    if TOKENIZATION_PROCESSES is None or current_process().daemon:
+        return None
+    if TOKENIZATION_PROCESSES not in _TOKENIZATION_POOLS:
+        pool = get_context("fork").Pool(TOKENIZATION_PROCESSES)
+        atexit.register(pool.terminate)
+        _TOKENIZATION_POOLS[TOKENIZATION_PROCESSES] = pool
+    return _TOKENIZATION_POOLS[TOKENIZATION_PROCESSES]
+
+def _read_elements(dataset_fnames, tags, queue, stopped):
+    """
+        Parses SemEval 2016/2017 Task 3 datasets and puts (tag, attributes, text) triples for
+        the closed XML elements with the given tags to a bounded queue, followed by None. If the
+        parsing fails, the exception is put to the queue instead of None.
+    """
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    try:
+        for dataset_fname in dataset_fnames:
+            for event, elem in INSTRUMENTATION.iterate("parse",
+                                                       iterparse_dataset(dataset_fname)):
+                if stopped.is_set():
+                    return
+                if event == "end" and elem.tag in tags:
+                    put((elem.tag, dict(elem.attrib), elem.text))
+                elem.clear()
+        put(None)
+    except Exception as exception:
+        put(exception)
+
+def _parse_elements(dataset_fnames, tags):
+    """
+        Produces (tag, attributes, text) triples for the closed XML elements with the given tags
+        in SemEval 2016/2017 Task 3 datasets. The datasets are parsed ahead by a reader thread.
+    """
+    queue = Queue(READER_QUEUE_SIZE)
+    stopped = Event()
+    reader = Thread(target=_read_elements, args=(dataset_fnames, tags, queue, stopped),
+                    daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        while reader.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Empty:
+                continue
+        reader.join()
+
+def _tokenize_elements(dataset_fnames, tags, segment_tags):
+    """
+        Produces (tag, attributes, tokens) triples for the closed XML elements with the given tags
+        in SemEval 2016/2017 Task 3 datasets in document order. The tokens are the tokenized text
+        of elements with segment_tags and None for other elements.
+
+        If TOKENIZATION_PROCESSES is not None, the elements are parsed by a reader thread and
+        chunks of TOKENIZATION_CHUNK_SIZE elements are tokenized by a pool of processes. At most
+        TOKENIZATION_WINDOW chunks per process are tokenized ahead of the consumer and at most
+        READER_QUEUE_SIZE elements are parsed ahead of the tokenization, so the memory use does
+        not grow with the size of the datasets.
+    """
+    pool = _tokenization_pool()
+    if pool is None:
+        tokenize_text = instrumented("tokenize")(tokenize) if INSTRUMENTATION.enabled else tokenize
+        for dataset_fname in dataset_fnames:
+            for event, elem in INSTRUMENTATION.iterate("parse",
+                                                       iterparse_dataset(dataset_fname)):
+                if event == "end" and elem.tag in tags:
+                    yield (elem.tag, elem.attrib,
+                           tokenize_text(elem.text) if elem.tag in segment_tags else None)
+                elem.clear()
+        return
+
+    def tokenize_ahead(chunk):
+        """Starts the tokenization of a chunk of elements."""
+        texts = [text for tag, _, text in chunk if tag in segment_tags]
+        return (chunk, pool.apply_async(_tokenize_chunk, (texts,)))
+
+    def reassemble(chunk, result):
+        """Produces the elements of a chunk together with their tokens."""
+        # Only the time spent waiting for the tokenization processes is recorded.
+        with INSTRUMENTATION.stage("tokenize"):
+            tokens = iter(result.get())
+        for tag, attrib, _ in chunk:
+            yield (tag, attrib, next(tokens) if tag in segment_tags else None)
+
+    window = deque()
+    chunk = []
+    for element in _parse_elements(dataset_fnames, tags):
+        chunk.append(element)
+        if len(chunk) == TOKENIZATION_CHUNK_SIZE:
+            window.append(tokenize_ahead(chunk))
+            chunk = []
+            if len(window) > TOKENIZATION_WINDOW * TOKENIZATION_PROCESSES:
+                yield from reassemble(*window.popleft())
+    if chunk:
+        window.append(tokenize_ahead(chunk))
+    while window:
+        yield from reassemble(*window.popleft())
+
 def segment_orgquestions(dataset_fnames):
     """Segments <OrgQuestion> elements from SemEval 2016/2017 Task 3 datasets."""
     qbody = None
     qsubject = None
-    for dataset_fname in dataset_fnames:
-        for event, elem in ElementTree.iterparse(dataset_fname):
-            if event == "end":
-                if elem.tag == "OrgQSubject" or elem.tag == "OrgQBody":
-                    segment = Segment(elem.text)
-                    if elem.tag == "OrgQSubject":
-                        qsubject = segment
-                    else:
-                        qbody = segment
-                elif elem.tag == "OrgQuestion":
-                    id = elem.attrib["ORGQ_ID"]
-                    assert qbody is not None and qsubject is not None
-                    yield Document(id, [qbody, qsubject], qbody, qsubject)
-                    qbody = None
-                    qsubject = None
-            elem.clear()
+    for tag, attrib, tokens in _tokenize_elements(dataset_fnames,
+                                                  ORGQUESTION_SEGMENT_TAGS + ("OrgQuestion",),
+                                                  ORGQUESTION_SEGMENT_TAGS):
+        if tag == "OrgQSubject" or tag == "OrgQBody":
+            segment = Segment(None, tokens=tokens)
+            if tag == "OrgQSubject":
+                qsubject = segment
+            else:
+                qbody = segment
+        elif tag == "OrgQuestion":
+            id = attrib["ORGQ_ID"]
+            assert qbody is not None and qsubject is not None
+            yield Document(id, [qbody, qsubject], qbody, qsubject)
+            qbody = None
+            qsubject = None
 
 def segment_threads(dataset_fnames, segment_filtering=None):
     """
@@ -213,35 +489,34 @@ def segment_threads(dataset_fnames, segment_filtering=None):
     relevant = None
     qbody = None
     qsubject = None
-    for dataset_fname in dataset_fnames:
-        for event, elem in ElementTree.iterparse(dataset_fname):
-            if event == "end":
-                if elem.tag == "RelQSubject" or elem.tag == "RelQBody" or elem.tag == "RelCText":
-                    segment = Segment(elem.text)
-                    if elem.tag == "RelQSubject":
-                        qsubject = segment
-                    if elem.tag == "RelQBody":
-                        qbody = segment
-                    elif elem.tag == "RelCText":
-                        assert segments
-                        segments.append(segment)
-                elif elem.tag == "RelQuestion":
-                    if "RELQ_RELEVANCE2ORGQ" in elem.attrib:
-                        relevance_label = elem.attrib["RELQ_RELEVANCE2ORGQ"]
-                        relevant = relevance_label == "PerfectMatch" \
-                                   or relevance_label == "Relevant"
-                    assert qbody is not None and qsubject is not None
-                    segments.append(qbody)
-                    segments.append(qsubject)
-                elif elem.tag == "Thread":
-                    id = elem.attrib["THREAD_SEQUENCE"]
-                    yield (Document(id, segments, qbody, qsubject, \
-                                    segment_filtering=segment_filtering),
-                           relevant)
-                    segments = []
-                    qbody = None
-                    qsubject = None
-            elem.clear()
+    for tag, attrib, tokens in _tokenize_elements(dataset_fnames,
+                                                  THREAD_SEGMENT_TAGS + ("RelQuestion", "Thread"),
+                                                  THREAD_SEGMENT_TAGS):
+        if tag == "RelQSubject" or tag == "RelQBody" or tag == "RelCText":
+            segment = Segment(None, tokens=tokens)
+            if tag == "RelQSubject":
+                qsubject = segment
+            if tag == "RelQBody":
+                qbody = segment
+            elif tag == "RelCText":
+                assert segments
+                segments.append(segment)
+        elif tag == "RelQuestion":
+            if "RELQ_RELEVANCE2ORGQ" in attrib:
+                relevance_label = attrib["RELQ_RELEVANCE2ORGQ"]
+                relevant = relevance_label == "PerfectMatch" \
+                           or relevance_label == "Relevant"
+            assert qbody is not None and qsubject is not None
+            segments.append(qbody)
+            segments.append(qsubject)
+        elif tag == "Thread":
+            id = attrib["THREAD_SEQUENCE"]
+            yield (Document(id, segments, qbody, qsubject, \
+                            segment_filtering=segment_filtering),
+                   relevant)
+            segments = []
+            qbody = None
+            qsubject = None
 
 def retrieve_comment_relevancies(dataset_fnames):
     """
@@ -250,7 +525,7 @@ def retrieve_comment_relevancies(dataset_fnames):
     """
     relevancies = []
     for dataset_fname in dataset_fnames:
-        for event, elem in ElementTree.iterparse(dataset_fname):
+        for event, elem in iterparse_dataset(dataset_fname):
             if event == "end":
                 if elem.tag == "RelComment":
                     relevance_label = elem.attrib["RELC_RELEVANCE2RELQ"]
@@ -261,3 +536,19 @@ def retrieve_comment_relevancies(dataset_fnames):
                     yield relevancies
                     relevancies = []
             elem.clear()
+
+def retrieve_orgquestion_ids(dataset_fnames):
+    """
+        Extracts the unique ORGQ_ID attributes of <OrgQuestion> elements from SemEval 2016/2017
+        Task 3 datasets in the order of their first appearance.
+    """
+    orgquestion_ids = set()
+    for dataset_fname in dataset_fnames:
+        for event, elem in iterparse_dataset(dataset_fname):
+            if event == "end":
+                if elem.tag == "OrgQuestion":
+                    id = elem.attrib["ORGQ_ID"]
+                    if id not in orgquestion_ids:
+                        orgquestion_ids.add(id)
+                        yield id
+            elem.clear()
@@ -0,0 +1,92 @@
+"""
+    This module implements a regression check that evaluates a sample of the configurations in the
+    published grid search results and compares the scores with the published scores.
+"""
+
+import csv
+import logging
+from random import Random
+from time import perf_counter
+
+import evaluation
+from experiment import run
+from filenames import GRID_SEARCH_RESULTS_FNAME
+from metrics import official_scores
+
+LOGGER = logging.getLogger(__name__)
+
+REGRESSION_SAMPLE_SIZE = 30
+REGRESSION_RANDOM_STATE = 12345
+# The grid search results were produced on the dev dataset.
+REGRESSION_YEAR = "dev"
+
+def load_published_results(fname=GRID_SEARCH_RESULTS_FNAME):
+    """
+        Returns a list of (configuration string, scores) pairs from a comma-separated results
+        file, where the scores are the MAP, AvgRec, and MRR strings formatted by the scorer.
+    """
+    with open(fname, "rt", newline="") as file:
+        return [(row[0], tuple(row[1:4])) for row in csv.reader(file) \
+                if row and row[0] != "config"]
+
+def _stratum(config):
+    """Returns the method and the base term weighting scheme of a configuration string."""
+    method, _, base_term_weighting = config.split("-")[:3]
+    return (method, base_term_weighting.split("_")[0])
+
+def sample_published_results(results, sample_size=REGRESSION_SAMPLE_SIZE,
+                             random_state=REGRESSION_RANDOM_STATE):
+    """
+        Returns a random sample of sample_size (configuration string, scores) pairs. The sample is
+        spread evenly across the methods and the base term weighting schemes, so that the
+        rare tf-idf configurations are sampled as often as the BM25 configurations.
+    """
+    strata = {}
+    for result in results:
+        strata.setdefault(_stratum(result[0]), []).append(result)
+    random = Random(random_state)
+    for stratum in strata.values():
+        random.shuffle(stratum)
+    sample = []
+    strata = [strata[key] for key in sorted(strata)]
+    while len(sample) < sample_size and any(strata):
+        for stratum in strata:
+            if stratum and len(sample) < sample_size:
+                sample.append(stratum.pop())
+    return sample
+
+def scores_match(published_scores, scores):
+    """
+        Returns whether scores agree with published scores to the precision of the published
+        scores, i.e. whether they differ by at most a half of the last published digit.
+    """
+    for published_score, score in zip(published_scores, scores):
+        decimals = len(published_score.split(".")[1]) if "." in published_score else 0
+        if abs(float(score) - float(published_score)) > 0.5 * 10**-decimals + 1e-12:
+            return False
+    return True
+
+def check_published_results(results, year=REGRESSION_YEAR):
+    """
+        Evaluates (configuration string, published scores) pairs on the datasets of a year with
+        the official scorer and produces (configuration string, published scores, scores,
+        whether the scores match, runtime in seconds) tuples. The features are computed anew
+        rather than loaded from the feature cache and the runtime includes the training and the
+        evaluation, but not the scorer.
+    """
+    cache_features = evaluation.CACHE_FEATURES
+    evaluation.CACHE_FEATURES = False
+    try:
+        for config, published_scores in results:
+            started = perf_counter()
+            test_dirname, gold_base_fname, base_output_fname = run(config, year)
+            runtime = perf_counter() - started
+            scores = tuple(official_scores(test_dirname, gold_base_fname,
+                                           base_output_fname).split(","))
+            matches = scores_match(published_scores, scores)
+            if not matches:
+                LOGGER.error("scores of %s differ: %s published, %s produced", config,
+                             ",".join(published_scores), ",".join(scores))
+            yield (config, published_scores, scores, matches, runtime)
+    finally:
+        evaluation.CACHE_FEATURES = cache_features
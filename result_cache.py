@@ -0,0 +1,95 @@
+"""This module implements a content-addressed cache of evaluation results."""
+
+from hashlib import sha256
+import logging
+import os
+import sqlite3
+
+from filenames import RESULT_CACHE_FNAME, UNANNOTATED_DATASET_DICTIONARY_FNAME, \
+    UNANNOTATED_DATASET_PIVOT_STATS_FNAME, UNANNOTATED_DATASET_BM25_STATS_FNAME
+from preprocessing import locate_dataset, open_dataset
+
+LOGGER = logging.getLogger(__name__)
+MODEL_ARTIFACT_FNAMES = [UNANNOTATED_DATASET_DICTIONARY_FNAME,
+                         UNANNOTATED_DATASET_PIVOT_STATS_FNAME,
+                         UNANNOTATED_DATASET_BM25_STATS_FNAME]
+SQLITE_TIMEOUT = 600.0
+
+class ResultCache(object):
+    """
+        A cache of evaluation results that is keyed by a configuration string, and by the hashes of
+        the dataset files and of the language model artifacts that the results were produced from.
+    """
+    def __init__(self, fname=RESULT_CACHE_FNAME):
+        """
+            Opens a result cache stored in an SQLite database in a file named fname, creating the
+            database if it does not exist.
+
+            Besides the results, the database also stores the hashes of files together with their
+            sizes and modification times, so that a file is only hashed again after it has changed.
+        """
+        self.connection = sqlite3.connect(fname, timeout=SQLITE_TIMEOUT)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY, config TEXT, scores TEXT)""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS file_hashes (
+                    fname TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)""")
+
+    def file_hash(self, fname):
+        """
+            Returns the SHA-256 hash of the content of a file. The content of a compressed dataset
+            or of a dataset in a zip archive is hashed after decompression (see open_dataset), so
+            that the hash does not depend on how the dataset is stored.
+        """
+        stat = os.stat(locate_dataset(fname)[0])
+        row = self.connection.execute("""
+            SELECT digest FROM file_hashes WHERE fname = ? AND size = ? AND mtime_ns = ?""",
+                                      (fname, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0]
+        LOGGER.info("hashing %s", fname)
+        digest = sha256()
+        with open_dataset(fname) as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                                    (fname, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def fingerprint(self, dataset_fnames):
+        """
+            Returns a fingerprint of the dataset files and of the language model artifacts.
+            Results are only reused when the fingerprint is unchanged.
+        """
+        digest = sha256()
+        for fname in dataset_fnames + MODEL_ARTIFACT_FNAMES:
+            digest.update(("%s\t%s\n" % (fname, self.file_hash(fname))).encode("utf8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(config, fingerprint):
+        """Returns the key of the results for a configuration string and a fingerprint."""
+        return sha256(("%s\t%s" % (config, fingerprint)).encode("utf8")).hexdigest()
+
+    def get(self, config, fingerprint):
+        """
+            Returns the scores of a configuration string as a comma-separated string, or None if
+            the scores are not in the cache.
+        """
+        row = self.connection.execute("SELECT scores FROM results WHERE key = ?",
+                                      (self.key(config, fingerprint),)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, config, fingerprint, scores):
+        """Stores the scores of a configuration string as a comma-separated string."""
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                                    (self.key(config, fingerprint), config, scores))
+
+    def close(self):
+        """Closes the underlying database connection."""
+        self.connection.close()
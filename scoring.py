@@ -5,7 +5,10 @@
 
 import logging
 from math import log, sqrt
-from numpy import mean
+from random import Random
+
+from numpy import array, dot, float64, maximum, mean, where
+from numpy import log as array_log
 
 LOGGER = logging.getLogger(__name__)
 
@@ -14,6 +17,10 @@ OKAPI_K1 = 1.2
 OKAPI_K3 = 1000.0
 OKAPI_B = 0.75
 
+ARRAY_CHECK_NUM_SAMPLES = 1000
+ARRAY_CHECK_RANDOM_STATE = 12345
+ARRAY_CHECK_RELATIVE_TOLERANCE = 1e-12
+
 def bm25(tf, qtf, N, df, dl, avdl, k1=OKAPI_K1, k3=OKAPI_K3, b=OKAPI_B):
     """The Okapi BM25 function for a single term."""
     return log((N-df+0.5) / (df+0.5), LOG_BASE) * \
@@ -83,3 +90,119 @@ def norm_u(_, pivot_stats, s):
 def norm_b(_, pivot_stats, s):
     """Pivoted byte normalization."""
     return 1.0 - s + s * pivot_stats["b"] / pivot_stats["avgb"]
+
+# The following methods implement the above methods over numpy arrays of term frequencies, document
+# frequencies, and term weights. The term frequency weighting methods take the term frequencies of
+# all terms in a segment and return the weights of all terms at once, which avoids recomputing the
+# maximum and the average term frequency for every term. The above methods serve as a reference.
+def bm25_array(tfs, qtfs, N, dfs, dl, avdl, k1=OKAPI_K1, k3=OKAPI_K3, b=OKAPI_B):
+    """The Okapi BM25 function for arrays of terms."""
+    return array_log((N-dfs+0.5) / (dfs+0.5)) / log(LOG_BASE) * \
+        ((k1+1) * tfs) / (k1 * ((1-b) + b * dl / avdl) + tfs) * \
+        (k3+1)*qtfs / (k3+qtfs)
+
+def tf_n_array(tfs):
+    """Natural term frequency."""
+    return tfs
+
+def tf_l_array(tfs):
+    """Logarithmic term frequency."""
+    return 1.0 + array_log(tfs) / log(LOG_BASE)
+
+def tf_d_array(tfs):
+    """Double-logarithmic term frequency."""
+    return 1.0 + array_log(1.0 + array_log(tfs) / log(LOG_BASE)) / log(LOG_BASE)
+
+def tf_a_array(tfs):
+    """Augmented term frequency."""
+    return 0.5 + (0.5 * tfs) / tfs.max()
+
+def tf_b_array(tfs):
+    """Boolean term frequency."""
+    return where(tfs > 0.0, 1.0, 0.0)
+
+def tf_L_array(tfs):
+    """Logarithmic averaged term frequency."""
+    return (1.0 + array_log(tfs)) / (1.0 + log(mean(tfs)))
+
+def df_n_array(dfs, _):
+    """No document frequency."""
+    return 1.0 + 0.0 * dfs
+
+def df_f_array(dfs, N):
+    """Inverse document frequency."""
+    return array_log(1.0 * N / dfs) / log(LOG_BASE)
+
+def df_F_array(dfs, N):
+    """Inverse document frequency taken to the power of 10."""
+    return (array_log(1.0 * N / dfs) / log(LOG_BASE))**10
+
+def df_t_array(dfs, N):
+    """Inverse document frequency."""
+    return array_log((N + 1.0) / dfs) / log(LOG_BASE)
+
+def df_p_array(dfs, N):
+    """Probabilistic inverse document frequency."""
+    return maximum(0.0, array_log(1.0 * (N - dfs) / dfs) / log(LOG_BASE))
+
+def norm_c_array(weights, *_):
+    """Cosine normalization."""
+    return sqrt(dot(weights, weights))
+
+ARRAY_VARIANTS = {
+    bm25: bm25_array,
+    tf_n: tf_n_array, tf_l: tf_l_array, tf_d: tf_d_array, tf_a: tf_a_array, tf_b: tf_b_array,
+    tf_L: tf_L_array,
+    df_n: df_n_array, df_f: df_f_array, df_F: df_F_array, df_t: df_t_array, df_p: df_p_array,
+    # The pivoted normalizations do not depend on the term weights.
+    norm_n: norm_n, norm_c: norm_c_array, norm_u: norm_u, norm_b: norm_b,
+}
+
+def array_variant_mismatches(num_samples=ARRAY_CHECK_NUM_SAMPLES,
+                             random_state=ARRAY_CHECK_RANDOM_STATE,
+                             rel_tol=ARRAY_CHECK_RELATIVE_TOLERANCE):
+    """
+        Produces (function name, inputs, reference output, output) tuples for the randomly sampled
+        inputs on which the methods and their array variants disagree by more than a relative
+        tolerance rel_tol.
+    """
+    random = Random(random_state)
+
+    def close(reference_output, output):
+        """Returns whether two outputs agree."""
+        return abs(reference_output - output) <= rel_tol * max(abs(reference_output), abs(output))
+
+    for _ in range(num_samples):
+        N = random.randint(2, 10**6)
+        tfs = [random.choice((1, 1, 1, 2, 3, random.randint(1, 100))) \
+               for _ in range(random.randint(1, 200))]
+        dfs = [random.randint(1, N-1) for _ in tfs]
+        qtfs = [random.randint(1, 10) for _ in tfs]
+        dl = random.randint(1, 10**4)
+        avdl = random.uniform(1.0, 10**4)
+        k1, k3, b = random.uniform(0.0, 3.0), random.choice((0.0, 1000.0)), random.uniform(0.0, 1.0)
+        tf_array = array(tfs, dtype=float64)
+        df_array = array(dfs, dtype=float64)
+        for function in (tf_n, tf_l, tf_d, tf_a, tf_b, tf_L):
+            outputs = ARRAY_VARIANTS[function](tf_array)
+            for tf, output in zip(tfs, outputs):
+                reference_output = function(tf, tfs)
+                if not close(reference_output, output):
+                    yield (function.__name__, (tf, tfs), reference_output, output)
+        for function in (df_n, df_f, df_F, df_t, df_p):
+            outputs = ARRAY_VARIANTS[function](df_array, N)
+            for df, output in zip(dfs, outputs):
+                reference_output = function(df, N)
+                if not close(reference_output, output):
+                    yield (function.__name__, (df, N), reference_output, output)
+        outputs = bm25_array(tf_array, array(qtfs, dtype=float64), N, df_array, dl, avdl,
+                             k1=k1, k3=k3, b=b)
+        for tf, qtf, df, output in zip(tfs, qtfs, dfs, outputs):
+            reference_output = bm25(tf, qtf, N, df, dl, avdl, k1=k1, k3=k3, b=b)
+            if not close(reference_output, output):
+                yield ("bm25", (tf, qtf, N, df, dl, avdl, k1, k3, b), reference_output, output)
+        weights = [random.uniform(0.0, 10.0) for _ in tfs]
+        reference_output = norm_c(list(enumerate(weights)))
+        output = norm_c_array(array(weights, dtype=float64))
+        if not close(reference_output, output):
+            yield ("norm_c", (weights,), reference_output, output)
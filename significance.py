@@ -0,0 +1,207 @@
+"""
+    This module implements paired significance tests of the differences in the mean average
+    precision (MAP) between configurations, and the Benjamini-Hochberg procedure that controls the
+    false discovery rate (FDR) over all tested pairs of configurations.
+"""
+
+from itertools import combinations
+import logging
+import os
+
+from numpy import absolute, arange, argsort, array, bincount, minimum, zeros
+from numpy.random import RandomState
+
+from experiment import determine_filenames, score
+from filenames import TEST_PREDICTIONS_BASE_DIRNAME
+from metrics import average_precision, rankings
+
+LOGGER = logging.getLogger(__name__)
+
+SIGNIFICANCE_RESAMPLES = 10000
+SIGNIFICANCE_RANDOM_STATE = 12345
+SIGNIFICANCE_ALPHA = 0.05
+# The number of pairs of configurations whose resampled differences are kept in memory at once.
+SIGNIFICANCE_CHUNK_SIZE = 1000
+# The tolerance of the comparisons between the resampled and the observed differences, which are
+# computed in a different order and can differ by rounding errors.
+SIGNIFICANCE_TOLERANCE = 1e-12
+
+def _parse_score(field):
+    """
+        Parses a test score in an output file with predictions. The scores are written by repr,
+        which wraps the numpy scalars in their type under numpy 2.0 and later, such as
+        np.float64(0.25).
+    """
+    if field.endswith(")"):
+        field = field[field.index("(") + 1:-1]
+    return float(field)
+
+def read_results(output_fname, gold_fname):
+    """
+        Reads an output file with predictions and a gold results file in the format of the
+        SemEval 2016/2017 Task 3 scorer and returns a list of (orgquestion id, thread id,
+        test score, relevant) tuples.
+    """
+    relevances = {}
+    with open(gold_fname, "rt") as gold_file:
+        for line in gold_file:
+            fields = line.rstrip("\n").split("\t")
+            relevances[(fields[0], fields[1])] = fields[4] == "true"
+    results = []
+    with open(output_fname, "rt") as output_file:
+        for line in output_file:
+            fields = line.rstrip("\n").split("\t")
+            results.append((fields[0], fields[1], _parse_score(fields[3]),
+                            relevances.get((fields[0], fields[1]), False)))
+    return results
+
+def config_average_precisions(config, year):
+    """
+        Returns a dict that maps the <OrgQuestion> ids of the test dataset of a year to the average
+        precisions of a configuration string. The predictions are read from the output file
+        produced by run if it exists and they are produced in-process by score otherwise.
+    """
+    test_dirname, _, gold_base_fname, _, _ = determine_filenames(year)
+    base_output_fname = "%s/subtask_B_%s-%s.txt" % (TEST_PREDICTIONS_BASE_DIRNAME, config, year)
+    output_fname = "%s/%s" % (test_dirname, base_output_fname)
+    if os.path.exists(output_fname):
+        results = read_results(output_fname, "%s/%s" % (test_dirname, gold_base_fname))
+    else:
+        LOGGER.info("%s does not exist, scoring %s in-process", output_fname, config)
+        results = score(config, year)
+    return {orgquestion_id: average_precision(relevances) \
+            for orgquestion_id, relevances in rankings(results)}
+
+def load_average_precisions(configs, year):
+    """
+        Returns a list of the <OrgQuestion> ids of the test dataset of a year and a matrix of the
+        average precisions of configuration strings, where the rows correspond to the
+        configurations and the columns to the <OrgQuestion>s.
+    """
+    orgquestion_ids = None
+    rows = []
+    for config in configs:
+        average_precisions = config_average_precisions(config, year)
+        if orgquestion_ids is None:
+            orgquestion_ids = sorted(average_precisions)
+        elif set(average_precisions) != set(orgquestion_ids):
+            raise ValueError("The predictions of %s contain different orgquestions" % config)
+        rows.append([average_precisions[orgquestion_id] for orgquestion_id in orgquestion_ids])
+    return orgquestion_ids, array(rows, dtype=float)
+
+def _resampled_pvalues(resampled_sums, pairs, observed_sums,
+                       chunk_size=SIGNIFICANCE_CHUNK_SIZE):
+    """
+        Returns the two-sided p-values of pairs of configurations given the observed sums of the
+        differences in the average precisions of the pairs and a matrix of the resampled sums of
+        the average precisions of the configurations under the null hypothesis. Since the sums
+        are linear in the average precisions, the resampled sums of the differences of a pair are
+        the differences of the resampled sums of its configurations.
+    """
+    num_resamples = resampled_sums.shape[1]
+    num_extreme = zeros(len(pairs))
+    for chunk_start in range(0, len(pairs), chunk_size):
+        chunk = pairs[chunk_start:chunk_start+chunk_size]
+        chunk_observed_sums = absolute(observed_sums[chunk_start:chunk_start+chunk_size])
+        chunk_resampled_sums = resampled_sums[chunk[:, 0]] - resampled_sums[chunk[:, 1]]
+        num_extreme[chunk_start:chunk_start+chunk_size] = \
+            (absolute(chunk_resampled_sums) \
+             >= chunk_observed_sums[:, None] - SIGNIFICANCE_TOLERANCE).sum(axis=1)
+    return (num_extreme + 1) / (num_resamples + 1)
+
+def randomization_tests(average_precisions, pairs, resamples=SIGNIFICANCE_RESAMPLES,
+                        random_state=SIGNIFICANCE_RANDOM_STATE):
+    """
+        Performs paired randomization tests of the differences in the MAP of pairs of
+        configurations, where average_precisions is a matrix of the average precisions of the
+        configurations (see load_average_precisions) and pairs is a sequence of pairs of row
+        indices. Returns the differences in the MAP and the two-sided p-values of the pairs.
+
+        Under the null hypothesis, the signs of the differences in the average precision of
+        every <OrgQuestion> are exchangeable. The sign flips are drawn once from random_state and
+        shared by all pairs, so that all pairs are tested by a single matrix product.
+    """
+    pairs = array(pairs, dtype=int).reshape(-1, 2)
+    num_orgquestions = average_precisions.shape[1]
+    signs = RandomState(random_state).randint(2, size=(resamples, num_orgquestions)) * 2 - 1
+    resampled_sums = average_precisions.dot(signs.T)
+    observed_sums = average_precisions[pairs[:, 0]].sum(axis=1) \
+                    - average_precisions[pairs[:, 1]].sum(axis=1)
+    pvalues = _resampled_pvalues(resampled_sums, pairs, observed_sums)
+    return observed_sums / num_orgquestions, pvalues
+
+def bootstrap_tests(average_precisions, pairs, resamples=SIGNIFICANCE_RESAMPLES,
+                    random_state=SIGNIFICANCE_RANDOM_STATE):
+    """
+        Performs paired bootstrap tests of the differences in the MAP of pairs of configurations,
+        where average_precisions is a matrix of the average precisions of the configurations (see
+        load_average_precisions) and pairs is a sequence of pairs of row indices. Returns the
+        differences in the MAP and the two-sided p-values of the pairs.
+
+        The <OrgQuestion>s are resampled with replacement and the bootstrap distribution of a
+        difference is shifted by the observed difference to obtain its distribution under the
+        null hypothesis. The resamples are drawn once from random_state and shared by all pairs,
+        so that all pairs are tested by a single matrix product.
+    """
+    pairs = array(pairs, dtype=int).reshape(-1, 2)
+    num_orgquestions = average_precisions.shape[1]
+    indices = RandomState(random_state).randint(num_orgquestions,
+                                                size=(resamples, num_orgquestions))
+    # The number of times every <OrgQuestion> is drawn in every resample.
+    counts = bincount((indices + arange(resamples)[:, None] * num_orgquestions).ravel(),
+                      minlength=resamples * num_orgquestions).reshape(resamples, num_orgquestions)
+    observed_sums = average_precisions[pairs[:, 0]].sum(axis=1) \
+                    - average_precisions[pairs[:, 1]].sum(axis=1)
+    # Centering the average precisions of every configuration centers the differences of pairs.
+    centered_average_precisions = average_precisions \
+                                  - average_precisions.mean(axis=1)[:, None]
+    resampled_sums = centered_average_precisions.dot(counts.T)
+    pvalues = _resampled_pvalues(resampled_sums, pairs, observed_sums)
+    return observed_sums / num_orgquestions, pvalues
+
+SIGNIFICANCE_TESTS = {
+    "randomization": randomization_tests,
+    "bootstrap": bootstrap_tests,
+}
+
+def benjamini_hochberg(pvalues):
+    """
+        Returns the Benjamini-Hochberg adjusted p-values (q-values) of p-values. Rejecting the
+        hypotheses whose q-values are at most alpha controls the FDR at the level alpha.
+    """
+    pvalues = array(pvalues, dtype=float)
+    num_pvalues = len(pvalues)
+    if not num_pvalues:
+        return pvalues
+    order = argsort(pvalues, kind="mergesort")
+    ranked_qvalues = pvalues[order] * num_pvalues / arange(1, num_pvalues + 1)
+    ranked_qvalues = minimum.accumulate(ranked_qvalues[::-1])[::-1]
+    qvalues = zeros(num_pvalues)
+    qvalues[order] = minimum(ranked_qvalues, 1.0)
+    return qvalues
+
+def compare_configs(configs, year, test="randomization", resamples=SIGNIFICANCE_RESAMPLES,
+                    random_state=SIGNIFICANCE_RANDOM_STATE, alpha=SIGNIFICANCE_ALPHA):
+    """
+        Tests the differences in the MAP of all pairs of configuration strings on the test
+        dataset of a year using a paired significance test from SIGNIFICANCE_TESTS and produces
+        (first config, second config, first MAP, second MAP, p-value, q-value, significant)
+        tuples, where the q-values are adjusted for the FDR over all pairs and the difference is
+        significant if its q-value is at most alpha.
+    """
+    configs = list(configs)
+    if len(configs) < 2:
+        return
+    _, average_precisions = load_average_precisions(configs, year)
+    mean_average_precisions = average_precisions.mean(axis=1)
+    pairs = list(combinations(range(len(configs)), 2))
+    LOGGER.info("testing %d pairs of configurations on %d orgquestions", len(pairs),
+                average_precisions.shape[1])
+    _, pvalues = SIGNIFICANCE_TESTS[test](average_precisions, pairs, resamples=resamples,
+                                          random_state=random_state)
+    qvalues = benjamini_hochberg(pvalues)
+    LOGGER.info("found %d significant differences at the FDR level %f",
+                (qvalues <= alpha).sum(), alpha)
+    for (first, second), pvalue, qvalue in zip(pairs, pvalues, qvalues):
+        yield (configs[first], configs[second], mean_average_precisions[first],
+               mean_average_precisions[second], pvalue, qvalue, qvalue <= alpha)
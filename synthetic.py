@@ -0,0 +1,192 @@
+"""
+    This module generates synthetic datasets in the format of the SemEval 2016/2017 Task 3 datasets,
+    which can be used to benchmark the code without downloading the SemEval datasets.
+"""
+
+from bisect import bisect
+from itertools import accumulate
+import logging
+import os
+from random import Random
+from string import ascii_lowercase
+from xml.sax.saxutils import escape, quoteattr
+
+from filenames import SUBTASK_B_TRAIN2016_DATASET_FNAMES, DEV_DATASET_FNAME, \
+    TEST2016_DATASET_FNAME, TEST2017_DATASET_FNAME, UNANNOTATED_DATASET_FNAME, \
+    TEST2016_PREDICTIONS_DIRNAME, TEST2017_PREDICTIONS_DIRNAME, SYNTHETIC_DATASETS_MARKER_FNAME
+
+LOGGER = logging.getLogger(__name__)
+
+SYNTHETIC_NUM_ORGQUESTIONS = 20
+SYNTHETIC_THREADS_PER_ORGQUESTION = 10
+SYNTHETIC_COMMENTS_PER_THREAD = 10
+SYNTHETIC_VOCABULARY_SIZE = 5000
+SYNTHETIC_ZIPF_EXPONENT = 1.0
+SYNTHETIC_RANDOM_STATE = 12345
+
+# The numbers of <Thread>s in the unannotated dataset per <OrgQuestion> in the training datasets.
+SYNTHETIC_UNANNOTATED_THREADS_PER_ORGQUESTION = 20
+# The mean numbers of tokens in the segments of the synthetic datasets.
+SYNTHETIC_SUBJECT_LENGTH = 6
+SYNTHETIC_BODY_LENGTH = 30
+SYNTHETIC_COMMENT_LENGTH = 20
+# The fraction of the tokens of a relevant <RelQuestion> that are drawn from its <OrgQuestion>.
+SYNTHETIC_RELEVANT_OVERLAP = 0.3
+SYNTHETIC_RELEVANCE_LABELS = ("PerfectMatch", "Relevant", "Irrelevant")
+SYNTHETIC_COMMENT_LABELS = ("Good", "PotentiallyUseful", "Bad")
+
+class SyntheticCorpus(object):
+    """
+        A generator of synthetic SemEval 2016/2017 Task 3 datasets. The tokens of the datasets are
+        drawn from a vocabulary of random words with Zipf-distributed frequencies, so that the
+        term statistics resemble those of natural text. Relevant <RelQuestion>s share a fraction of
+        their tokens with their <OrgQuestion>, so that the relevance labels can be learned.
+    """
+    def __init__(self, vocabulary_size=SYNTHETIC_VOCABULARY_SIZE,
+                 zipf_exponent=SYNTHETIC_ZIPF_EXPONENT, random_state=SYNTHETIC_RANDOM_STATE):
+        """
+            Sets up a vocabulary of vocabulary_size words, where the frequency of the word with rank
+            r is proportional to 1 / r**zipf_exponent.
+        """
+        self.random = Random(random_state)
+        words = set()
+        while len(words) < vocabulary_size:
+            words.add("".join(self.random.choice(ascii_lowercase) \
+                              for _ in range(self.random.randint(2, 12))))
+        self.vocabulary = sorted(words)
+        self.random.shuffle(self.vocabulary)
+        self.cumulative_weights = list(accumulate(1 / rank**zipf_exponent \
+                                                  for rank in range(1, vocabulary_size + 1)))
+
+    def words(self, mean_length):
+        """Returns a list of random words whose length is uniform between 1 and 2 * mean_length."""
+        # Random.choices is only available in Python 3.6 and later. The words are drawn as by
+        # Random.choices with cum_weights, so that the datasets do not depend on the version.
+        total_weight = self.cumulative_weights[-1]
+        return [self.vocabulary[bisect(self.cumulative_weights, self.random.random() * total_weight,
+                                       0, len(self.vocabulary) - 1)] \
+                for _ in range(self.random.randint(1, 2 * mean_length))]
+
+    def text(self, words):
+        """
+            Returns the text of a segment. Some segments contain HTML markup and URLs, which are
+            removed by the tokenizer.
+        """
+        text = " ".join(words)
+        if self.random.random() < 0.1:
+            text = "%s <b>%s</b> http://www.example.com/%s" % (text, self.random.choice(words),
+                                                                 self.random.choice(words))
+        return escape(text)
+
+    def thread(self, thread_id, num_comments, orgquestion_words=None):
+        """
+            Returns the XML of a <Thread>. If orgquestion_words is not None, the <RelQuestion> is
+            labeled by its relevance to an <OrgQuestion> with the given words.
+        """
+        subject = self.words(SYNTHETIC_SUBJECT_LENGTH)
+        body = self.words(SYNTHETIC_BODY_LENGTH)
+        relevance = ""
+        if orgquestion_words is not None:
+            label = self.random.choice(SYNTHETIC_RELEVANCE_LABELS)
+            if label != "Irrelevant":
+                subject = [self.random.choice(orgquestion_words) \
+                           if self.random.random() < SYNTHETIC_RELEVANT_OVERLAP else word \
+                           for word in subject]
+                body = [self.random.choice(orgquestion_words) \
+                        if self.random.random() < SYNTHETIC_RELEVANT_OVERLAP else word \
+                        for word in body]
+            relevance = " RELQ_RELEVANCE2ORGQ=%s" % quoteattr(label)
+        lines = ["<Thread THREAD_SEQUENCE=%s>" % quoteattr(thread_id),
+                 "<RelQuestion RELQ_ID=%s%s>" % (quoteattr(thread_id), relevance),
+                 "<RelQSubject>%s</RelQSubject>" % self.text(subject),
+                 "<RelQBody>%s</RelQBody>" % self.text(body),
+                 "</RelQuestion>"]
+        for comment_number in range(num_comments):
+            lines.append("<RelComment RELC_ID=%s RELC_RELEVANCE2RELQ=%s>" \
+                         % (quoteattr("%s_C%d" % (thread_id, comment_number + 1)),
+                            quoteattr(self.random.choice(SYNTHETIC_COMMENT_LABELS))))
+            lines.append("<RelCText>%s</RelCText>" \
+                         % self.text(self.words(SYNTHETIC_COMMENT_LENGTH)))
+            lines.append("</RelComment>")
+        lines.append("</Thread>")
+        return "\n".join(lines)
+
+    def write_annotated_dataset(self, fname, prefix, num_orgquestions, threads_per_orgquestion,
+                                comments_per_thread):
+        """Writes a synthetic subtask B dataset with <OrgQuestion> ids starting with prefix."""
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "wt") as file:
+            file.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<root>\n")
+            for orgquestion_number in range(num_orgquestions):
+                orgquestion_id = "%s%d" % (prefix, orgquestion_number + 1)
+                subject = self.words(SYNTHETIC_SUBJECT_LENGTH)
+                body = self.words(SYNTHETIC_BODY_LENGTH)
+                # As in the SemEval datasets, every copy of an <OrgQuestion> has the same text.
+                subject_text, body_text = self.text(subject), self.text(body)
+                for thread_number in range(threads_per_orgquestion):
+                    file.write("<OrgQuestion ORGQ_ID=%s>\n" % quoteattr(orgquestion_id))
+                    file.write("<OrgQSubject>%s</OrgQSubject>\n" % subject_text)
+                    file.write("<OrgQBody>%s</OrgQBody>\n" % body_text)
+                    file.write("%s\n" % self.thread("%s_R%d" % (orgquestion_id, thread_number + 1),
+                                                    comments_per_thread,
+                                                    orgquestion_words=subject + body))
+                    file.write("</OrgQuestion>\n")
+            file.write("</root>\n")
+
+    def write_unannotated_dataset(self, fname, num_threads, comments_per_thread):
+        """
+            Writes a synthetic unannotated dataset, whose <Thread>s contain between zero and
+            2 * comments_per_thread comments.
+        """
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "wt") as file:
+            file.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<root>\n")
+            for thread_number in range(num_threads):
+                file.write("%s\n" % self.thread("U%d" % (thread_number + 1),
+                                                self.random.randint(0, 2 * comments_per_thread)))
+            file.write("</root>\n")
+
+def generate_datasets(dirname, num_orgquestions=SYNTHETIC_NUM_ORGQUESTIONS,
+                      threads_per_orgquestion=SYNTHETIC_THREADS_PER_ORGQUESTION,
+                      comments_per_thread=SYNTHETIC_COMMENTS_PER_THREAD,
+                      vocabulary_size=SYNTHETIC_VOCABULARY_SIZE,
+                      zipf_exponent=SYNTHETIC_ZIPF_EXPONENT, random_state=SYNTHETIC_RANDOM_STATE):
+    """
+        Writes synthetic training, dev, and test datasets and a synthetic unannotated dataset to the
+        paths in filenames.py relative to a directory, and creates the predictions directories.
+
+        The first training dataset contains num_orgquestions <OrgQuestion>s and the other
+        annotated datasets contain half as many. Every <OrgQuestion> has threads_per_orgquestion
+        <Thread>s with comments_per_thread comments each. The datasets are fully determined by
+        the parameters, so the same parameters always produce the same datasets.
+
+        The directory must not exist, be empty, or contain synthetic datasets generated before,
+        which are marked by SYNTHETIC_DATASETS_MARKER_FNAME. Other directories are refused, so
+        that the datasets and the statistics of a checkout are never overwritten or removed.
+    """
+    marker_fname = "%s/%s" % (dirname, SYNTHETIC_DATASETS_MARKER_FNAME)
+    if os.path.isdir(dirname) and os.listdir(dirname) and not os.path.exists(marker_fname):
+        raise ValueError("%s is neither empty nor a directory with synthetic datasets, refusing to "
+                         "overwrite its datasets" % dirname)
+    os.makedirs(dirname, exist_ok=True)
+    with open(marker_fname, "wt"):
+        pass
+    corpus = SyntheticCorpus(vocabulary_size=vocabulary_size, zipf_exponent=zipf_exponent,
+                             random_state=random_state)
+    annotated_datasets = [(SUBTASK_B_TRAIN2016_DATASET_FNAMES[0], "Q", num_orgquestions),
+                          (SUBTASK_B_TRAIN2016_DATASET_FNAMES[1], "P", num_orgquestions // 2),
+                          (DEV_DATASET_FNAME, "D", num_orgquestions // 2),
+                          (TEST2016_DATASET_FNAME, "T", num_orgquestions // 2),
+                          (TEST2017_DATASET_FNAME, "S", num_orgquestions // 2)]
+    for dataset_fname, prefix, dataset_num_orgquestions in annotated_datasets:
+        LOGGER.info("generating %s", dataset_fname)
+        corpus.write_annotated_dataset("%s/%s" % (dirname, dataset_fname), prefix,
+                                       max(1, dataset_num_orgquestions), threads_per_orgquestion,
+                                       comments_per_thread)
+    LOGGER.info("generating %s", UNANNOTATED_DATASET_FNAME)
+    corpus.write_unannotated_dataset("%s/%s" % (dirname, UNANNOTATED_DATASET_FNAME),
+                                     num_orgquestions \
+                                     * SYNTHETIC_UNANNOTATED_THREADS_PER_ORGQUESTION,
+                                     comments_per_thread)
+    for predictions_dirname in (TEST2016_PREDICTIONS_DIRNAME, TEST2017_PREDICTIONS_DIRNAME):
+        os.makedirs("%s/%s" % (dirname, predictions_dirname), exist_ok=True)
@@ -0,0 +1,222 @@
+"""
+    This module implements a work queue that distributes the evaluation of configuration strings
+    across worker processes on several machines that share a filesystem.
+"""
+
+import logging
+import os
+from random import Random
+import socket
+from threading import Event, Thread
+import time
+
+import evaluation
+from experiment import run
+from metrics import official_scores
+
+LOGGER = logging.getLogger(__name__)
+
+WORK_QUEUE_BATCH_SIZE = 10
+WORK_QUEUE_LEASE_TIMEOUT = 600.0
+WORK_QUEUE_POLL_INTERVAL = 10.0
+
+class WorkQueue(object):
+    """
+        A work queue of batches of configuration strings stored in a directory on a shared
+        filesystem. The directory contains the following files:
+
+        - year, which contains the year of the datasets that the configurations are evaluated on,
+        - batches/NNNNNN, which contain the configuration strings of batch NNNNNN,
+        - leases/NNNNNN.G, which mark that batch NNNNNN is being evaluated by a worker,
+        - results/NNNNNN.csv, which contain the comma-separated results of batch NNNNNN, and
+        - failures/NNNNNN.csv, which contain the configuration strings of batch NNNNNN whose
+          evaluation has failed together with the errors.
+
+        A worker claims a batch by exclusively creating a lease file and keeps the lease alive by
+        regularly updating its modification time. When a worker crashes, its lease expires after
+        lease_timeout seconds and another worker claims the batch by exclusively creating a lease
+        file with the next generation number G. Since exclusive file creation is atomic, exactly
+        one worker claims each generation of a batch. Since the results of a batch are written
+        atomically, a batch is either finished or it is evaluated again. A configuration whose
+        evaluation fails is recorded as a failure and the batch is still finished, so that only
+        crashed workers cause a batch to be evaluated again.
+    """
+    def __init__(self, dirname, lease_timeout=WORK_QUEUE_LEASE_TIMEOUT):
+        """Sets up a work queue stored in a directory named dirname."""
+        self.dirname = dirname
+        self.batches_dirname = "%s/batches" % dirname
+        self.leases_dirname = "%s/leases" % dirname
+        self.results_dirname = "%s/results" % dirname
+        self.failures_dirname = "%s/failures" % dirname
+        self.lease_timeout = lease_timeout
+
+    def submit(self, year, configs, batch_size=WORK_QUEUE_BATCH_SIZE):
+        """
+            Submits configuration strings that are to be evaluated on the datasets of a year.
+            Configuration strings that have already been submitted are skipped.
+        """
+        for dirname in (self.batches_dirname, self.leases_dirname, self.results_dirname,
+                        self.failures_dirname):
+            os.makedirs(dirname, exist_ok=True)
+        try:
+            with open("%s/year" % self.dirname, "rt") as file:
+                assert file.read().strip() == year
+        except IOError:
+            self._write_atomically("%s/year" % self.dirname, "%s\n" % year)
+        submitted_configs = set(config for batch in self.batches() \
+                                for config in self.configs(batch))
+        configs = [config for config in configs if config not in submitted_configs]
+        first_batch = len(self.batches())
+        for batch_number, batch_start in enumerate(range(0, len(configs), batch_size)):
+            batch = "%06d" % (first_batch + batch_number)
+            batch_configs = configs[batch_start:batch_start+batch_size]
+            self._write_atomically("%s/%s" % (self.batches_dirname, batch),
+                                   "".join("%s\n" % config for config in batch_configs))
+        LOGGER.info("submitted %d configurations", len(configs))
+
+    def year(self):
+        """Returns the year of the datasets that the configurations are evaluated on."""
+        with open("%s/year" % self.dirname, "rt") as file:
+            return file.read().strip()
+
+    def batches(self):
+        """Returns the names of all batches."""
+        return sorted(fname for fname in os.listdir(self.batches_dirname) \
+                      if not fname.endswith(".tmp"))
+
+    def finished(self, batch):
+        """Returns whether the results of a batch are available."""
+        return os.path.exists("%s/%s.csv" % (self.results_dirname, batch))
+
+    def claim(self, batch, worker_id):
+        """
+            Tries to claim a batch for a worker and returns the name of the lease file, or None if
+            the batch is leased by another worker.
+        """
+        generations = [int(fname.split(".")[1]) for fname in os.listdir(self.leases_dirname) \
+                       if fname.split(".")[0] == batch]
+        if generations:
+            generation = max(generations)
+            lease_fname = "%s/%s.%d" % (self.leases_dirname, batch, generation)
+            try:
+                if time.time() - os.stat(lease_fname).st_mtime < self.lease_timeout:
+                    return None
+            except FileNotFoundError:
+                return None
+            LOGGER.warning("lease %s has expired", lease_fname)
+            generation += 1
+        else:
+            generation = 0
+        lease_fname = "%s/%s.%d" % (self.leases_dirname, batch, generation)
+        try:
+            file_descriptor = os.open(lease_fname, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(file_descriptor, "wt") as file:
+            file.write("%s\n" % worker_id)
+        return lease_fname
+
+    def configs(self, batch):
+        """Returns the configuration strings of a batch."""
+        with open("%s/%s" % (self.batches_dirname, batch), "rt") as file:
+            return [line.strip() for line in file if line.strip()]
+
+    def finish(self, batch, results, failures=()):
+        """
+            Stores the comma-separated results of a batch and the comma-separated configuration
+            strings and errors of its failed configurations. The failures are stored first, so
+            that they are available once the batch is finished.
+        """
+        if failures:
+            os.makedirs(self.failures_dirname, exist_ok=True)
+            self._write_atomically("%s/%s.csv" % (self.failures_dirname, batch),
+                                   "".join("%s\n" % failure for failure in failures))
+        self._write_atomically("%s/%s.csv" % (self.results_dirname, batch),
+                               "".join("%s\n" % result for result in results))
+
+    def results(self):
+        """Produces the comma-separated results of all finished batches."""
+        for batch in self.batches():
+            if self.finished(batch):
+                with open("%s/%s.csv" % (self.results_dirname, batch), "rt") as file:
+                    for line in file:
+                        yield line.strip()
+
+    def failures(self):
+        """Produces the comma-separated configuration strings and errors of all failures."""
+        for batch in self.batches():
+            if self.finished(batch):
+                try:
+                    with open("%s/%s.csv" % (self.failures_dirname, batch), "rt") as file:
+                        for line in file:
+                            yield line.strip()
+                except FileNotFoundError:
+                    pass # The batch has no failures.
+
+    @staticmethod
+    def _write_atomically(fname, content):
+        """Writes content to a file, so that other processes never see a partially written file."""
+        temporary_fname = "%s.%s.%d.tmp" % (fname, socket.gethostname(), os.getpid())
+        with open(temporary_fname, "wt") as file:
+            file.write(content)
+        os.replace(temporary_fname, fname)
+
+def _keep_alive(lease_fname, interval, stopped):
+    """Updates the modification time of a lease file every interval seconds until stopped."""
+    while not stopped.wait(interval):
+        try:
+            os.utime(lease_fname)
+        except OSError:
+            LOGGER.warning("failed to renew lease %s", lease_fname)
+
+def work(queue, poll_interval=WORK_QUEUE_POLL_INTERVAL):
+    """
+        Evaluates batches of configuration strings from a work queue until all batches are
+        finished. When all unfinished batches are leased by other workers, the worker waits for
+        them to finish or for their leases to expire.
+
+        The worker keeps the parsed datasets and the language model statistics in memory, so that
+        they are loaded only once rather than once per configuration.
+    """
+    evaluation.CACHE_DOCUMENT_PAIRS = True
+    worker_id = "%s:%d" % (socket.gethostname(), os.getpid())
+    year = queue.year()
+    random = Random(worker_id)
+    while True:
+        unfinished_batches = [batch for batch in queue.batches() if not queue.finished(batch)]
+        if not unfinished_batches:
+            break
+        # Visit the batches in a random order to reduce contention between workers.
+        random.shuffle(unfinished_batches)
+        for batch in unfinished_batches:
+            lease_fname = queue.claim(batch, worker_id)
+            if lease_fname is not None:
+                break
+        else:
+            time.sleep(poll_interval)
+            continue
+        LOGGER.info("worker %s claimed batch %s", worker_id, batch)
+        stopped = Event()
+        keep_alive = Thread(target=_keep_alive,
+                            args=(lease_fname, queue.lease_timeout / 4, stopped), daemon=True)
+        keep_alive.start()
+        try:
+            results, failures = [], []
+            for config in queue.configs(batch):
+                # A configuration that fails deterministically would fail for every worker, so the
+                # failure is recorded rather than left to the expiry of the lease.
+                try:
+                    test_dirname, gold_base_fname, base_output_fname = run(config, year)
+                    scores = official_scores(test_dirname, gold_base_fname, base_output_fname)
+                except Exception as error:
+                    LOGGER.exception("worker %s failed to evaluate %s", worker_id, config)
+                    # The error is stored on a single line of the failures file.
+                    message = " ".join(("%s: %s" % (type(error).__name__, error)).split())
+                    failures.append("%s,%s" % (config, message.rstrip(":")))
+                    continue
+                results.append("%s,%s" % (config, scores))
+            queue.finish(batch, results, failures)
+        finally:
+            stopped.set()
+            keep_alive.join()
+        LOGGER.info("worker %s finished batch %s", worker_id, batch)